@@ -23,6 +23,7 @@ CREATE TABLE IF NOT EXISTS "Deck" (
   "QUALIFIER" varchar(255) DEFAULT '',
   "RECORD" varchar(255) DEFAULT NULL,
   "POINTS" int(11) DEFAULT NULL,
+  "PLAYER_KEY" varchar(255) DEFAULT NULL,
   FOREIGN KEY ("T_ID") REFERENCES Tournament("T_ID") ON DELETE CASCADE
 );
 CREATE TABLE IF NOT EXISTS "Matches" (
@@ -59,12 +60,42 @@ CREATE TABLE IF NOT EXISTS "Card" (
   "LIFECHANGE" varchar(8) DEFAULT NULL,
   PRIMARY KEY ("CARD_NAME")
 );
+CREATE TABLE IF NOT EXISTS "ArchetypeTotals" (
+  "T_ID" int(64) NOT NULL,
+  "DECK_NAME" varchar(255) DEFAULT NULL,
+  "QUALIFIER" varchar(255) DEFAULT NULL,
+  "DECKS" int(11) NOT NULL DEFAULT '0',
+  "MATCH_WIN" int(11) NOT NULL DEFAULT '0',
+  "MATCH_LOSS" int(11) NOT NULL DEFAULT '0',
+  "MATCH_DRAW" int(11) NOT NULL DEFAULT '0',
+  "TOP8" int(11) NOT NULL DEFAULT '0',
+  "TOP16" int(11) NOT NULL DEFAULT '0',
+  FOREIGN KEY ("T_ID") REFERENCES Tournament("T_ID") ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS "MatchupCube" (
+  "FORMAT" varchar(255) DEFAULT NULL,
+  "SOURCE" varchar(255) DEFAULT NULL,
+  "WEEK" date NOT NULL,
+  "DECK_NAME" varchar(255) DEFAULT NULL,
+  "QUALIFIER" varchar(255) DEFAULT NULL,
+  "DECK_NAME_2" varchar(255) DEFAULT NULL,
+  "QUALIFIER_2" varchar(255) DEFAULT NULL,
+  "MATCH_WIN" int(11) NOT NULL DEFAULT '0',
+  "MATCH_LOSS" int(11) NOT NULL DEFAULT '0',
+  "MATCH_DRAW" int(11) NOT NULL DEFAULT '0',
+  "CUM_WIN" int(11) NOT NULL DEFAULT '0',
+  "CUM_LOSS" int(11) NOT NULL DEFAULT '0',
+  "CUM_DRAW" int(11) NOT NULL DEFAULT '0'
+);
 CREATE INDEX "Deck_t_id" ON "Deck" ("T_ID");
 CREATE INDEX "Deck_playerIndex" ON "Deck" ("PLAYER_NAME");
+CREATE INDEX "Deck_playerKey" ON "Deck" ("PLAYER_KEY");
 CREATE INDEX "Deck_archetypeIndex" ON "Deck" ("DECK_NAME");
 CREATE INDEX "Deck_subarchetype" ON "Deck" ("QUALIFIER");
 CREATE INDEX "Matches_t_id" ON "Matches" ("T_ID");
 CREATE INDEX "Matches_deck_id" ON "Matches" ("DECK_1");
+CREATE INDEX "ix_ArchetypeTotals_T_ID" ON "ArchetypeTotals" ("T_ID");
+CREATE INDEX "MatchupCube_week" ON "MatchupCube" ("FORMAT", "WEEK");
 CREATE VIEW `deck1Match` AS
     select
         `Matches`.`MATCH_ID` AS `MATCH_ID`,
@@ -1,38 +1,108 @@
 #!/usr/bin/env python
 
 import matplotlib.pyplot as plt
+import numpy
 import pandas
 import seaborn as sns
 import sys
 
-def read_sample_file(filename):
-    i = 0
-    lastcomment = 0
-    beforedata = 0
-    ncomments = 0
-    commentblocksize = 0
-    nblocks = 0
+CHUNK_SIZE = 10000
+
+def _parse_config(line, config):
+    """Record 'key = value' settings from Stan's header comments."""
+    if '=' in line:
+        key, value = line.lstrip('#').split('=', 1)
+        key = key.strip()
+        if key in ('num_warmup', 'save_warmup', 'thin'):
+            try:
+                config[key] = int(value.split()[0])
+            except (ValueError, IndexError):
+                pass
+
+def read_sample_file(filename, prefixes=('pdeck.', 'pwin_deck.'), thin=1,
+        chunksize=CHUNK_SIZE):
+    """Read one Stan sample CSV in a single pass, keeping only columns that
+    start with one of the given prefixes, dropping warmup draws, and keeping
+    every 'thin'th draw after that. Rows are parsed in chunks, so memory use
+    depends only on what is kept.
+
+    The number of warmup draws is taken from the num_warmup, save_warmup, and
+    thin settings in the header comments. If those are missing, draws before
+    the "Adaptation terminated" comment block are treated as warmup (and if
+    there is no such block, none of the draws are).
+
+    Returns (column names, 2D array of draws)."""
+    config = {}
+    header = None
+    columns = None
+    warmup = None
+    kept = []
+    pending = []  # Draws which may turn out to be warmup
+    lines = []
+    index = 0
+    def parse(lines):
+        if not lines:
+            return numpy.empty((0, len(columns)))
+        return numpy.loadtxt(lines, delimiter=',', usecols=columns, ndmin=2)
+    def flush():
+        nonlocal lines, index
+        chunk = parse(lines)
+        lines = []
+        if warmup is None:
+            pending.append(chunk)
+            return
+        # Row numbers of this chunk counted from the first post-warmup draw
+        rows = numpy.arange(index, index + len(chunk)) - warmup
+        index += len(chunk)
+        keep = (rows >= 0) & (rows % thin == 0)
+        kept.append(chunk[keep])
     with open(filename) as text:
         for line in text:
-            i += 1
             if line.startswith('#'):
-                commentblocksize += 1
-                lastcomment = i
-            elif commentblocksize > 0:
-                ncomments += commentblocksize
-                beforedata = lastcomment
-                commentblocksize = 0
-                nblocks += 1
-    df = pandas.read_csv(filename, comment='#', header=0)
-    if nblocks > 1:
-        skiplines = beforedata - ncomments - 1
-    else:
-        skiplines = beforedata
-    return df[skiplines:]
+                if header is None:
+                    _parse_config(line, config)
+                elif warmup is None and 'Adaptation terminated' in line:
+                    # Everything before this was warmup
+                    lines = []
+                    pending.clear()
+                    warmup = 0
+                continue
+            if header is None:
+                header = [ name.strip() for name in line.split(',') ]
+                columns = [ i for i, name in enumerate(header)
+                    if name.startswith(tuple(prefixes)) ]
+                if config.get('save_warmup') == 0:
+                    warmup = 0
+                elif 'num_warmup' in config and 'save_warmup' in config:
+                    warmup = -(-config['num_warmup'] // config.get('thin', 1))
+                continue
+            if not line.strip():
+                continue
+            lines.append(line)
+            if len(lines) >= chunksize:
+                flush()
+    if header is None:
+        raise Exception("No header found in {}".format(filename))
+    flush()
+    if pending:
+        # No adaptation block: none of the draws were warmup
+        draws = numpy.concatenate(pending)
+        kept.append(draws[::thin])
+    names = [ header[i] for i in columns ]
+    return names, numpy.concatenate(kept) if kept else numpy.empty((0, len(names)))
 
-def read_sample_files(filenames):
-    frames = [read_sample_file(f) for f in filenames]
-    return pandas.concat(frames)
+def read_sample_files(filenames, prefixes=('pdeck.', 'pwin_deck.'), thin=1):
+    """Read the requested columns of several chains into one DataFrame."""
+    names = None
+    arrays = []
+    for f in filenames:
+        file_names, draws = read_sample_file(f, prefixes, thin)
+        if names is None:
+            names = file_names
+        elif file_names != names:
+            raise Exception("Columns in {} don't match the other sample files".format(f))
+        arrays.append(draws)
+    return pandas.DataFrame(numpy.concatenate(arrays), columns=names)
 
 def read_archetypes(filename):
     archetypes = []
@@ -63,12 +133,18 @@ def plot_bivariate(df, xvars, yvars, xlim=(0,.2), ylim=(0.4,0.6)):
     g.ax_joint.axhline(0.5, linestyle='-', color='black', linewidth=0.5)
     return g
 
-title = sys.argv[1]
-archetype_file = sys.argv[2]
-sample_files = sys.argv[3:]
+args = sys.argv[1:]
+thin = 1
+if '--thin' in args:
+    i = args.index('--thin')
+    thin = int(args[i+1])
+    del args[i:i+2]
+title = args[0]
+archetype_file = args[1]
+sample_files = args[2:]
 reverse=False
 
-df = read_sample_files(sample_files)
+df = read_sample_files(sample_files, thin=thin)
 archetypes = read_archetypes(archetype_file)
 print(archetypes)
 
@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 
 import csv
-import pystan
 import matplotlib.pyplot as plt
 from sys import argv
 
+from league_model import LeagueModel
+from stancache import cached_model, load_init, save_means
+
+PARS = ['pdeck', 'matchups', 'wait_time']
+
 def consolidate(data, n):
     transformed = {}
     transformed['n_archetypes'] = n+1
@@ -28,12 +32,36 @@ def consolidate(data, n):
     return transformed
 
 def run_inference(data, iterations, warmup, chains, init='random',
-        sample_file=None):
-    sm = pystan.StanModel(file="models/league.stan")
-    fit = sm.sampling(data=data,
-            iter=iterations, warmup=warmup, chains=chains,
-            n_jobs=-1,
-            sample_file=sample_file, init=init)
+        sample_file=None, backend='native'):
+    """Fit the league model. The native backend (league_model.py) finds the
+    posterior mode and draws (iterations-warmup)*chains samples from a Laplace
+    approximation; backend='stan' samples models/league.stan with pystan, if
+    it's installed, compiling it only if the source has changed.
+
+    init: 'random', a dict of parameter values, or the filename of a previous
+        run's means (JSON) or sample file (CSV) to warm start from."""
+    if isinstance(init, str) and init != 'random':
+        init = load_init(init, PARS)
+    if isinstance(init, dict) and len(init.get('pdeck', [])) != data['n_archetypes']:
+        print("Initial values don't match the selected archetypes; using random inits")
+        init = 'random'
+    if backend == 'stan':
+        sm = cached_model("models/league.stan")
+        if isinstance(init, dict):
+            init = [ dict(init) for i in range(chains) ]
+        fit = sm.sampling(data=data,
+                iter=iterations, warmup=warmup, chains=chains,
+                n_jobs=-1,
+                sample_file=sample_file, init=init)
+        print(fit)
+        return fit
+    model = LeagueModel(data)
+    start = None
+    if isinstance(init, dict):
+        start = model.unconstrain(init)
+    fit = model.sample((iterations - warmup) * chains, init=start)
+    if sample_file:
+        fit.write_sample_file(sample_file)
     print(fit)
     return fit
 
@@ -115,6 +143,18 @@ def save_names(archetype_list, filename):
             outfile.write("\n")
 
 if __name__ == "__main__":
+    backend = 'native'
+    if '--stan' in argv:
+        argv.remove('--stan')
+        backend = 'stan'
+    # --init FILE: warm start from a previous run's means (.json) or samples (.csv)
+    # --save-means FILE: save this run's posterior means for a later warm start
+    options = {}
+    for option in ('--init', '--save-means'):
+        if option in argv:
+            i = argv.index(option)
+            options[option] = argv[i+1]
+            del argv[i:i+2]
     pairings_file = argv[1]
     selected_decks = argv[2]
     n_chains = int(argv[3])
@@ -133,8 +173,13 @@ if __name__ == "__main__":
     print("\t({} sampling iterations)".format(n_iterations))
     if sample_output:
         print("\t(recording samples at {})".format(sample_output))
+    if '--init' in options:
+        print("\t(warm start from {})".format(options['--init']))
     fit = run_inference(data, n_iterations+n_warmup, n_warmup, n_chains,
-            sample_file=sample_output)
+            sample_file=sample_output, backend=backend,
+            init=options.get('--init', 'random'))
+    if '--save-means' in options:
+        save_means(fit, options['--save-means'], PARS)
     fit.plot(pars=['pdeck', 'matchups', 'pwin_deck', 'wait_time'])
 #    fit.plot(pars=['pdeck', 'matchups', 'pwin_deck'])
     plt.show()
@@ -0,0 +1,311 @@
+"""Native NumPy implementation of the league model in models/league.stan.
+
+The log density mirrors the Stan program (same parameters, priors, and
+likelihood), evaluated for a whole batch of parameter vectors at once.
+Gradients are computed by the complex-step method: the model is evaluated at
+every parameter plus a tiny imaginary perturbation in one batched call, which
+gives derivatives accurate to machine precision without a compiler or an
+autodiff library. Inference finds the posterior mode with L-BFGS and draws
+samples from a Laplace (normal) approximation around it.
+
+Parameters are handled on Stan's unconstrained scale: pdeck through an
+additive log-ratio transform, matchups through the logit, and wait_time
+through the log, with the Jacobian included in the log density.
+"""
+
+import numpy
+from scipy.optimize import minimize
+from scipy.special import gammaln
+
+COMPLEX_STEP = 1e-20
+MAX_ITERATIONS = 100
+EPSILON = 1e-10
+
+def r_index(w, l):
+    """Convert a (win, loss) record into its (zero-based) index."""
+    k = w + l
+    return (k * (k+1) // 2) + l
+
+class LeagueModel(object):
+    """The league pairing/record model for one data set (the same dict that
+    would be passed to Stan)."""
+
+    def __init__(self, data):
+        self.n_decks = K = int(data['n_archetypes'])
+        self.n_rounds = R = int(data['n_rounds'])
+        self.n_scores = NS = 2*R + 1
+        self.n_records = NR = ((R+1) * (R+2)) // 2
+        self.n_matchups = K * (K-1) // 2
+        self.n_params = (K-1) + self.n_matchups + 1
+        self.pairings = numpy.array(data['pairings'], dtype=float).reshape(NS, K)
+        self.paired_scores = numpy.array(data['paired_scores'], dtype=float).reshape(NS, NS)
+        self.decks = numpy.array(data['decks'], dtype=float).reshape(NR, K)
+        # Prior probability of each record, and record <-> score matrices
+        PR = numpy.zeros(NR)
+        B = numpy.zeros((NS, NR))
+        for w in range(R+1):
+            for l in range(R+1-w):
+                n = w + l
+                r = r_index(w, l)
+                PR[r] = numpy.exp(gammaln(n+1) - gammaln(w+1) - gammaln(l+1)) * .5**n / (R + 1.0)
+                B[w-l+R, r] = 1.0
+        U = (B * PR).T
+        U = U / U.sum(axis=0)
+        self.PR, self.B, self.U = PR, B, U
+        score_prior = B @ PR
+        # Score pairing components: for each tolerance delta, the opponent's
+        # score distribution given a match is found, and the total prior mass
+        # of scores within the window
+        self.S_k = numpy.zeros((NS, NS, NS))
+        self.window_mass = numpy.zeros((NS, NS))
+        for delta in range(NS):
+            for i in range(NS):
+                lo, hi = max(0, i-delta), min(NS, i+delta+1)
+                total = score_prior[lo:hi].sum()
+                self.S_k[delta, lo:hi, i] = score_prior[lo:hi] / total
+                self.window_mass[i, delta] = total
+        # Record transitions after a win or a loss
+        T_win = numpy.zeros((NR, NR))
+        T_lose = numpy.zeros((NR, NR))
+        for w in range(R+1):
+            for l in range(R+1-w):
+                r = r_index(w, l)
+                if w + l == R:
+                    T_win[r, 0] = 1.0
+                    T_lose[r, 0] = 1.0
+                else:
+                    T_win[r, r_index(w+1, l)] = 1.0
+                    T_lose[r, r_index(w, l+1)] = 1.0
+        self.T_win, self.T_lose = T_win, T_lose
+        # Index of each matchup parameter in the matchup matrix (Stan order)
+        self.upper = ([], [])
+        for j in range(K):
+            for i in range(j):
+                self.upper[0].append(i)
+                self.upper[1].append(j)
+        self.upper = (numpy.array(self.upper[0], dtype=int), numpy.array(self.upper[1], dtype=int))
+
+    # Parameter transforms
+
+    def constrain(self, theta):
+        """Map unconstrained parameter vectors (..., n_params) to a dict of
+        (pdeck, matchups, wait_time) arrays and the log Jacobian."""
+        K = self.n_decks
+        y = theta[..., :K-1]
+        z = theta[..., K-1:K-1+self.n_matchups]
+        u = theta[..., -1]
+        y = numpy.concatenate([y, numpy.zeros(y.shape[:-1] + (1,), dtype=y.dtype)], axis=-1)
+        y = y - y.real.max(axis=-1, keepdims=True)
+        ey = numpy.exp(y)
+        pdeck = ey / ey.sum(axis=-1, keepdims=True)
+        matchups = 1 / (1 + numpy.exp(-z))
+        wait_time = numpy.exp(u)
+        log_jacobian = (numpy.log(pdeck).sum(axis=-1)
+                + (numpy.log(matchups) + numpy.log(1 - matchups)).sum(axis=-1) + u)
+        return { 'pdeck': pdeck, 'matchups': matchups, 'wait_time': wait_time }, log_jacobian
+
+    def unconstrain(self, pars):
+        """Map constrained parameters to an unconstrained vector."""
+        pdeck = numpy.asarray(pars['pdeck'], dtype=float)
+        matchups = numpy.asarray(pars['matchups'], dtype=float)
+        wait_time = max(float(pars['wait_time']), 1e-300)
+        pdeck = numpy.maximum(pdeck, 1e-300)
+        y = numpy.log(pdeck[:-1]) - numpy.log(pdeck[-1])
+        z = numpy.log(matchups) - numpy.log(1 - matchups)
+        return numpy.concatenate([y, z, [numpy.log(wait_time)]])
+
+    # Model components (batched over the leading axis)
+
+    def matchup_matrix(self, matchups):
+        P = matchups.shape[0]
+        K = self.n_decks
+        M = numpy.full((P, K, K), .5, dtype=matchups.dtype)
+        i, j = self.upper
+        M[:, i, j] = matchups
+        M[:, j, i] = 1 - matchups
+        return M
+
+    def score_matrix(self, wait_time):
+        """score_matrix_full from the Stan model."""
+        P = wait_time.shape[0]
+        NS = self.n_scores
+        p_success = 1 - numpy.exp(-self.window_mass[None, :, :] / wait_time[:, None, None])
+        S = numpy.zeros((P, NS, NS), dtype=wait_time.dtype)
+        for delta in range(NS):
+            p_unpaired = 1.0 - S.sum(axis=1)
+            p_find = p_unpaired * p_success[:, :, delta]
+            S = S + self.S_k[delta][None, :, :] * p_find[:, None, :]
+        total = S.sum(axis=1, keepdims=True)
+        rescale = (total.real != 0) & (total.real != 1)
+        return numpy.where(rescale, S / numpy.where(rescale, total, 1), S)
+
+    def deck_record_matrix(self, pdeck, M, S):
+        """deck_record_matrix from the Stan model: P(deck | record), found by
+        fixed-point iteration."""
+        Q = (self.U @ S @ self.B) * self.PR
+        F = numpy.repeat(pdeck[:, :, None], self.n_records, axis=2)
+        MT = numpy.swapaxes(M, 1, 2)
+        for i in range(MAX_ITERATIONS):
+            A = F @ Q
+            F_next = (F * (M @ A)) @ self.T_win + (F * (MT @ A)) @ self.T_lose
+            total = F_next.sum(axis=1, keepdims=True)
+            F_norm = numpy.where(total.real > 0, F_next / numpy.where(total.real > 0, total, 1), F)
+            diff = numpy.abs((F_norm - F).real).sum(axis=(1, 2))
+            F = F_norm
+            if (diff <= EPSILON).all():
+                break
+        return F
+
+    def transformed(self, pars):
+        M = self.matchup_matrix(pars['matchups'])
+        S = self.score_matrix(pars['wait_time'])
+        F = self.deck_record_matrix(pars['pdeck'], M, S)
+        pdeck_score = F @ self.U @ S
+        return M, S, F, pdeck_score
+
+    def log_prob(self, theta, jacobian=True):
+        """Log density (up to a constant) at a batch of unconstrained
+        parameter vectors (P, n_params), real or complex."""
+        theta = numpy.atleast_2d(theta)
+        pars, log_jacobian = self.constrain(theta)
+        M, S, F, pdeck_score = self.transformed(pars)
+        def multinomial(counts, p):
+            # counts: (n, k); p: (P, k, n) with distributions in columns
+            mask = counts.T > 0
+            logp = numpy.log(numpy.where(mask, p, 1))
+            return (numpy.where(mask, logp, 0) * counts.T).sum(axis=(1, 2))
+        matchups = pars['matchups']
+        lp = (10 * numpy.log(matchups) + 10 * numpy.log(1 - matchups)).sum(axis=-1)
+        lp = lp + multinomial(self.pairings, pdeck_score)
+        lp = lp + multinomial(self.paired_scores, S)
+        lp = lp + multinomial(self.decks, F)
+        lp = lp - 2 * pars['wait_time']
+        if jacobian:
+            lp = lp + log_jacobian
+        return lp
+
+    def log_prob_grad(self, theta, jacobian=True):
+        """Log density and its gradient at one unconstrained parameter
+        vector, via the complex step (one batched evaluation)."""
+        theta = numpy.asarray(theta, dtype=float)
+        n = len(theta)
+        batch = numpy.empty((n+1, n), dtype=complex)
+        batch[:] = theta
+        batch[1:] += 1j * COMPLEX_STEP * numpy.eye(n)
+        lp = self.log_prob(batch, jacobian)
+        return lp[0].real, lp[1:].imag / COMPLEX_STEP
+
+    def hessian(self, theta, step=1e-5):
+        """Hessian of the log density by central differences of the gradient."""
+        n = len(theta)
+        H = numpy.empty((n, n))
+        for k in range(n):
+            e = numpy.zeros(n)
+            e[k] = step
+            H[:, k] = (self.log_prob_grad(theta + e)[1] - self.log_prob_grad(theta - e)[1]) / (2*step)
+        return (H + H.T) / 2
+
+    def generated(self, pars):
+        """pwin_deck from the Stan model's generated quantities."""
+        M = self.matchup_matrix(pars['matchups'])
+        return (M @ pars['pdeck'][:, :, None])[:, :, 0]
+
+    # Inference
+
+    def initial(self, rng):
+        """Random inits on (-2, 2), as Stan does."""
+        return rng.uniform(-2, 2, self.n_params)
+
+    def optimize(self, init=None, seed=None):
+        """Find the posterior mode on the unconstrained scale."""
+        rng = numpy.random.default_rng(seed)
+        theta0 = self.initial(rng) if init is None else numpy.asarray(init, dtype=float)
+        def objective(theta):
+            lp, grad = self.log_prob_grad(theta)
+            return -lp, -grad
+        result = minimize(objective, theta0, jac=True, method='L-BFGS-B')
+        return result.x, -result.fun
+
+    def sample(self, draws, init=None, seed=None):
+        """Posterior mode plus draws from the Laplace approximation around
+        it. Returns a LeagueFit."""
+        rng = numpy.random.default_rng(seed)
+        mode, lp = self.optimize(init=init, seed=rng)
+        H = self.hessian(mode)
+        # Covariance from the negative Hessian, clipping any non-positive
+        # curvature so that the approximation is always proper
+        values, vectors = numpy.linalg.eigh(-H)
+        values = numpy.maximum(values, 1e-8)
+        cov = (vectors / values) @ vectors.T
+        theta = rng.multivariate_normal(mode, cov, size=draws)
+        return LeagueFit(self, mode, cov, theta)
+
+class LeagueFit(object):
+    """Draws from a fitted LeagueModel, with a few of the conveniences of a
+    pystan fit object."""
+
+    def __init__(self, model, mode, cov, theta):
+        self.model = model
+        self.mode = mode
+        self.cov = cov
+        self.theta = theta
+        self.lp = model.log_prob(theta)
+        pars, _ = model.constrain(theta)
+        self.samples = dict(pars)
+        self.samples['pwin_deck'] = model.generated(pars)
+
+    def extract(self):
+        return dict(self.samples)
+
+    def unconstrain_pars(self, pars):
+        return self.model.unconstrain(pars)
+
+    def log_prob(self, upar, adjust_transform=True):
+        return float(self.model.log_prob(upar, adjust_transform)[0])
+
+    def columns(self):
+        """Flattened (name, values) columns, named as in Stan sample files."""
+        columns = [ ('lp__', self.lp) ]
+        for name in ('pdeck', 'matchups', 'wait_time', 'pwin_deck'):
+            values = self.samples[name]
+            if values.ndim == 1:
+                columns.append((name, values))
+            else:
+                for i in range(values.shape[1]):
+                    columns.append((f'{name}.{i+1}', values[:, i]))
+        return columns
+
+    def write_sample_file(self, filename):
+        """Write the draws as a Stan-style CSV, readable by contour.py."""
+        columns = self.columns()
+        with open(filename, 'w') as outfile:
+            outfile.write("# Laplace approximation at the posterior mode (league_model.py)\n")
+            outfile.write(f"# num_samples = {len(self.theta)}\n")
+            outfile.write("# num_warmup = 0\n")
+            outfile.write("# save_warmup = 0\n")
+            outfile.write("# thin = 1\n")
+            outfile.write(','.join(name for name, values in columns) + "\n")
+            outfile.write("# Adaptation terminated\n")
+            for row in zip(*[ values for name, values in columns ]):
+                outfile.write(','.join(repr(float(x)) for x in row) + "\n")
+
+    def __str__(self):
+        lines = [ f"Laplace approximation, {len(self.theta)} draws",
+                "{:<14} {:>8} {:>8} {:>8} {:>8}".format('', 'mean', 'sd', '2.5%', '97.5%') ]
+        for name, values in self.columns():
+            lo, hi = numpy.percentile(values, [2.5, 97.5])
+            lines.append("{:<14} {:>8.4f} {:>8.4f} {:>8.4f} {:>8.4f}".format(
+                name, values.mean(), values.std(), lo, hi))
+        return "\n".join(lines)
+
+    def plot(self, pars):
+        import matplotlib.pyplot as plt
+        fig, axes = plt.subplots(len(pars), 1, squeeze=False)
+        for ax, name in zip(axes[:, 0], pars):
+            values = self.samples[name]
+            if values.ndim == 1:
+                values = values[:, None]
+            for i in range(values.shape[1]):
+                ax.hist(values[:, i], bins=50, histtype='step')
+            ax.set_title(name)
+        return fig
@@ -1,181 +1,191 @@
 #!/usr/bin/env python
+"""Generate synthetic league data with known parameters, and check that
+inference recovers them.
+
+The simulated league keeps the number of players with each (record, deck) in a
+NumPy array, and plays matches in batches: players are drawn from the pool
+without replacement, opponents' scores are sampled from alias tables, and all
+results are applied at once."""
 
 import matplotlib.pyplot as plt
-from random import Random
+import numpy
 from sys import argv
 
 import league
+from league_model import r_index
+
+rng = numpy.random.default_rng()
+
+class AliasTable(object):
+    """Walker alias tables for sampling from several fixed discrete
+    distributions (one per row) in O(1) per draw."""
+
+    def __init__(self, probabilities):
+        p = numpy.asarray(probabilities, dtype=float)
+        p = p / p.sum(axis=1, keepdims=True)
+        rows, n = p.shape
+        self.prob = numpy.ones((rows, n))
+        self.alias = numpy.tile(numpy.arange(n), (rows, 1))
+        for row in range(rows):
+            scaled = p[row] * n
+            small = [ i for i in range(n) if scaled[i] < 1 ]
+            large = [ i for i in range(n) if scaled[i] >= 1 ]
+            while small and large:
+                i = small.pop()
+                j = large.pop()
+                self.prob[row, i] = scaled[i]
+                self.alias[row, i] = j
+                scaled[j] -= 1 - scaled[i]
+                (small if scaled[j] < 1 else large).append(j)
 
-rand = Random()
-match_wins = {}
+    def sample(self, rows):
+        """Draw one value from the distribution in each of the given rows."""
+        rows = numpy.asarray(rows)
+        i = rng.integers(0, self.prob.shape[1], size=rows.shape)
+        accept = rng.random(rows.shape) < self.prob[rows, i]
+        return numpy.where(accept, i, self.alias[rows, i])
 
 class League(object):
     def __init__(self, field_distribution, matchups, score_distribution):
-        self.matchups = matchups
-        self.max_rounds = max(score_distribution.keys())
-        self.field = {}
-        self.field_distribution = field_distribution
-        self.decks = range(len(field_distribution))
+        """field_distribution: Probability of each deck.
+        matchups: matchups[d1][d2] is the probability that d1 beats d2.
+        score_distribution: score_distribution[s1][s2] is the probability
+            that a player with score s1 is paired against score s2."""
+        self.max_rounds = R = max(score_distribution.keys())
+        self.field_distribution = numpy.asarray(field_distribution, dtype=float)
+        self.field_distribution /= self.field_distribution.sum()
+        K = len(field_distribution)
+        self.decks = range(K)
+        self.matchups = numpy.array([ [ matchups[d1][d2] for d2 in self.decks ]
+            for d1 in self.decks ], dtype=float)
+        self.scores = [ i - R for i in range(2*R + 1) ]
+        self.records = [ (n-l, l) for n in range(R+1) for l in range(n+1) ]
         self.n = 0
-        self.score_counts = {}
-        self.scores = []
-        self.score_distribution = score_distribution
-        self.records = []
-        self.field_record = {}
-        self.record_counts = {}
-        self.pairings = {}
-        for i in range(2*self.max_rounds + 1):
-            score = i - self.max_rounds
-            self.scores.append(score)
-            self.field[score] = {deck: 0 for deck in self.decks}
-            self.score_counts[score] = 0
-        for s1 in self.scores:
-            self.pairings[s1] = {s2: 0 for s2 in self.scores}
-        for n in range(self.max_rounds+1):
-            for l in range(n+1):
-                r = (n-l, l)
-                self.records.append(r)
-                self.field_record[r] = {deck: 0 for deck in self.decks}
-                self.record_counts[r] = 0
-        for d in self.decks:
-            match_wins[d] = {d2: 0 for d2 in self.decks}
+        NR = len(self.records)
+        # counts[r, d]: number of players with record r playing deck d
+        self.counts = numpy.zeros((NR, K), dtype=numpy.int64)
+        self.record_score = numpy.array([ w - l + R for (w, l) in self.records ])
+        self.record_wins = numpy.array([ w for (w, l) in self.records ])
+        self.record_losses = numpy.array([ l for (w, l) in self.records ])
+        # Index of the record after a win or a loss; finished players start over
+        self.after_win = numpy.array([ 0 if w+l == R else r_index(w+1, l) for (w, l) in self.records ])
+        self.after_loss = numpy.array([ 0 if w+l == R else r_index(w, l+1) for (w, l) in self.records ])
+        self.score_distribution = numpy.array([ [ score_distribution[s1][s2]
+            for s2 in self.scores ] for s1 in self.scores ], dtype=float)
+        self.paired_score = AliasTable(self.score_distribution)
+        self.pairings = numpy.zeros((2*R + 1, 2*R + 1), dtype=numpy.int64)
+        self.match_wins = numpy.zeros((K, K), dtype=numpy.int64)
+
+    def score_counts(self):
+        """Number of players with each score."""
+        return numpy.bincount(self.record_score, weights=self.counts.sum(axis=1),
+                minlength=len(self.scores)).astype(numpy.int64)
+
+    def field(self):
+        """field[s, d]: number of players with score s playing deck d."""
+        field = numpy.zeros((len(self.scores), len(self.decks)), dtype=numpy.int64)
+        numpy.add.at(field, self.record_score, self.counts)
+        return field
 
     def current_distribution(self):
-        return {d: float(sum([self.field_record[r][d] for r in
-            self.records]))/self.n for d in self.decks}
+        return self.counts.sum(axis=0) / float(self.n)
 
     def add(self, n):
-        """Add a single deck, sampled from the field distribution, with a 0-0
-        record."""
-        new_decks = rand.choices(self.decks, self.field_distribution, k=n)
-        for d in new_decks:
-            self.field[0][d] = self.field[0][d] + 1
-            self.score_counts[0] = self.score_counts[0] + 1
-            self.field_record[(0,0)][d] = self.field_record[(0,0)][d] + 1
-            self.record_counts[(0,0)] = self.record_counts[(0,0)] + 1
+        """Add n decks, sampled from the field distribution, with 0-0 records."""
+        self.counts[0] += rng.multinomial(n, self.field_distribution)
         self.n += n
 
-    def choose_score(self):
-        """Sample a score uniformly."""
-        p = [self.score_counts[score]/float(self.n) for score in self.scores]
-        return rand.choices(self.scores, p, k=1)[0]
-
-    def choose_paired_score(self, score1):
-        """Sample the opponent's score given the player's score, according to
-        the score pairing distribution."""
-        p = [self.score_distribution[score1][score2] for score2 in self.scores]
-        return rand.choices(self.scores, p, k=1)[0]
-
-    def choose_deck(self, score=None):
-        """Choose a deck, identified by archetype and record, by sampling
-        uniformly from those with the exact score (wins minus losses) or
-        completely at random if no score is given."""
-        if score is None:
-            return self.choose_deck(self.choose_score())
-        n = float(self.score_counts[score])
-        if n > 0:
-            options = []
-            counts = []
-            for (w, l) in self.records:
-                if w-l == score:
-                    for deck in self.field_record[(w, l)]:
-                        k = self.field_record[(w, l)][deck]
-                        if k > 0:
-                            options.append((deck, (w, l)))
-                            counts.append(self.field_record[(w, l)][deck])
-            p_record_deck = [k/n for k in counts]
-            if len(options) > 0:
-                d = rand.choices(options, p_record_deck, k=1)[0]
-                if d is not None:
-                    return d
-        return (None, None)
+    def _draw(self, mask, k):
+        """Remove up to k players, uniformly at random, from the cells of the
+        pool selected by mask. Returns their (record, deck) cells."""
+        available = numpy.where(mask[:, None], self.counts, 0)
+        k = min(k, int(available.sum()))
+        if k == 0:
+            return numpy.empty(0, dtype=int), numpy.empty(0, dtype=int)
+        taken = rng.multivariate_hypergeometric(available.ravel(), k).reshape(available.shape)
+        self.counts -= taken
+        r, d = numpy.nonzero(taken)
+        reps = taken[r, d]
+        order = rng.permutation(k)
+        return numpy.repeat(r, reps)[order], numpy.repeat(d, reps)[order]
 
-    def choose_within_one(self, score, tries):
-        for i in range(tries):
-            (deck, record) = self.choose_deck()
-            if record is not None and (record[0] - record[1]) == score:
-                return (deck, record, score)
-        if self.score_counts.get(score, 0) == 0:
-            if self.score_counts.get(score-1, 0) == 0:
-                if self.score_counts.get(score+1, 0) == 0:
-                    return (None, None, None)
-        while(True):
-            (deck, record) = self.choose_deck()
-            if record is not None:
-                other_score = record[0] - record[1]
-                if abs(score - other_score) <= 1:
-                    return (deck, record, other_score)
-
-    def add_record(self, deck, new_w, new_l):
-        """Add a deck with a specific record to the record/score counts."""
-        new_score = new_w - new_l
-        if new_w + new_l > self.max_rounds:
-            self.add_record(deck, 0, 0)
+    def play_matches(self, k, tries=None):
+        """Play k matches at once. Each first player is drawn uniformly from
+        the pool. With tries=None, the opponent's score is drawn from the
+        score distribution; otherwise an opponent with the same score is
+        found with the probability of drawing one within 'tries' random
+        draws, and an opponent within one point of the player's score is
+        taken if not. Matches for which no opponent is available aren't
+        played."""
+        r1, d1 = self._draw(numpy.ones(len(self.records), dtype=bool), k)
+        s1 = self.record_score[r1]
+        if tries is None:
+            target = self.paired_score.sample(s1)
+            exact = numpy.ones(len(r1), dtype=bool)
         else:
-            record = (new_w, new_l)
-            self.field[new_score][deck] = self.field[new_score][deck] + 1
-            self.score_counts[new_score] = self.score_counts[new_score] + 1
-            self.field_record[record][deck] = self.field_record[record][deck] + 1
-            self.record_counts[record] = self.record_counts[record] + 1
-
-    def record_pairing(self, s1, s2):
-        self.pairings[s1][s2] = self.pairings[s1][s2] + 1
+            share = self.score_counts() / float(max(self.counts.sum(), 1))
+            exact = rng.random(len(r1)) < 1 - (1 - share[s1])**tries
+            target = s1
+        r2 = numpy.full(len(r1), -1)
+        d2 = numpy.full(len(r1), -1)
+        # Draw opponents for each (exactness, target score) group at once
+        for is_exact in (True, False):
+            for score in numpy.unique(target[exact == is_exact]):
+                which = numpy.nonzero((exact == is_exact) & (target == score))[0]
+                if is_exact:
+                    mask = self.record_score == score
+                else:
+                    mask = numpy.abs(self.record_score - score) <= 1
+                r, d = self._draw(mask, len(which))
+                r2[which[:len(r)]] = r
+                d2[which[:len(d)]] = d
+        unmatched = r2 < 0
+        numpy.add.at(self.counts, (r1[unmatched], d1[unmatched]), 1)
+        played = ~unmatched
+        r1, d1, r2, d2, s1 = r1[played], d1[played], r2[played], d2[played], s1[played]
+        numpy.add.at(self.pairings, (s1, self.record_score[r2]), 1)
+        won = rng.random(len(r1)) < self.matchups[d1, d2]
+        winner = numpy.where(won, d1, d2)
+        loser = numpy.where(won, d2, d1)
+        numpy.add.at(self.match_wins, (winner, loser), 1)
+        numpy.add.at(self.counts, (numpy.where(won, self.after_win[r1], self.after_loss[r1]), d1), 1)
+        numpy.add.at(self.counts, (numpy.where(won, self.after_loss[r2], self.after_win[r2]), d2), 1)
+        return len(r1)
 
     def play_match(self, tries=None):
-        p1_score = self.choose_score()
-        (p1_deck, p1_record) = self.choose_deck(p1_score)
-        if p1_deck is None:
-            return
-        if tries is None:
-            p2_score = self.choose_paired_score(p1_score)
-            (p2_deck, p2_record) = self.choose_deck(p2_score)
-        else:
-            (p2_deck, p2_record, p2_score) = self.choose_within_one(p1_score, tries)
-        if p2_deck is None:
-            return
-        self.record_pairing(p1_score, p2_score)
-        self.field[p1_score][p1_deck] = self.field[p1_score][p1_deck] - 1
-        self.field[p2_score][p2_deck] = self.field[p2_score][p2_deck] - 1
-        self.score_counts[p1_score] = self.score_counts[p1_score] - 1
-        self.score_counts[p2_score] = self.score_counts[p2_score] - 1
-        self.field_record[p1_record][p1_deck] = self.field_record[p1_record][p1_deck] - 1
-        self.field_record[p2_record][p2_deck] = self.field_record[p2_record][p2_deck] - 1
-        self.record_counts[p1_record] = self.record_counts[p1_record] - 1
-        self.record_counts[p2_record] = self.record_counts[p2_record] - 1
-        p_win_p1 = self.matchups[p1_deck][p2_deck]
-        p1_w, p1_l = p1_record
-        p2_w, p2_l = p2_record
-        if rand.random() < p_win_p1:
-            self.add_record(p1_deck, p1_w+1, p1_l)
-            self.add_record(p2_deck, p2_w, p2_l+1)
-            match_wins[p1_deck][p2_deck] = match_wins[p1_deck][p2_deck] + 1
-        else:
-            self.add_record(p1_deck, p1_w, p1_l+1)
-            self.add_record(p2_deck, p2_w+1, p2_l)
-            match_wins[p2_deck][p1_deck] = match_wins[p2_deck][p1_deck] + 1
+        return self.play_matches(1, tries)
+
+    def choose_decks(self):
+        """For each score, choose one player with that score uniformly at
+        random, without removing them. Returns (score indices, records,
+        decks) for the scores that have any players."""
+        scores, records, decks = [], [], []
+        for s in range(len(self.scores)):
+            cells = self.counts * (self.record_score == s)[:, None]
+            total = cells.sum()
+            if total == 0:
+                continue
+            i = rng.choice(cells.size, p=cells.ravel() / total)
+            r, d = divmod(i, len(self.decks))
+            scores.append(s)
+            records.append(r)
+            decks.append(d)
+        return scores, records, decks
 
     def ev(self, deck, score):
-        p = 0.0
-        for score2 in self.scores:
-            p_pair_score = self.score_distribution[score][score2]
-            n = self.score_counts[score2]
-            if n > 0:
-                for deck2 in self.decks:
-                    p_pair_deck = self.field[score2][deck2] / float(n)
-                    p_win = self.matchups[deck][deck2]
-                    p += p_pair_score * p_pair_deck * p_win
-        return p
+        """Expected match win probability for a deck with a given score."""
+        field = self.field()
+        n = field.sum(axis=1)
+        p_deck = numpy.where(n[:, None] > 0, field / numpy.maximum(n, 1)[:, None], 0)
+        s = score + self.max_rounds
+        return float(self.score_distribution[s] @ (p_deck @ self.matchups[deck]))
 
 #m = [0.3, 0.8, 0.3]
 m = [0.45, 0.55, 0.45]
 
-def generate():
-    n_decks = 1000
-    n_samples = 100
-    n_matches = 10
-    n_rounds = 4
-    tries = 100
-    field = [0.3, 0.5, 0.2]
+def generate(n_decks=1000, n_samples=100, n_matches=10, n_rounds=4, tries=100,
+        field=(0.3, 0.5, 0.2)):
+    field = list(field)
     matchups = {
             0: {0:    0.5,  1:   m[0],  2: m[1]},
             1: {0: 1-m[0],  1:    0.5,  2: m[2]},
@@ -189,63 +199,52 @@ def generate():
         score_map[i][i] = 1.0
     l = League(field, matchups, score_map)
     l.add(n_decks)
-    actual_field = l.field[0]
-    actual_distribution = {d: actual_field[d]/float(n_decks) for d in actual_field}
-    ev = {d: l.ev(d, 0) for d in actual_field}
-    counts = {s: [0]*len(field) for s in scores}
-    record_counts = {r: [0]*len(field) for r in l.records}
+    actual_distribution = l.current_distribution()
+    ev = [l.ev(d, 0) for d in l.decks]
+    counts = numpy.zeros((len(scores), len(field)), dtype=int)
+    record_counts = numpy.zeros((len(l.records), len(field)), dtype=int)
     data_points = 0
     for i in range(n_samples):
-        for j in range(n_matches):
-            l.play_match(tries)
+        l.play_matches(n_matches, tries)
     for i in range(n_samples):
-        for j in range(n_matches):
-            l.play_match(tries)
-        for s in scores:
-            (i, r) = l.choose_deck(s)
-            if i is not None:
-                data_points += 1
-                counts[s][i] += 1
-                record_counts[r][i] += 1
+        l.play_matches(n_matches, tries)
+        s, r, d = l.choose_decks()
+        numpy.add.at(counts, (s, d), 1)
+        numpy.add.at(record_counts, (r, d), 1)
+        data_points += len(s)
     data = {
             'n_archetypes': len(field),
             'n_rounds': n_rounds,
-            'pairings': [counts[s] for s in scores],
+            'pairings': counts.tolist(),
             'paired_scores': [[0]*len(scores) for s in scores],
-            'decks': [[0]*len(field) for s in l.records]
+            'decks': [[0]*len(field) for r in l.records]
     }
-    for s in scores:
-        n_score = float(sum(counts[s]))
-        p_score = [x/n_score if x > 0 else 0 for x in counts[s]]
+    for i, s in enumerate(scores):
+        n_score = float(counts[i].sum())
+        p_score = (counts[i] / n_score).tolist() if n_score > 0 else [0]*len(field)
         print("\tscore distribution[{}]: {}".format(s, p_score))
-    for r in l.records:
-        n_record = float(sum(record_counts[r]))
-        p_record = [x/n_record if x > 0 else 0 for x in record_counts[r]]
+    for i, r in enumerate(l.records):
+        n_record = float(record_counts[i].sum())
+        p_record = (record_counts[i] / n_record).tolist() if n_record > 0 else [0]*len(field)
         print("\trecord distribution[{}]: {}".format(r, p_record))
+    totals = l.match_wins + l.match_wins.T
+    empirical = numpy.where(totals > 0, l.match_wins / numpy.maximum(totals, 1), 0.0)
     for d1 in l.decks:
-        record = []
-        for d2 in l.decks:
-            mw = match_wins[d1][d2]
-            ml = match_wins[d2][d1]
-            p = mw / float(mw+ml) if mw+ml > 0 else 0.0
-            record.append(p)
-        print("\tEmpirical match wins[{}]: {}".format(d1, record))
-    n_wins = {d: sum([match_wins[d][x] for x in actual_field]) for d in actual_field}
-    n_losses = {d: sum([match_wins[x][d] for x in actual_field]) for d in actual_field}
-    win_rate = {d: n_wins[d]/float(n_wins[d]+n_losses[d]) if n_wins[d] > 0
-            else 0.0 for d in actual_field}
-    print("\tSample distribution:", actual_distribution)
+        print("\tEmpirical match wins[{}]: {}".format(d1, empirical[d1].tolist()))
+    n_wins = l.match_wins.sum(axis=1)
+    n_losses = l.match_wins.sum(axis=0)
+    win_rate = numpy.where(n_wins > 0, n_wins / numpy.maximum(n_wins + n_losses, 1), 0.0)
+    print("\tSample distribution:", actual_distribution.tolist())
     print("\tSample EV:", ev)
-    print("\tSample empirical wins:", win_rate)
-    for s1 in l.scores:
-        total = float(sum([l.pairings[s1][s2] for s2 in l.scores]))
-        for s2 in l.scores:
-            p = l.pairings[s1][s2] / total
-            if p > 0:
-                print("\tGiven score {}, paired against {}: {}".format(s1, s2, p))
-    for s in l.scores:
-        p = float(l.score_counts[s]) / l.n
-        print("score[{}]: {}".format(s, p))
+    print("\tSample empirical wins:", win_rate.tolist())
+    for i, s1 in enumerate(l.scores):
+        total = float(l.pairings[i].sum())
+        for j, s2 in enumerate(l.scores):
+            if total > 0 and l.pairings[i, j] > 0:
+                print("\tGiven score {}, paired against {}: {}".format(s1, s2, l.pairings[i, j] / total))
+    score_counts = l.score_counts()
+    for i, s in enumerate(l.scores):
+        print("score[{}]: {}".format(s, score_counts[i] / float(l.n)))
     print("{} total data points.".format(data_points))
     return data
 
@@ -5,44 +5,19 @@ matchups."""
 
 import csv
 
-import pystan
 import matplotlib.pyplot as plt
 import sys
 
-from metatools.database import *#getDecks, getMatches, getTournaments
-from metatools.dbmeta import DBMeta
-from metatools.util import record
+from metatools.database import getUniqueMatches
+from metatools.export import matchupCounts, writeCounts
+from stancache import cached_model, warm_start
 
-def generate():
-    metagame = DBMeta(getTournaments(format='Legacy', source='SCG'))
-    skip = set({'Unknown', '(Not Submitted)', ''})
-    def clean(string):
-        return string.replace('"', '').replace(',', '').strip().lower()
-    archetypes = [deck for deck in metagame.archetypes if deck not in skip]
-    for i in range(len(archetypes)):
-        a1 = archetypes[i]
-        if metagame.archetypes[a1] == 0:
-            continue
-        decks1 = getDecks(tournaments=metagame.tournaments, archetypes=[a1])
-        for j in range(i+1, len(archetypes)):
-            a2 = archetypes[j]
-            if metagame.archetypes[a2] == 0:
-                continue
-            decks2 = getDecks(tournaments=metagame.tournaments, archetypes=[a2])
-            matches = getMatches(tournaments=metagame.tournaments,
-                    decks1=decks1, decks2=decks2)
-            if len(matches) == 0:
-                continue
-            # Matches are doubled up for some reason, but given in the same
-            # order, so just divide counts by 2
-            w_both, l_both, d_both = record(matches)
-            w = int(w_both / 2)
-            l = int(l_both / 2)
-            n = w + l
-            if n > 0:
-                print("{0},{1},{2},{3}".format(clean(a1), clean(a2), n, w))
+def generate(format='Legacy', source='SCG'):
+    """Print matchup counts for every pair of archetypes (see
+    metatools.export; python -m metatools.export counts does the same)."""
+    writeCounts(matchupCounts(getUniqueMatches(format=format, source=source)), sys.stdout)
 
-def analyze(data_file, order, mirror):
+def analyze(data_file, order, mirror, init=None):
     n_model = 0
     max_matchups = 0
     data = {
@@ -72,8 +47,10 @@ def analyze(data_file, order, mirror):
                 matchups.append(row['deck2'] + "," + row['deck1'])
     data['n_matchups'] = len(matchups)
     data['n_modeled'] = min(n_model, len(matchups))
-    sm = pystan.StanModel(file="models/matchup.stan")
-    fit = sm.sampling(data=data, iter=5000, chains=8, n_jobs=-1)
+    sm = cached_model("models/matchup.stan")
+    chains = 8
+    fit = sm.sampling(data=data, iter=5000, chains=chains, n_jobs=-1,
+            init=warm_start(init, chains))
     print(fit)
     print(matchups[:n_model])
     fit.plot()
@@ -81,6 +58,6 @@ def analyze(data_file, order, mirror):
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
-        analyze(sys.argv[1], False, False)
+        analyze(sys.argv[1], False, False, sys.argv[2] if len(sys.argv) > 2 else None)
     else:
         generate()
@@ -0,0 +1,134 @@
+"""Compiled model cache and warm starts for the pystan inference scripts.
+
+Compiled models are pickled under a cache directory, keyed by a hash of the
+Stan source, so a model is only recompiled when its .stan file changes. Runs
+can be initialized from a previous run's posterior means (saved as JSON) or
+from a Stan sample CSV, instead of from random inits.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import pickle
+
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get('STAN_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '.stancache'))
+
+def source_hash(filename):
+    with open(filename, 'rb') as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+def cached_model(filename, cache_dir=None):
+    """Return a pystan.StanModel for a .stan file, compiling it only if no
+    model compiled from identical source is in the cache."""
+    import pystan
+    cache_dir = cache_dir or CACHE_DIR
+    name = os.path.splitext(os.path.basename(filename))[0]
+    path = os.path.join(cache_dir, "{}-{}.pkl".format(name, source_hash(filename)[:16]))
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as cached:
+                model = pickle.load(cached)
+            print("Using cached model {}".format(path))
+            return model
+        except Exception as e:
+            print("Couldn't load cached model {} ({}); recompiling".format(path, e))
+    model = pystan.StanModel(file=filename)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'wb') as cached:
+        pickle.dump(model, cached)
+    return model
+
+def _nest(flat):
+    """Turn {'x.1.2': v, ...} into {'x': [[..., v], ...]}, ordered by index."""
+    pars = OrderedDict()
+    for column, value in flat.items():
+        parts = column.split('.')
+        name, index = parts[0], [ int(i)-1 for i in parts[1:] ]
+        if not index:
+            pars[name] = value
+            continue
+        pars.setdefault(name, {})[tuple(index)] = value
+    def build(entries, depth):
+        size = max(k[depth] for k in entries) + 1
+        if depth == len(next(iter(entries))) - 1:
+            values = [ None ] * size
+            for k, v in entries.items():
+                values[k[depth]] = v
+            return values
+        return [ build({ k: v for k, v in entries.items() if k[depth] == i }, depth+1)
+            for i in range(size) ]
+    for name, value in pars.items():
+        if isinstance(value, dict):
+            pars[name] = build(value, 0)
+    return dict(pars)
+
+def means_from_sample_file(filename, pars=None):
+    """Posterior means of the sampled parameters in a Stan sample CSV,
+    skipping warmup draws (those before the adaptation comment, if any) and
+    diagnostic columns ending in '__'."""
+    sums = None
+    n = 0
+    header = None
+    with open(filename) as text:
+        for line in text:
+            if line.startswith('#'):
+                if 'Adaptation terminated' in line:
+                    # Everything so far was warmup
+                    sums = None
+                    n = 0
+                continue
+            if header is None:
+                header = next(csv.reader([line]))
+                continue
+            values = [ float(x) for x in line.split(',') ]
+            sums = values if sums is None else [ a + b for a, b in zip(sums, values) ]
+            n += 1
+    if n == 0:
+        raise Exception("No draws found in {}".format(filename))
+    flat = OrderedDict()
+    for column, total in zip(header, sums):
+        if column.endswith('__'):
+            continue
+        if pars is not None and column.split('.')[0] not in pars:
+            continue
+        flat[column] = total / n
+    return _nest(flat)
+
+def means_from_fit(fit, pars=None):
+    """Posterior means of every parameter in a fit (pystan or native)."""
+    samples = fit.extract()
+    means = {}
+    for name, values in samples.items():
+        if name.endswith('__') or (pars is not None and name not in pars):
+            continue
+        mean = values.mean(axis=0)
+        means[name] = mean.tolist() if hasattr(mean, 'tolist') else float(mean)
+    return means
+
+def save_means(fit, filename, pars=None):
+    """Save a fit's posterior means as JSON, for warm starting later runs."""
+    with open(filename, 'w') as outfile:
+        json.dump(means_from_fit(fit, pars), outfile)
+
+def load_init(source, pars=None):
+    """Load initial values from a JSON file of means (see save_means) or a
+    Stan sample CSV. Only the given parameters are kept, if specified."""
+    if source.endswith('.json'):
+        with open(source) as infile:
+            init = json.load(infile)
+        if pars is not None:
+            init = { k: v for k, v in init.items() if k in pars }
+        return init
+    return means_from_sample_file(source, pars)
+
+def warm_start(source, chains, pars=None):
+    """Per-chain inits for pystan: 'random' if there is no previous run,
+    otherwise the previous run's means for every chain."""
+    if not source:
+        return 'random'
+    init = load_init(source, pars)
+    return [ dict(init) for i in range(chains) ]
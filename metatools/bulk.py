@@ -0,0 +1,215 @@
+"""Batched insertion of whole tournaments.
+
+Parsers hand the BulkWriter plain, picklable records (so they can be built in
+worker processes), and the writer inserts each batch of tournaments with a
+handful of executemany statements inside a single transaction.
+
+A record is a dict of the form:
+    {
+        'tournament': { 'name': ..., 'date': datetime.date, 'format': ...,
+                        'numPlayers': ..., 'source': ..., 'city': ...,
+                        'state': ..., 'country': ... },
+        'decks': [ { 'player': ..., 'place': ..., 'points': ..., 'record': ...,
+                     'archetype': ..., 'subarchetype': ..., 'original': ...,
+                     'slots': { cardname: (main, side), ... } }, ... ],
+        'matches': [ (deck_index_1, deck_index_2, win, loss, draw, round), ... ]
+    }
+where deck indices refer to positions in the 'decks' list.
+"""
+
+from metatools.archetypes import ArchetypeParser
+from metatools.database import tournamentTable, deckTable, contents, rawMatches, hasColumn
+from metatools.deck import Deck, playerKey
+from metatools.summaries import updateArchetypeTotals, staleMatchupCube, rebuildMatchupCube
+
+from sqlalchemy.sql import select, func
+
+import sys
+import time
+
+tournamentColumns = { 'name': 'T_NAME', 'date': 'T_DATE', 'format': 'FORMAT',
+        'numPlayers': 'PLAYERS', 'source': 'SOURCE', 'city': 'CITY',
+        'state': 'STATE', 'country': 'COUNTRY' }
+deckColumns = { 'player': 'PLAYER_NAME', 'place': 'PLACE', 'points': 'POINTS',
+        'record': 'RECORD', 'archetype': 'DECK_NAME', 'subarchetype': 'QUALIFIER',
+        'original': 'ORIGINAL', 'split': 'SPLIT' }
+
+def tournamentKey(name, date):
+    """Key identifying a tournament for the purpose of skipping duplicates."""
+    return (name, str(date))
+
+def ingestedTournaments(session):
+    """Return the set of (name, date) keys already present in the database."""
+    result = session.execute(select([tournamentTable.c.T_NAME, tournamentTable.c.T_DATE]))
+    return set(tournamentKey(name, date) for name, date in result)
+
+def classifyRecord(record, parser, fallback=None):
+    """Run the archetype parser over every deck in a record that has a decklist,
+    overwriting the archetype and subarchetype in place. Decks which can't be
+    classified keep their existing label (or the fallback, if given)."""
+    for deck in record['decks']:
+        slots = deck.get('slots')
+        if not slots:
+            continue
+        d = Deck(player=deck.get('player'), place=deck.get('place'))
+        d.setMain({card: slots[card][0] for card in slots if slots[card][0] > 0})
+        d.setSide({card: slots[card][1] for card in slots if slots[card][1] > 0})
+        label = fallback if fallback else deck.get('archetype', ArchetypeParser.unknown)
+        try:
+            main, sub, exact_match = parser.classify(d, fallback=label)
+            deck['archetype'] = main
+            deck['subarchetype'] = sub
+        except Exception as e:
+            print(f"WARNING: {e} (using {label})", file=sys.stderr)
+            deck['archetype'] = label
+    return record
+
+class BulkWriter(object):
+    """Accumulate tournament records and insert them in batches, committing once
+    per batch. Tournaments whose (name, date) are already in the database, or
+    which were already seen by this writer, are skipped.
+
+    Archetype totals are updated with each batch, but the matchup cube is only
+    rebuilt once, by close(), from the earliest week written to. (Rebuilding
+    it per batch would rescan everything after each batch's first week, which
+    is quadratic when backfilling in date order.) If the writer isn't closed,
+    run metatools.migrate to bring the cube up to date."""
+
+    def __init__(self, session, batchSize=50, dryRun=False, verbose=True):
+        self.session = session
+        self.batchSize = batchSize
+        self.dryRun = dryRun
+        self.verbose = verbose
+        self.pending = []
+        self.ingested = ingestedTournaments(session)
+        self.nTournaments = 0
+        self.nDecks = 0
+        self.nMatches = 0
+        self.nSkipped = 0
+        self.total = None
+        self.start = time.time()
+        self.staleCube = {}
+
+    def isIngested(self, name, date):
+        return tournamentKey(name, date) in self.ingested
+
+    def add(self, record):
+        """Queue a tournament for insertion, flushing if the batch is full.
+        Returns False if the tournament was skipped as a duplicate."""
+        t = record['tournament']
+        key = tournamentKey(t['name'], t['date'])
+        if key in self.ingested:
+            self.nSkipped += 1
+            return False
+        self.ingested.add(key)
+        self.pending.append(record)
+        if len(self.pending) >= self.batchSize:
+            self.flush()
+        return True
+
+    def skip(self):
+        """Count a tournament skipped upstream (e.g. by a worker process)."""
+        self.nSkipped += 1
+
+    def _nextId(self, column):
+        current = self.session.execute(select([func.max(column)])).scalar()
+        return 1 if current is None else current + 1
+
+    def flush(self):
+        """Insert every pending tournament in one transaction."""
+        if not self.pending:
+            return []
+        nextTid = self._nextId(tournamentTable.c.T_ID)
+        nextDeck = self._nextId(deckTable.c.DECK_ID)
+        tournamentRows = []
+        deckRows = []
+        hasPlayerKey = hasColumn('Deck', 'PLAYER_KEY')
+        slotRows = []
+        matchRows = []
+        tids = []
+        for record in self.pending:
+            tid = nextTid
+            nextTid += 1
+            tids.append(tid)
+            row = { 'T_ID': tid }
+            for key, column in tournamentColumns.items():
+                row[column] = record['tournament'].get(key)
+            tournamentRows.append(row)
+            deckIds = []
+            for deck in record['decks']:
+                deckId = nextDeck
+                nextDeck += 1
+                deckIds.append(deckId)
+                row = { 'DECK_ID': deckId, 'T_ID': tid }
+                for key, column in deckColumns.items():
+                    row[column] = deck.get(key)
+                if row['DECK_NAME'] is None:
+                    row['DECK_NAME'] = ArchetypeParser.unknown
+                if row['QUALIFIER'] is None:
+                    row['QUALIFIER'] = ''
+                if hasPlayerKey:
+                    row['PLAYER_KEY'] = playerKey(row['PLAYER_NAME'])
+                deckRows.append(row)
+                for card, (main, side) in deck.get('slots', {}).items():
+                    slotRows.append({ 'DECK_ID': deckId, 'CARD_NAME': card,
+                        'NUM_MAIN': main, 'NUM_SIDE': side })
+            for i1, i2, w, l, d, r in record['matches']:
+                matchRows.append({ 'T_ID': tid, 'DECK_1': deckIds[i1], 'DECK_2': deckIds[i2],
+                    'WIN': w, 'LOSS': l, 'DRAW': d, 'ROUND': r })
+        try:
+            self.session.execute(tournamentTable.insert(), tournamentRows)
+            self.session.execute(deckTable.insert(), deckRows)
+            if slotRows:
+                self.session.execute(contents.insert(), slotRows)
+            if matchRows:
+                self.session.execute(rawMatches.insert(), matchRows)
+            updateArchetypeTotals(tids)
+            stale = staleMatchupCube(tids)
+        except:
+            self.session.rollback()
+            raise
+        if self.dryRun:
+            self.session.rollback()
+        else:
+            self.session.commit()
+            for key, date in stale.items():
+                if key not in self.staleCube or date < self.staleCube[key]:
+                    self.staleCube[key] = date
+        self.nTournaments += len(self.pending)
+        self.nDecks += len(deckRows)
+        self.nMatches += len(matchRows)
+        self.pending = []
+        if self.verbose:
+            self.report()
+        return tids
+
+    def close(self):
+        """Flush any remaining tournaments, then rebuild the matchup cube."""
+        if not self.flush() and self.verbose:
+            self.report()
+        self.rebuildCube()
+
+    def rebuildCube(self):
+        """Rebuild the matchup cube once per (format, source) written to,
+        from the earliest week written."""
+        for (format, source), date in sorted(self.staleCube.items(), key=str):
+            try:
+                rebuildMatchupCube(format, source, since=date)
+            except:
+                self.session.rollback()
+                raise
+            self.session.commit()
+            if self.verbose:
+                print(f'Rebuilt matchup cube for format={format}, source={source} '
+                        f'from {date}')
+        self.staleCube = {}
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 1e-9)
+        done = self.nTournaments + self.nSkipped
+        progress = f'{done}/{self.total}' if self.total else f'{done}'
+        print(f'{progress} tournaments processed ({self.nTournaments} inserted, '
+                f'{self.nSkipped} skipped): {self.nDecks} decks, {self.nMatches} matches '
+                f'[{self.nTournaments / elapsed:.1f} tournaments/s, '
+                f'{self.nDecks / elapsed:.0f} decks/s]'
+                + (' (dry run)' if self.dryRun else ''))
@@ -1,10 +1,12 @@
-from sqlalchemy import schema, types, orm
+from sqlalchemy import schema, types, orm, event
 from sqlalchemy.engine import create_engine
 from sqlalchemy.sql import select, func
 from sqlalchemy.sql.expression import and_, or_, asc, text
 
+import datetime
+
 from metatools.config import config
-from metatools.deck import Deck, Card, Slot
+from metatools.deck import Deck, Card, Slot, playerKey, playerKeys, playerKeyRange
 from metatools.match import Match
 from metatools.tournament import Tournament
 
@@ -50,7 +52,9 @@ deckTable = schema.Table('Deck', metadata,
         schema.Column('ORIGINAL', types.String),
         schema.Column('QUALIFIER', types.String),
         schema.Column('RECORD', types.String),
-        schema.Column('POINTS', types.Integer))
+        schema.Column('POINTS', types.Integer),
+        schema.Column('PLAYER_KEY', types.String),
+        schema.Index('Deck_playerKey', 'PLAYER_KEY'))
 
 contents = schema.Table('Contents', metadata,
         schema.Column('CARD_NAME', types.String,
@@ -95,6 +99,34 @@ rawMatches = schema.Table('Matches', metadata,
         schema.Column('ROUND', types.String),
         schema.Column('TABLE_NUM', types.Integer))
 
+archetypeTotals = schema.Table('ArchetypeTotals', metadata,
+        schema.Column('T_ID', types.Integer,
+            schema.ForeignKey('Tournament.T_ID'), index=True),
+        schema.Column('DECK_NAME', types.String),
+        schema.Column('QUALIFIER', types.String),
+        schema.Column('DECKS', types.Integer),
+        schema.Column('MATCH_WIN', types.Integer),
+        schema.Column('MATCH_LOSS', types.Integer),
+        schema.Column('MATCH_DRAW', types.Integer),
+        schema.Column('TOP8', types.Integer),
+        schema.Column('TOP16', types.Integer))
+
+matchupCube = schema.Table('MatchupCube', metadata,
+        schema.Column('FORMAT', types.String),
+        schema.Column('SOURCE', types.String),
+        schema.Column('WEEK', types.Date),
+        schema.Column('DECK_NAME', types.String),
+        schema.Column('QUALIFIER', types.String),
+        schema.Column('DECK_NAME_2', types.String),
+        schema.Column('QUALIFIER_2', types.String),
+        schema.Column('MATCH_WIN', types.Integer),
+        schema.Column('MATCH_LOSS', types.Integer),
+        schema.Column('MATCH_DRAW', types.Integer),
+        schema.Column('CUM_WIN', types.Integer),
+        schema.Column('CUM_LOSS', types.Integer),
+        schema.Column('CUM_DRAW', types.Integer),
+        schema.Index('MatchupCube_week', 'FORMAT', 'WEEK'))
+
 class DBDeck(Deck):
     def getMatches(self):
         if len(self.matches) > 0:
@@ -133,7 +165,7 @@ orm.mapper(DBTournament, tournamentTable, properties= {
     'format': tournamentTable.c.FORMAT,
     'source': tournamentTable.c.SOURCE
 })
-orm.mapper(DBDeck, deckTable, properties = {
+deckMapper = orm.mapper(DBDeck, deckTable, exclude_properties=['PLAYER_KEY'], properties = {
     'slots': orm.relation(Slot, backref='deck'),
     'id': deckTable.c.DECK_ID,
     'player': deckTable.c.PLAYER_NAME,
@@ -186,6 +218,25 @@ orm.mapper(RawMatch, rawMatches, properties={
     'table': rawMatches.c.TABLE_NUM
 })
 
+@event.listens_for(orm.mapper, 'before_configured', once=True)
+def mapPlayerKey():
+    """Map DBDeck.playerKey once the database can be checked for the
+    PLAYER_KEY column. In a database that metatools.migrate hasn't added it
+    to yet, the key is computed from the name as each deck is loaded."""
+    if hasColumn('Deck', 'PLAYER_KEY'):
+        deckMapper.add_property('playerKey', deckTable.c.PLAYER_KEY)
+    else:
+        event.listen(DBDeck, 'load', loadPlayerKey)
+
+def loadPlayerKey(deck, context):
+    deck.playerKey = playerKey(deck.player)
+
+@event.listens_for(DBDeck, 'before_insert')
+@event.listens_for(DBDeck, 'before_update')
+def setPlayerKey(mapper, connection, deck):
+    """Keep PLAYER_KEY in sync with PLAYER_NAME for decks saved through the ORM."""
+    deck.playerKey = playerKey(deck.player)
+
 def tournamentQuery(tournaments=[], tids=[], format=None, name=None, source=None,
         min_date=None, max_date=None, min_players=None, max_players=None):
     """Build a query for tournaments.
@@ -228,7 +279,7 @@ def tournamentQuery(tournaments=[], tids=[], format=None, name=None, source=None
 
 def deckQuery(decks=None, dids=[], tournaments=[], tquery=None, tids=[], players=[],
         min_place=None, max_place=None, archetypes=[], subarchetypes=[], deckTypes=[],
-        exclude=[]):
+        exclude=[], playerPrefixes=[]):
     """Build a query for decks.
     
     All options which are specified will be required to be true (unless
@@ -243,6 +294,8 @@ def deckQuery(decks=None, dids=[], tournaments=[], tquery=None, tids=[], players
     tquery: A query for tournaments to select decks from.
     tids: IDs of tournaments to select decks from.
     players: Player names.
+    playerPrefixes: Only return decks whose player names start with one of
+        these (compared by player key, so each is a range scan on its index).
     min_place: Minimum place in the tournament.
     max_place: Maximum place in the tournament.
     archetypes: Only return decks with one of these archetypes.
@@ -264,9 +317,23 @@ def deckQuery(decks=None, dids=[], tournaments=[], tquery=None, tids=[], players
         query = query.filter(deckTable.c.T_ID.in_(tids))
     if tquery:
         query = query.join(tquery.subquery())
-    if players:
-        p2 = [ func.upper(p) for p in players ]
-        query = query.filter(func.upper(DBDeck.player).in_(p2))
+    if hasColumn('Deck', 'PLAYER_KEY'):
+        if players:
+            query = query.filter(DBDeck.playerKey.in_(playerKeys(players)))
+        if playerPrefixes:
+            ranges = [ r for r in map(playerKeyRange, playerPrefixes) if r is not None ]
+            if ranges:
+                query = query.filter(or_(*[ and_(DBDeck.playerKey >= low,
+                    DBDeck.playerKey < high) for low, high in ranges ]))
+    else:
+        # Without the key column, compare names case-insensitively in SQL
+        name = func.upper(DBDeck.player)
+        if players:
+            query = query.filter(name.in_([ func.upper(p) for p in players ]))
+        prefixes = [ p for p in playerPrefixes if p ]
+        if prefixes:
+            query = query.filter(or_(*[ func.substr(name, 1, len(p)) == func.upper(p)
+                for p in prefixes ]))
     if min_place:
         query = query.filter(DBDeck.place >= min_place)
     if max_place:
@@ -498,6 +565,234 @@ def getMatchTotals(tids, decks1, decks2, fromSub=False):
             *(tids + decks1 + decks2))
     return result
 
+def getArchetypeTotals(tids):
+    """Sum the precomputed per-tournament archetype totals over a set of
+    tournaments. Returns rows of (archetype, subarchetype, decks, match wins,
+    match losses, match draws, top 8 decks, top 16 decks)."""
+    if not tids:
+        return []
+    return sql("""select DECK_NAME, QUALIFIER, SUM(DECKS), SUM(MATCH_WIN),
+        SUM(MATCH_LOSS), SUM(MATCH_DRAW), SUM(TOP8), SUM(TOP16) from
+        ArchetypeTotals where T_ID """ + inequals(tids)
+        + """ group by DECK_NAME, QUALIFIER""", *tids)
+
+def getPlayerRecords(tids):
+    """Match totals for every player and archetype over a set of tournaments,
+    comparing players by PLAYER_KEY. Returns rows of (player key, archetype,
+    match wins, match losses, match draws)."""
+    if not tids:
+        return []
+    if hasColumn('Deck', 'PLAYER_KEY'):
+        return sql("""select D.PLAYER_KEY, M.DECK_NAME, SUM(M.MATCH_WIN),
+            SUM(M.MATCH_LOSS), SUM(M.MATCH_DRAW) from MatchesSCG M
+            join Deck D on D.DECK_ID = M.DECK_ID where M.T_ID """
+            + inequals(tids) + """ group by D.PLAYER_KEY, M.DECK_NAME""", *tids)
+    # Not migrated yet: group by name, then combine names with the same key
+    totals = {}
+    for name, archetype, win, loss, draw in sql("""select D.PLAYER_NAME, M.DECK_NAME,
+            SUM(M.MATCH_WIN), SUM(M.MATCH_LOSS), SUM(M.MATCH_DRAW) from MatchesSCG M
+            join Deck D on D.DECK_ID = M.DECK_ID where M.T_ID """
+            + inequals(tids) + """ group by D.PLAYER_NAME, M.DECK_NAME""", *tids):
+        key = (playerKey(name), archetype)
+        w, l, d = totals.get(key, (0, 0, 0))
+        totals[key] = (w + (win or 0), l + (loss or 0), d + (draw or 0))
+    return [ key + record for key, record in totals.items() ]
+
+def getArchetypePlayers(tids, archetypes):
+    """Players who played any of the given archetypes in a set of
+    tournaments. Returns rows of (player key, one spelling of the name as
+    entered)."""
+    if not tids or not archetypes:
+        return []
+    if hasColumn('Deck', 'PLAYER_KEY'):
+        return sql("""select PLAYER_KEY, MIN(PLAYER_NAME) from Deck where T_ID """
+            + inequals(tids) + """ and DECK_NAME """ + inequals(archetypes)
+            + """ group by PLAYER_KEY""", *(tids + archetypes))
+    names = {}
+    for name, in sql("""select distinct PLAYER_NAME from Deck where T_ID """
+            + inequals(tids) + """ and DECK_NAME """ + inequals(archetypes),
+            *(tids + archetypes)):
+        key = playerKey(name)
+        if key not in names or name < names[key]:
+            names[key] = name
+    return list(names.items())
+
+def toDate(value):
+    """Convert a date, datetime, or ISO date string (as returned by raw SQL on
+    some backends) to a date."""
+    if value is None or isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def weekOf(date):
+    """The Monday starting the week containing a date; used to bucket the
+    matchup cube."""
+    date = toDate(date)
+    return date - datetime.timedelta(days=date.weekday())
+
+def _windowCondition(format, source):
+    """SQL condition and parameters selecting tournaments (aliased T) by format
+    and source, matching tournamentQuery's treatment of None as 'any'."""
+    conditions = []
+    params = []
+    if format:
+        conditions.append("T.FORMAT = " + param)
+        params.append(format)
+    if source:
+        conditions.append("T.SOURCE = " + param)
+        params.append(source)
+    return conditions, params
+
+def _cubePrefix(format, source, week, decks1, decks2):
+    """Cumulative match totals per (archetype, subarchetype) pair through the
+    given week (inclusive), summed over sources. Since the cumulative columns
+    only ever increase with time, the value at the latest week on or before
+    the cutoff is simply the maximum."""
+    conditions = ["WEEK <= " + param]
+    params = [str(week)]
+    if format:
+        conditions.append("FORMAT = " + param)
+        params.append(format)
+    if source:
+        conditions.append("SOURCE = " + param)
+        params.append(source)
+    conditions.append("DECK_NAME " + inequals(decks1))
+    conditions.append("DECK_NAME_2 " + inequals(decks2))
+    params += decks1 + decks2
+    return sql("""select FORMAT, SOURCE, DECK_NAME, QUALIFIER, DECK_NAME_2, QUALIFIER_2,
+        MAX(CUM_WIN), MAX(CUM_LOSS), MAX(CUM_DRAW) from MatchupCube where """
+        + " and ".join(conditions) + """ group by FORMAT, SOURCE, DECK_NAME,
+        QUALIFIER, DECK_NAME_2, QUALIFIER_2""", *params)
+
+def _scanTotals(format, source, begin, end, decks1, decks2):
+    """Match totals by (archetype, subarchetype) pair over a date range, read
+    directly from the matches."""
+    conditions, params = _windowCondition(format, source)
+    conditions.append("T.T_DATE >= " + param)
+    conditions.append("T.T_DATE <= " + param)
+    params += [str(begin), str(end)]
+    conditions.append("M.DECK_NAME " + inequals(decks1))
+    conditions.append("M.DECK_NAME_2 " + inequals(decks2))
+    params += decks1 + decks2
+    return sql("""select M.DECK_NAME, M.QUALIFIER, M.DECK_NAME_2, M.QUALIFIER_2,
+        SUM(M.MATCH_WIN), SUM(M.MATCH_LOSS), SUM(M.MATCH_DRAW) from MatchesSCG M
+        join Tournament T on M.T_ID = T.T_ID where """ + " and ".join(conditions)
+        + """ group by M.DECK_NAME, M.QUALIFIER, M.DECK_NAME_2, M.QUALIFIER_2""", *params)
+
+def getUniqueMatches(format=None, source=None, begin=None, end=None, tids=None):
+    """Every match of a format (and optionally source) between two dates, or
+    in the given tournaments, once each. Most matches are stored twice in
+    Matches, once from each player's side, so rows are grouped by
+    tournament, round, and unordered pair of decks, and oriented so that
+    DECK_1 has the lower deck ID. Returns rows of (T_ID, T_DATE, SOURCE,
+    ROUND, deck 1 ID, archetype 1, deck 2 ID, archetype 2, games won by deck
+    1, games lost, games drawn, player 1 key, player 2 key)."""
+    conditions, params = _windowCondition(format, source)
+    if tids is not None:
+        if not tids:
+            return []
+        conditions.append("T.T_ID " + inequals(tids))
+        params += list(tids)
+    if begin is not None:
+        conditions.append("T.T_DATE >= " + param)
+        params.append(str(toDate(begin)))
+    if end is not None:
+        conditions.append("T.T_DATE <= " + param)
+        params.append(str(toDate(end)))
+    where = (" where " + " and ".join(conditions)) if conditions else ""
+    low = "case when M.DECK_1 < M.DECK_2 then M.DECK_1 else M.DECK_2 end"
+    high = "case when M.DECK_1 < M.DECK_2 then M.DECK_2 else M.DECK_1 end"
+    keyed = hasColumn('Deck', 'PLAYER_KEY')
+    player = "PLAYER_KEY" if keyed else "PLAYER_NAME"
+    rows = sql("""select G.T_ID, G.T_DATE, G.SOURCE, G.ROUND, G.DECK_1, D1.DECK_NAME,
+        G.DECK_2, D2.DECK_NAME, G.WIN, G.LOSS, G.DRAW, D1.""" + player + """,
+        D2.""" + player + """ from
+        (select M.T_ID as T_ID, T.T_DATE as T_DATE, T.SOURCE as SOURCE,
+            M.ROUND as ROUND, """ + low + """ as DECK_1, """ + high + """ as DECK_2,
+            MAX(case when M.DECK_1 < M.DECK_2 then M.WIN else M.LOSS end) as WIN,
+            MAX(case when M.DECK_1 < M.DECK_2 then M.LOSS else M.WIN end) as LOSS,
+            MAX(M.DRAW) as DRAW
+            from Matches M join Tournament T on M.T_ID = T.T_ID""" + where + """
+            group by M.T_ID, T.T_DATE, T.SOURCE, M.ROUND, """ + low + ", " + high + """) G
+        join Deck D1 on G.DECK_1 = D1.DECK_ID
+        join Deck D2 on G.DECK_2 = D2.DECK_ID
+        order by G.T_ID, G.ROUND""", *params)
+    if keyed:
+        return rows
+    return [ tuple(row[:11]) + (playerKey(row[11]), playerKey(row[12])) for row in rows ]
+
+def getMatchTotalsByDate(format, source, begin, end, decks1, decks2, fromSub=False):
+    """Equivalent to getMatchTotals over every tournament of a format (and
+    optionally source) between two dates, inclusive, but read from the
+    matchup cube: whole weeks come from the difference of two cumulative
+    lookups, and only the partial weeks at either end are read from the
+    matches themselves."""
+    decks1 = list(decks1)
+    decks2 = list(decks2)
+    begin = toDate(begin)
+    end = toDate(end)
+    totals = {}
+    def add(key, win, loss, draw, sign=1):
+        w, l, d = totals.get(key, (0, 0, 0))
+        totals[key] = (w + sign*(win or 0), l + sign*(loss or 0), d + sign*(draw or 0))
+    def key(d1, s1, d2):
+        return (d1, s1, d2) if fromSub else (d1, d2)
+    if begin is None:
+        firstWeek = None
+    else:
+        firstWeek = weekOf(begin)
+        if firstWeek < begin:
+            firstWeek += datetime.timedelta(days=7)
+    if end is None:
+        lastWeek = weekOf(datetime.date.max - datetime.timedelta(days=7))
+    else:
+        lastWeek = weekOf(end)
+        if lastWeek + datetime.timedelta(days=6) > end:
+            lastWeek -= datetime.timedelta(days=7)
+    if firstWeek is not None and firstWeek > lastWeek:
+        for d1, s1, d2, s2, win, loss, draw in _scanTotals(format, source, begin, end,
+                decks1, decks2):
+            add(key(d1, s1, d2), win, loss, draw)
+    else:
+        for row in _cubePrefix(format, source, lastWeek, decks1, decks2):
+            add(key(row[2], row[3], row[4]), *row[6:])
+        if firstWeek is not None:
+            before = firstWeek - datetime.timedelta(days=7)
+            for row in _cubePrefix(format, source, before, decks1, decks2):
+                add(key(row[2], row[3], row[4]), *row[6:], sign=-1)
+            if begin < firstWeek:
+                for d1, s1, d2, s2, win, loss, draw in _scanTotals(format, source, begin,
+                        firstWeek - datetime.timedelta(days=1), decks1, decks2):
+                    add(key(d1, s1, d2), win, loss, draw)
+        if end is not None and lastWeek + datetime.timedelta(days=6) < end:
+            for d1, s1, d2, s2, win, loss, draw in _scanTotals(format, source,
+                    lastWeek + datetime.timedelta(days=7), end, decks1, decks2):
+                add(key(d1, s1, d2), win, loss, draw)
+    return [ k + v for k, v in totals.items() if v != (0, 0, 0) ]
+
+_tables = {}
+def hasTable(name):
+    """Check whether a table exists, e.g. a summary table which may not have
+    been created yet by metatools.migrate. Once a table has been found, it
+    isn't checked for again."""
+    if not _tables.get(name):
+        _tables[name] = engine.has_table(name)
+    return _tables[name]
+
+_columns = {}
+def hasColumn(table, column):
+    """Check (once per process) whether a table has a column, e.g. one added
+    by metatools.migrate. Missing tables count as having every column."""
+    if (table, column) not in _columns:
+        if engine.has_table(table):
+            columns = engine.execute('select * from ' + table + ' limit 0').keys()
+            _columns[(table, column)] = column.upper() in [ c.upper() for c in columns ]
+        else:
+            _columns[(table, column)] = True
+    return _columns[(table, column)]
+
 def getCardCounts(decks, side=False):
     dids = [ d.id for d in decks ]
     condition = inequals(dids)
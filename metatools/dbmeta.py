@@ -1,5 +1,6 @@
 from metatools.meta import ObservedMeta, MetaFactory, Metagame
-from metatools.database import getDecks, getMatches, deckQuery, DBDeck, func, getMatchTotals
+from metatools.database import getDecks, getMatches, deckQuery, DBDeck, func, getMatchTotals, \
+        getArchetypeTotals, getMatchTotalsByDate, hasTable
 from metatools.deck import Card, Deck
 from metatools.util import mwp, mwp_record, record
 
@@ -7,41 +8,66 @@ from decimal import Decimal
 
 class DBMeta(ObservedMeta):
     """Describe the metagame based on tournament results in the database."""
-    def __init__(self, tournaments, players=[]):
+    def __init__(self, tournaments, players=[], window=None):
         """Instantiate an observed metagame.
         
         tournaments: A list of Tournament objects.
-        players: An optional list of players to restrict the field to."""
+        players: An optional list of players to restrict the field to.
+        window: Optional (format, source, begin, end) tuple, given when the
+            tournaments are exactly those returned by getTournaments with
+            those arguments, so that matchups can be read from the matchup
+            cube instead of scanning every match."""
         self.tournaments = set(tournaments)
         self.tids = [ t.id for t in self.tournaments ]
-        self.decks = []
-        self.matches = []
+        self._decks = None
+        self._matches = None
         self.archetypes = { }
         self.matchups = { }
         self.players = players
+        self.window = window
+        self.skillModel = None
         self.scg = True
         self.beginning = None
         self.end = None
         for t in self.tournaments:
-            self.decks.extend(t.decks)
             self.scg = self.scg and t.source == 'SCG'
             if self.beginning is None or t.date < self.beginning:
                 self.beginning = t.date
             if self.end is None or t.date > self.end:
                 self.end = t.date
-        for t in self.tournaments:
-            self.matches.extend(t.matches)
         self.total = 0
         #Compute the metagame. 
-        deckq = deckQuery(tournaments=self.tournaments, players=self.players)\
-            .from_self(DBDeck.archetype, DBDeck.subarchetype, func.count('*'))\
-            .group_by(DBDeck.archetype, DBDeck.subarchetype)
+        if not self.players and hasTable('ArchetypeTotals'):
+            # Sum the precomputed per-tournament totals
+            deckq = [ row[:3] for row in getArchetypeTotals(self.tids) ]
+        else:
+            deckq = deckQuery(tournaments=self.tournaments, players=self.players)\
+                .from_self(DBDeck.archetype, DBDeck.subarchetype, func.count('*'))\
+                .group_by(DBDeck.archetype, DBDeck.subarchetype)
         for main, sub, count in deckq:
             if main not in self.archetypes:
                 self.archetypes[main] = {}
             self.archetypes[main][sub] = count
             self.total += count
 
+    @property
+    def decks(self):
+        """All decks in this metagame's tournaments (loaded on first use)."""
+        if self._decks is None:
+            self._decks = []
+            for t in self.tournaments:
+                self._decks.extend(t.decks)
+        return self._decks
+
+    @property
+    def matches(self):
+        """All matches in this metagame's tournaments (loaded on first use)."""
+        if self._matches is None:
+            self._matches = []
+            for t in self.tournaments:
+                self._matches.extend(t.matches)
+        return self._matches
+
     def getSingleMatches(self, deck1, sub1, deck2, sub2):
         """Get Match objects for deck1,sub1 against deck2,sub2."""
         sublist1 = []
@@ -100,7 +126,14 @@ class DBMeta(ObservedMeta):
         deck2: Deck 2
         sub1:  Subarchetype 1
         sub2:  Subarchetype 2
-        datatype:  Type of result. Default is Decimal; float may be faster."""
+        datatype:  Type of result. Default is Decimal; float may be faster.
+
+        If a skill model has been set (see adjustForSkill), archetype
+        matchups come from it, as in getMultipleMatchups."""
+        if self.skillModel is not None and deck2 and not sub1 and not sub2:
+            adjusted = self.skillModel.matchup(deck1, deck2)
+            if adjusted is not None:
+                return datatype(adjusted)
         return mwp(self.getSingleMatches(deck1, sub1, deck2, sub2), datatype)
 
     def getFloatMatchup(self, deck1, deck2, sub1=None, sub2=None):
@@ -117,6 +150,24 @@ class DBMeta(ObservedMeta):
         matches = self.getAggregateMatches(sub1, group1, sub2, group2)
         return mwp(matches)
 
+    def getMatchupRecords(self, decks1, decks2, fromSub=False):
+        """Get match records for all combinations of decks in one group and
+        decks in another, as { d1: { d2: (win, loss, draw) } }, where d1 is
+        an (archetype, subarchetype) pair if fromSub is set."""
+        if self.window and hasTable('MatchupCube'):
+            result = getMatchTotalsByDate(*self.window, decks1, decks2, fromSub)
+        else:
+            result = getMatchTotals(self.tids, decks1, decks2, fromSub)
+        records = {}
+        for row in result:
+            if fromSub:
+                d1, s1, d2, win, loss, draw = row
+                d1 = (d1, s1)
+            else:
+                d1, d2, win, loss, draw = row
+            records.setdefault(d1, {})[d2] = (win, loss, draw)
+        return records
+
     def getMultipleMatchups(self, decks1, decks2, fromSub=False, correction=0):
         """Get MWPs for all combinations of decks in one group and decks
         in another, broken down by archetype.
@@ -124,23 +175,31 @@ class DBMeta(ObservedMeta):
         decks1: List of 'from' archetypes.
         decks2: List of 'to' archetypes.
         fromSub: Break down 'from' decks by subarchetype.
+
+        If a skill model has been set (see adjustForSkill), archetype
+        matchups come from it instead, with pilot skill factored out.
         """
-        result = getMatchTotals(self.tids, decks1, decks2, fromSub)
+        records = self.getMatchupRecords(decks1, decks2, fromSub)
         matchups = {}
-        if fromSub:
-            for d1, d2, s1, win, loss, draw in result:
-                win += correction
-                loss += correction
-                matchups[(d1,s1)] = matchups.get((d1,s1), {})
-                matchups[(d1,s1)][d2] = mwp_record(win, loss, draw)
-        else:
-            for d1, d2, win, loss, draw in result:
-                win += correction
-                loss += correction
-                matchups[d1] = matchups.get(d1, {})
-                matchups[d1][d2] = mwp_record(win, loss, draw)
+        for d1 in records:
+            matchups[d1] = {}
+            for d2, (win, loss, draw) in records[d1].items():
+                adjusted = None
+                if self.skillModel is not None and not fromSub:
+                    adjusted = self.skillModel.matchup(d1, d2)
+                if adjusted is None:
+                    matchups[d1][d2] = mwp_record(win + correction, loss + correction, draw)
+                else:
+                    matchups[d1][d2] = Decimal(adjusted)
         return matchups
 
+    def adjustForSkill(self, model):
+        """Report matchups from a SkillModel (see metatools.skillmodel), which
+        separates archetype matchups from the skill of the players piloting
+        them. Pass None to go back to raw match records."""
+        self.skillModel = model
+        self.invalidate()
+
     def factory(self, correction=0):
         """Initialize a MetaFactory based on this Metagame. Ignores subarchetypes."""
         decknames = sorted(self.archetypes.keys())
@@ -80,6 +80,26 @@ class Card(object):
         """Get the note."""
         return self.note
 
+def playerKey(name):
+    """Normalized form of a player name, used to compare names regardless of
+    case and spacing. Stored in the database as Deck.PLAYER_KEY."""
+    if name is None:
+        return None
+    return ' '.join(name.split()).upper()
+
+def playerKeys(names):
+    """Set of player keys for a list of names, for membership tests."""
+    return { playerKey(name) for name in names if name is not None }
+
+def playerKeyRange(prefix):
+    """Bounds (low, high) such that low <= key < high exactly when key starts
+    with the given prefix's player key, for range scans over an index on
+    player keys. Returns None for an empty prefix."""
+    low = playerKey(prefix)
+    if not low:
+        return None
+    return (low, low[:-1] + chr(ord(low[-1]) + 1))
+
 class Deck(object):
     """Represents a deck that was played in a tournament.
 
@@ -101,6 +121,7 @@ class Deck(object):
         self.initialize()
         self.place = place
         self.player = player
+        self.playerKey = playerKey(player)
         self.tournament = tournament
         self.record = record
         self.points = points
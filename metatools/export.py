@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Export match data from the database in the formats read by the models in
+inference/: pairwise matchup counts (like inference/data/tmi_counts.csv) and
+per-match pairing records (like inference/data/league_pairings.csv).
+
+Both are built from one pass over getUniqueMatches, so each match is counted
+once even though most are stored twice."""
+
+from metatools.database import getUniqueMatches, toDate
+
+import argparse
+import csv
+import sys
+
+SKIP = set({'Unknown', '(Not Submitted)', ''})
+
+def cleanName(name):
+    """Archetype name as used by the inference scripts."""
+    return (name or '').replace('"', '').replace(',', '').strip().lower()
+
+def roundNumber(value):
+    """Swiss round number, or None for playoff and other unnumbered rounds."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def matchupCounts(matches):
+    """Total decided matches between each pair of different archetypes.
+    Returns (deck1, deck2, n, w) tuples, where w is deck1's match wins out of
+    n, sorted by decreasing n. Each pair appears once, in alphabetical order;
+    draws are left out."""
+    counts = {}
+    for row in matches:
+        a, b = row[5], row[7]
+        if a in SKIP or b in SKIP:
+            continue
+        a, b = cleanName(a), cleanName(b)
+        win, loss = row[8], row[9]
+        if a == b or win == loss:
+            continue
+        if a > b:
+            a, b, win, loss = b, a, loss, win
+        n, w = counts.get((a, b), (0, 0))
+        counts[(a, b)] = (n + 1, w + (1 if win > loss else 0))
+    result = [ (a, b, n, w) for (a, b), (n, w) in counts.items() ]
+    result.sort(key=lambda x: (-x[2], x[0], x[1]))
+    return result
+
+def leagueRecords(matches):
+    """One row per player per Swiss match: the player's record going into the
+    round (w, l), the opponent's archetype, and the opponent's record (opp_w,
+    opp_l). Records only count matches present in the database (so not
+    byes), and unnumbered rounds are skipped."""
+    tournaments = {}
+    for row in matches:
+        r = roundNumber(row[3])
+        if r is not None:
+            tournaments.setdefault(row[0], []).append((r,) + tuple(row))
+    rows = []
+    for tid in sorted(tournaments):
+        records = {}
+        for entry in sorted(tournaments[tid], key=lambda x: x[0]):
+            r, tid, date, source, rnd, d1, a1, d2, a2, win, loss, draw = entry[:12]
+            w1, l1 = records.get(d1, (0, 0))
+            w2, l2 = records.get(d2, (0, 0))
+            date = toDate(date)
+            for w, l, opponent, oppW, oppL in ((w1, l1, a2, w2, l2), (w2, l2, a1, w1, l1)):
+                if opponent in SKIP:
+                    continue
+                rows.append({ 'source': source or '', 'date': str(date) if date else '',
+                    'w': w, 'l': l, 'deck': cleanName(opponent),
+                    'opp_w': oppW, 'opp_l': oppL })
+            if win > loss:
+                records[d1] = (w1 + 1, l1)
+                records[d2] = (w2, l2 + 1)
+            elif loss > win:
+                records[d1] = (w1, l1 + 1)
+                records[d2] = (w2 + 1, l2)
+    return rows
+
+def writeCounts(counts, outfile):
+    writer = csv.writer(outfile, lineterminator='\n')
+    writer.writerow(['deck1', 'deck2', 'n', 'w'])
+    writer.writerows(counts)
+
+def writeRecords(records, outfile):
+    writer = csv.DictWriter(outfile, ['source', 'date', 'w', 'l', 'deck', 'opp_w', 'opp_l'],
+            lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(records)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Export match data for the inference scripts.")
+    p.add_argument("kind", choices=['counts', 'league'],
+            help="counts: matchup counts by archetype pair (deck1,deck2,n,w); "
+            "league: each player's record and opponent in every Swiss match")
+    p.add_argument("-O", "--format", type=str, default='Legacy',
+            help="Tournament format (default: %(default)s)")
+    p.add_argument("-S", "--source", type=str, default=None,
+            help="Only use tournaments from this source, e.g. SCG")
+    p.add_argument("-b", "--begin", type=str, default=None,
+            help="Earliest tournament date, YYYY-MM-DD")
+    p.add_argument("-e", "--end", type=str, default=None,
+            help="Latest tournament date, YYYY-MM-DD")
+    p.add_argument("-o", "--output", type=str, default=None,
+            help="Output file (default: standard output)")
+    args = p.parse_args()
+    matches = getUniqueMatches(args.format, args.source, args.begin, args.end)
+    outfile = open(args.output, 'w', newline='') if args.output else sys.stdout
+    if args.kind == 'counts':
+        writeCounts(matchupCounts(matches), outfile)
+    else:
+        writeRecords(leagueRecords(matches), outfile)
+    if args.output:
+        outfile.close()
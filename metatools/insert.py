@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from metatools.database import *
+from metatools.summaries import updateSummaries
 import argparse
 import datetime
 import csv
@@ -144,6 +145,8 @@ def insertTournament(deckPath, matchPath, tname, tformat, year, month, day, city
                 session.add(match)
 
     tourney.numPlayers = tourney.getNumPlayers()
+    session.flush()
+    updateSummaries([tourney.id])
     print(tourney)
     if not dryRun:
         session.commit()
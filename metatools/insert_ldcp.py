@@ -2,8 +2,10 @@
 """Inserts data exported from spreadsheets in the form produced by the Legacy Data Collection Project."""
 
 from metatools.archetypes import ArchetypeParser
-from metatools.database import session, getDecks, RawMatch
+from metatools.database import session, rawMatches
+from metatools.deck import playerKey
 from metatools.insert import *
+from metatools.summaries import updateSummaries
 
 import argparse
 import csv
@@ -129,6 +131,7 @@ def insertLDCPTournament(session, filename, nameArg=None, formatArg=None, dateAr
             decoded_to_indices[decoded] = name_to_indices[name]
     nDecks = 0
     nDecklists = 0
+    player_decks = {}
     renamed = []
     fallbacks_used = {}
     for playerName, deckName, place in parseChallengeDecks(filename):
@@ -186,23 +189,33 @@ def insertLDCPTournament(session, filename, nameArg=None, formatArg=None, dateAr
                         print(f"WARNING: {e} (using {fallback})")
                         deck.archetype = fallback
         session.add(deck)
+        player_decks.setdefault(playerKey(playerName), deck)
         nDecks += 1
     tourney.numPlayers = nDecks
     session.flush()
-    nMatches = 0
+    match_rows = []
+    unresolved = {}
     for p1, p2, w, l, d, r in parseChallengeMatches(filename):
-        d1 = getDecks(tournaments=[tourney], players=[p1])
-        d2 = getDecks(tournaments=[tourney], players=[p2])
-        if len(d1) == 0:
-            raise Exception(f"Unexpected player name '{p1}' in match history")
-        if len(d2) == 0:
-            raise Exception(f"Unexpected player name '{p2}' in match history (round {r} opponent for {p1})")
-        match = RawMatch(d1[0], d2[0], w, l, d, r)
-        session.add(match)
+        d1 = player_decks.get(playerKey(p1))
+        d2 = player_decks.get(playerKey(p2))
+        if d1 is None:
+            unresolved.setdefault(p1, []).append(f"round {r} (as player)")
+        if d2 is None:
+            unresolved.setdefault(p2, []).append(f"round {r} opponent for {p1}")
+        if d1 is None or d2 is None:
+            continue
+        match_rows.append({'T_ID': tourney.id, 'DECK_1': d1.id, 'DECK_2': d2.id,
+            'WIN': w, 'LOSS': l, 'DRAW': d, 'ROUND': r})
         if w > l:
-            d1[0].points += 3
-        nMatches += 1
+            d1.points += 3
+    if unresolved:
+        details = '\n'.join(f"\t'{name}': {'; '.join(where)}" for name, where in sorted(unresolved.items()))
+        raise Exception(f"{len(unresolved)} unexpected player name(s) in match history:\n{details}")
+    if match_rows:
+        session.execute(rawMatches.insert(), match_rows)
+    nMatches = len(match_rows)
     session.flush()
+    updateSummaries([tourney.id])
 
     remappings = {key: list(it) for key, it in itertools.groupby(renamed, lambda t: f'{t[2]} -> {t[3]}')}
     for key in sorted(list(remappings.keys())):
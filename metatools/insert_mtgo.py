@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 
 from metatools.archetypes import ArchetypeParser
+from metatools.bulk import BulkWriter, classifyRecord, tournamentKey
 from metatools.database import *
 
 import argparse
 import datetime
 import json
+import multiprocessing
 import re
 import sys
 
@@ -18,28 +20,28 @@ def extract_format(name):
             return match.group(1)
     return None
 
-def load_json(filename):
-    json_data = None
-    with open(filename, 'r') as f:
-        json_data = json.load(f)
+def read_json(filename, json_data=None):
+    """Parse a tournament JSON file into a plain record suitable for the BulkWriter.
+    If the file's contents have already been loaded, pass them as json_data."""
+    if json_data is None:
+        with open(filename, 'r') as f:
+            json_data = json.load(f)
     tname = json_data['Tournament']['Name']
     tdate = datetime.date.fromisoformat(json_data['Tournament']['Date'][:10])
-    tformat = '?'
     standings = {}
     if json_data.get('Standings', None) is not None:
         for standing in json_data['Standings']:
             standings[standing['Player']] = (standing['Rank'], standing['Points'])
-    tournament = DBTournament(name=tname, date=tdate, format=extract_format(tname),
-            numPlayers=len(standings))
-    decks = {}
-    contents = {}
+    tournament = {'name': tname, 'date': tdate, 'format': extract_format(tname),
+            'numPlayers': len(standings)}
+    decks = []
+    index = {}
     for d in json_data['Decks']:
         place, points = standings.get(d['Player'], (None, None))
-        decks[d['Player']] = DBDeck(place=place, player=d['Player'], tournament=tournament,
-                points=points)
+        deck = {'place': place, 'player': d['Player'], 'points': points}
         if 'Result':
             if '-' in d['Result']:
-                decks[d['Player']].record = d['Result']
+                deck['record'] = d['Result']
             else:
                 d['Result']
         decklist = {}
@@ -51,12 +53,18 @@ def load_json(filename):
             name = main['CardName']
             md, sb = decklist.get(name, (0, 0))
             decklist[name] = (md, sb+main['Count'])
-        contents[d['Player']] = decklist
+        deck['slots'] = decklist
+        if d['Player'] in index:
+            decks[index[d['Player']]] = deck
+        else:
+            index[d['Player']] = len(decks)
+            decks.append(deck)
     for player_name in standings:
-        if player_name not in decks:
+        if player_name not in index:
             print(f'Adding empty unknown deck for player {player_name}')
             place, points = standings[player_name]
-            decks[player_name] = DBDeck(place=place, player=player_name, tournament=tournament, points=points)
+            index[player_name] = len(decks)
+            decks.append({'place': place, 'player': player_name, 'points': points})
     matches = []
     if json_data.get('Bracket', None) is not None:
         for key in json_data['Bracket'].keys():
@@ -70,8 +78,10 @@ def load_json(filename):
                 else:
                     w = int(parts[0].strip())
                     l = int(parts[1].strip())
-                    matches.append(RawMatch(decks[match_data['Player1']], decks[match_data['Player2']], w, l, 0, key))
-                    matches.append(RawMatch(decks[match_data['Player2']], decks[match_data['Player1']], l, w, 0, key))
+                    i1 = index[match_data['Player1']]
+                    i2 = index[match_data['Player2']]
+                    matches.append((i1, i2, w, l, 0, key))
+                    matches.append((i2, i1, l, w, 0, key))
     if json_data.get('Rounds', None) is not None:
         n_rounds = 0
         for round_data in json_data['Rounds']:
@@ -81,7 +91,7 @@ def load_json(filename):
                 parts = match_data['Result'].split('-')
                 if len(parts) != 2 and len(parts) != 3:
                     print(f"ERROR: couldn't parse match result {match_data['Result']}")
-                elif match_data['Player2'] not in decks:
+                elif match_data['Player2'] not in index:
                     if match_data['Player2'].strip() != '-' \
                             and match_data['Player2'].lower().strip() != 'bye' \
                             and match_data['Player2'].strip() != '':
@@ -90,9 +100,33 @@ def load_json(filename):
                     w = int(parts[0].strip())
                     l = int(parts[1].strip())
                     d = 0 if len(parts) < 3 else int(parts[2].strip())
-                    matches.append(RawMatch(decks[match_data['Player1']], decks[match_data['Player2']], w, l, d, round_name))
-                    matches.append(RawMatch(decks[match_data['Player2']], decks[match_data['Player1']], l, w, d, round_name))
-    return tournament, decks, matches, contents
+                    i1 = index[match_data['Player1']]
+                    i2 = index[match_data['Player2']]
+                    matches.append((i1, i2, w, l, d, round_name))
+                    matches.append((i2, i1, l, w, d, round_name))
+    return {'tournament': tournament, 'decks': decks, 'matches': matches}
+
+_worker_parser = None
+_worker_ingested = set()
+
+def _init_worker(archetype_dir, ingested):
+    global _worker_parser, _worker_ingested
+    _worker_parser = ArchetypeParser(archetype_dir) if archetype_dir else None
+    _worker_ingested = ingested
+
+def _process_file(filename):
+    """Worker task: parse and classify one file. Returns (filename, record), with
+    record set to None if the tournament has already been ingested."""
+    with open(filename, 'r') as f:
+        json_data = json.load(f)
+    header = json_data['Tournament']
+    key = tournamentKey(header['Name'], datetime.date.fromisoformat(header['Date'][:10]))
+    if key in _worker_ingested:
+        return filename, None
+    record = read_json(filename, json_data)
+    if _worker_parser is not None:
+        classifyRecord(record, _worker_parser)
+    return filename, record
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser(description="Insert tournament(s) in JSON format such as from the "
@@ -101,31 +135,32 @@ if __name__ == "__main__":
             help="Archetype parsing rule directory, such as from the MTGOArchetypeParser project")
     p.add_argument("-D", "--dry_run", action="store_true",
             help="Perform a dry run: parse the data, but don't commit anything to the database")
+    p.add_argument("-b", "--batch_size", type=int, default=50,
+            help="Number of tournaments to insert per transaction (default: %(default)s)")
+    p.add_argument("-j", "--jobs", type=int, default=None,
+            help="Number of worker processes used to parse and classify files "
+            "(default: number of CPUs)")
     p.add_argument("files", nargs="+", help="JSON file(s) containing tournament(s)")
     args = p.parse_args()
-    if args.archetypes:
-        archetype_parser = ArchetypeParser(args.archetypes)
+    writer = BulkWriter(session, batchSize=args.batch_size, dryRun=args.dry_run)
+    writer.total = len(args.files)
+    init_args = (args.archetypes, writer.ingested)
+    if args.jobs == 1:
+        _init_worker(*init_args)
+        results = map(_process_file, args.files)
+        pool = None
     else:
-        archetype_parser = False
-    for filename in args.files:
-        tournament, decks, matches, contents = load_json(filename)
-        session.add(tournament)
-        for player in decks:
-            if player in contents:
-                slots = []
-                for card in contents[player]:
-                    slot = Slot()
-                    slot.cardname = card
-                    slot.main, slot.side = contents[player][card]
-                    slots.append(slot)
-                decks[player].slots = slots
-                if archetype_parser:
-                    decks[player].loadContents()
-                    decks[player].setArchetype(archetype_parser.classify(decks[player]))
-            session.add(decks[player])
-        for m in matches:
-            session.add(m)
-        if not args.dry_run:
-            session.commit()
-        print(tournament)
-        print(f'{len(tournament.decks)} decks, {len(matches)} matches')
+        pool = multiprocessing.Pool(args.jobs, initializer=_init_worker, initargs=init_args)
+        results = pool.imap(_process_file, args.files, chunksize=4)
+    try:
+        for filename, record in results:
+            if record is None:
+                print(f'Skipping {filename}: already in the database')
+                writer.skip()
+            elif not writer.add(record):
+                print(f'Skipping {filename}: duplicate tournament')
+        writer.close()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -4,6 +4,7 @@ from .util import mwp
 from decimal import *
 from math import floor
 from numpy.random import multinomial
+import numpy
 from csv import DictReader
 from sys import stderr
 
@@ -28,6 +29,105 @@ class Metagame(object):
             for sub in self.archetypes[main]:
                 self.total += self.archetypes[main][sub]
 
+    @property
+    def archetypes(self):
+        return self._archetypes
+
+    @archetypes.setter
+    def archetypes(self, decks):
+        self._archetypes = decks
+        self.invalidate()
+
+    @property
+    def matchups(self):
+        return self._matchups
+
+    @matchups.setter
+    def matchups(self, matchups):
+        self._matchups = matchups
+        self.invalidate()
+
+    def invalidate(self):
+        """Discard cached matchup matrices. Called automatically when
+        archetypes or matchups are replaced; call it explicitly after
+        modifying either dictionary in place."""
+        self._matrices = None
+        self._memo = {}
+
+    def _buildMatrices(self):
+        """Precompute float matchup matrices from the matchup dictionary, with
+        the subarchetype weights used by getFloatMatchup folded in:
+            sub[i, j]:   (main_i, sub_i) vs (main_j, sub_j)
+            mixed[i, b]: (main_i, sub_i) vs archetype b (sub2=None)
+            arch[a, b]:  archetype a vs archetype b (sub1=sub2=None)
+        Entries which the dictionary can't supply are NaN."""
+        keys = [ (main, sub) for main in self.archetypes for sub in self.archetypes[main] ]
+        names = list(self.archetypes)
+        subIndex = { k: i for i, k in enumerate(keys) }
+        archIndex = { name: i for i, name in enumerate(names) }
+        n = len(keys)
+        sub = numpy.full((n, n), numpy.nan)
+        for i, (main1, sub1) in enumerate(keys):
+            row = self.matchups.get(main1, {}).get(sub1, {})
+            for main2 in row:
+                for sub2 in row[main2]:
+                    j = subIndex.get((main2, sub2))
+                    if j is not None:
+                        sub[i, j] = float(row[main2][sub2])
+        # weight[j] = subPercent(main_j, sub_j) / (number of subarchetypes of main_j)
+        weight = numpy.full(n, numpy.nan)
+        members = [ [] for name in names ]
+        for j, (main, s) in enumerate(keys):
+            members[archIndex[main]].append(j)
+            total = self.getCount(main)
+            if total:
+                weight[j] = self.getCount(main, s) / total / len(self.archetypes[main])
+        mixed = numpy.full((n, len(names)), numpy.nan)
+        for b, cols in enumerate(members):
+            if cols:
+                mixed[:, b] = sub[:, cols] @ weight[cols]
+        arch = numpy.full((len(names), len(names)), numpy.nan)
+        for a, rows in enumerate(members):
+            if rows:
+                arch[a, :] = weight[rows] @ mixed[rows, :]
+        self._matrices = (keys, subIndex, names, archIndex, sub, mixed, arch)
+        return self._matrices
+
+    def _lookupFloat(self, deck1, deck2, sub1, sub2):
+        """Float matchup from the precomputed matrices, or None if it isn't
+        available there (in which case the dictionary is authoritative)."""
+        matrices = self._matrices
+        if matrices is None:
+            matrices = self._buildMatrices()
+        keys, subIndex, names, archIndex, sub, mixed, arch = matrices
+        try:
+            if sub1 is None and sub2 is None:
+                value = arch[archIndex[deck1], archIndex[deck2]]
+            elif sub2 is None:
+                value = mixed[subIndex[(deck1, sub1)], archIndex[deck2]]
+            elif sub1 is None:
+                value = 1 - mixed[subIndex[(deck2, sub2)], archIndex[deck1]]
+            else:
+                value = sub[subIndex[(deck1, sub1)], subIndex[(deck2, sub2)]]
+        except KeyError:
+            return None
+        if numpy.isnan(value):
+            return None
+        return float(value)
+
+    def archetypeMatrix(self):
+        """Return (archetype names, matrix) where matrix[i][j] is the float
+        MWP of archetype i against archetype j, averaged over subarchetypes as
+        in getFloatMatchup(deck1, deck2, None, None). Missing entries are NaN."""
+        matrices = self._matrices if self._matrices is not None else self._buildMatrices()
+        return matrices[2], matrices[6]
+
+    def subarchetypeMatrix(self):
+        """Return ((archetype, subarchetype) keys, matrix) of float MWPs
+        between individual subarchetypes. Missing entries are NaN."""
+        matrices = self._matrices if self._matrices is not None else self._buildMatrices()
+        return matrices[0], matrices[4]
+
     @staticmethod
     def fromList(decks, counts, matchups):
         """Initialize a Metagame from a series of lists. Cannot specify
@@ -140,6 +240,14 @@ class Metagame(object):
         deck2: Deck 2
         sub1:  Subarchetype 1
         sub2:  Subarchetype 2"""
+        key = (deck1, deck2, sub1, sub2, getcontext().prec)
+        if key in self._memo:
+            return self._memo[key]
+        result = self._computeSingleMatchup(deck1, deck2, sub1, sub2)
+        self._memo[key] = result
+        return result
+
+    def _computeSingleMatchup(self, deck1, deck2, sub1, sub2):
         if sub2 is None and sub1 is None:
             total = 0
             for sub1 in self.archetypes[deck1]:
@@ -161,6 +269,9 @@ class Metagame(object):
 
     def getFloatMatchup(self, deck1, deck2, sub1='', sub2=''):
         """Float version of getSingleMatchup. Less precise but faster."""
+        value = self._lookupFloat(deck1, deck2, sub1, sub2)
+        if value is not None:
+            return value
         if sub2 is None and sub1 is None:
             total = 0.0
             for sub1 in self.archetypes[deck1]:
@@ -240,7 +351,7 @@ class Metagame(object):
         undefeated; and 3) mapping each deck to a ratio of current field
         presence to original field presence.
         
-        Assumes a single-eliminatino tournament with a number of players
+        Assumes a single-elimination tournament with a number of players
         equal to some power of two."""
         precision = getcontext().prec
         getcontext().prec = 50
@@ -271,13 +382,13 @@ class Metagame(object):
         # alive[i][deck] = alive[i-1][deck] * winp[i-1][deck]
         # field[i][deck] = alive[i][deck] * field[0][deck] * 2^i
         # norm[i][deck] = field[i][deck] / field[0][deck]
-        print >> stderr, 0, sum(field[0].values())
+        print(0, sum(field[0].values()), file=stderr)
         for i in range(1, numrounds+1):
             for deck in self.archetypes:
                 alive[i][deck] = alive[i-1][deck] * winp[i-1][deck]
                 field[i][deck] = alive[i][deck] * field[0][deck] * (2**i)
                 norm[i][deck] = field[i][deck] / field[0][deck]
-            print >> stderr, i, sum(field[i].values())
+            print(i, sum(field[i].values()), file=stderr)
             for deck in self.archetypes:
                 winp[i][deck] = 0
                 for deck2 in self.archetypes:
@@ -307,10 +418,11 @@ class ObservedMeta(Metagame):
         self.matchups = {}
         self.archetypes = {}
         self.total = 0
+        keys = playerKeys(players)
         #Compute the metagame. 
         for tournament in self.tournaments:
             for deck in tournament:
-                if self.players and deck.player not in self.players:
+                if keys and deck.playerKey not in keys:
                     continue
                 main = deck.archetype
                 sub = deck.subarchetype
@@ -327,11 +439,12 @@ class ObservedMeta(Metagame):
         types: return only those Decks with the listed archetypes
         players: return only those Decks with the listed players"""
         decks = []
+        keys = playerKeys(players)
         for t in self.tournaments:
             for d in t.decks:
                 if types and d.archetype not in types:
                     continue
-                if players and d.player not in players:
+                if keys and d.playerKey not in keys:
                     continue
                 decks.append(d)
         return decks
@@ -351,11 +464,12 @@ class PairedMeta(Metagame):
         self.total = 0
         self.d1s = []
         self.d2s = {}
+        keys = playerKeys(players)
         #Compute the metagame. 
         for d1 in decks:
             for match in d1.matches:
                 d2 = match.deck2
-                if self.players and d2.player not in self.players:
+                if keys and d2.playerKey not in keys:
                     continue
                 main = d2.archetype
                 sub = d2.subarchetype
@@ -374,7 +488,7 @@ class MetaFactory(object):
     """An object that can instantiate Metagames, based on some
     configuration."""
 
-    def __init__(self, decknames, pvalues, matchups):
+    def __init__(self, decknames, pvalues, matchups, seed=None):
         """Create a MetaFactory, which can create Metagames.
 
         decknames: A list of archetype names.
@@ -382,10 +496,27 @@ class MetaFactory(object):
             appropriate deck in decknames. Should sum to 1.
         matchups: A 2D array of matchups, ordered in the same way, e.g.
             (1vs1, 1vs2, 1vs3), (2vs1, 2vs2, 2vs3), (3vs1, 3vs2, 3vs3))
-            Should be fully specified."""
+            Should be fully specified.
+        seed: Seed or numpy Generator used by the batched sampling methods."""
         self.decknames = decknames
         self.p = pvalues
-        self.matchups = self.matchupGen(matchups)
+        # Shared, read-only matchup matrix and field shares as floats
+        self.matrix = numpy.array([ [ float(m) for m in row ] for row in matchups ])
+        self.matrix.flags.writeable = False
+        shares = numpy.array([ float(x) for x in pvalues ])
+        self.shares = shares / shares.sum()
+        self.shares.flags.writeable = False
+        self.rng = seed if isinstance(seed, numpy.random.Generator) else numpy.random.default_rng(seed)
+        self._matchupList = matchups
+        self._matchups = None
+
+    @property
+    def matchups(self):
+        """Matchups in the nested dictionary form used by Metagame, built on
+        first use."""
+        if self._matchups is None:
+            self._matchups = self.matchupGen(self._matchupList)
+        return self._matchups
 
     def matchupGen(self, matchups):
         """Take a 2D array of matchups and turn it into a dictionary
@@ -400,6 +531,68 @@ class MetaFactory(object):
                 sub[name][''][name2] = {'': mp}
         return sub
 
+    def sampleShares(self, k, concentration=None):
+        """Draw k field compositions as a (k, archetypes) array of shares.
+        If concentration is given, shares are drawn from a Dirichlet
+        distribution centered on the factory's proportions, with that total
+        concentration (larger means less uncertainty); otherwise every row is
+        the factory's proportions."""
+        if concentration is None:
+            return numpy.broadcast_to(self.shares, (k, len(self.shares)))
+        alpha = numpy.maximum(self.shares * concentration, 1e-9)
+        return self.rng.dirichlet(alpha, size=k)
+
+    def sampleCounts(self, n, k=1, concentration=None):
+        """Draw k fields of n players as a (k, archetypes) array of counts,
+        optionally with Dirichlet uncertainty on the shares (see
+        sampleShares)."""
+        return self.rng.multinomial(n, self.sampleShares(k, concentration))
+
+    def sampleMatrices(self, k, strength=None):
+        """Draw k matchup matrices as a (k, archetypes, archetypes) array.
+        If strength is given, each matchup above the diagonal is drawn from a
+        Beta distribution with the factory's matchup as its mean and strength
+        as its effective number of matches (a scalar or a matrix), and the
+        matchup below the diagonal is its complement. Otherwise every matrix
+        is the factory's (read-only) matrix."""
+        A = len(self.decknames)
+        if strength is None:
+            return numpy.broadcast_to(self.matrix, (k, A, A))
+        strength = numpy.broadcast_to(numpy.asarray(strength, dtype=float), (A, A))
+        i, j = numpy.triu_indices(A, 1)
+        mean = numpy.clip(self.matrix[i, j], 1e-9, 1 - 1e-9)
+        draws = self.rng.beta(mean * strength[i, j], (1 - mean) * strength[i, j], size=(k, len(i)))
+        matrices = numpy.empty((k, A, A))
+        matrices[:] = self.matrix
+        matrices[:, i, j] = draws
+        matrices[:, j, i] = 1 - draws
+        return matrices
+
+    def sampleEnsemble(self, k, n=None, concentration=None, strength=None):
+        """Draw k metagames at once: returns (shares or counts, matrices),
+        where the first is a (k, archetypes) array of shares (or counts of n
+        players, if n is given) and matrices is (k, archetypes, archetypes)."""
+        if n is None:
+            fields = self.sampleShares(k, concentration)
+        else:
+            fields = self.sampleCounts(n, k, concentration)
+        return fields, self.sampleMatrices(k, strength)
+
+    def expectedWinRates(self, fields=None, matrices=None):
+        """Expected match win rate of each archetype against a random
+        opponent from the field, for every sampled metagame at once.
+        fields: (k, archetypes) shares or counts (default: the factory's
+            proportions).
+        matrices: (k, archetypes, archetypes) or a single matrix (default:
+            the factory's matrix).
+        Returns a (k, archetypes) array."""
+        fields = self.shares[None, :] if fields is None else numpy.asarray(fields, dtype=float)
+        fields = fields / fields.sum(axis=-1, keepdims=True)
+        matrices = self.matrix if matrices is None else numpy.asarray(matrices)
+        if matrices.ndim == 2:
+            return fields @ matrices.T
+        return numpy.einsum('kij,kj->ki', matrices, fields)
+
     def countGen(self, counts):
         """Take a list of counts and turn it into a dictionary that
         Metagame will be able to interpret."""
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Create any summary tables missing from an existing database and backfill
+them from the Deck and Matches tables, and add and fill in the normalized
+player key column on Deck. Safe to rerun."""
+
+from metatools.database import session, engine, sql, param, archetypeTotals, matchupCube, \
+        playerKey
+from metatools.summaries import updateSummaries, updateArchetypeTotals, rebuildMatchupCube
+
+import argparse
+
+summaryTables = [ archetypeTotals, matchupCube ]
+
+def createSummaryTables():
+    """Create missing summary tables. Returns the tables that were created."""
+    created = []
+    for table in summaryTables:
+        if not engine.has_table(table.name):
+            table.create(bind=engine)
+            created.append(table)
+    return created
+
+def addPlayerKey(batchSize=10000):
+    """Add the PLAYER_KEY column and its index to Deck if they're missing, and
+    fill in the key for any deck that doesn't have one yet."""
+    columns = sql('select * from Deck limit 0').keys()
+    if 'PLAYER_KEY' not in columns:
+        sql('alter table Deck add column PLAYER_KEY varchar(255) default null')
+        print('Added column Deck.PLAYER_KEY')
+    sql('create index if not exists Deck_playerKey on Deck (PLAYER_KEY)')
+    session.commit()
+    total = 0
+    while True:
+        rows = list(sql(f"""select DECK_ID, PLAYER_NAME from Deck where PLAYER_KEY is null
+            and PLAYER_NAME is not null limit {int(batchSize)}"""))
+        if not rows:
+            break
+        sql(f'update Deck set PLAYER_KEY = {param} where DECK_ID = {param}',
+                [ (playerKey(name), did) for did, name in rows ])
+        session.commit()
+        total += len(rows)
+        print(f'{total} player keys filled in')
+
+def backfill(tids=None, batchSize=200):
+    """Recompute summaries for the given tournaments, committing after each
+    batch. By default, rebuild everything: per-tournament totals in batches,
+    then the matchup cube once per (format, source)."""
+    if tids is not None:
+        for i in range(0, len(tids), batchSize):
+            updateSummaries(tids[i:i+batchSize])
+            session.commit()
+            print(f'{min(i+batchSize, len(tids))}/{len(tids)} tournaments summarized')
+        return
+    tids = [ row[0] for row in sql("select T_ID from Tournament order by T_ID") ]
+    for i in range(0, len(tids), batchSize):
+        updateArchetypeTotals(tids[i:i+batchSize])
+        session.commit()
+        print(f'{min(i+batchSize, len(tids))}/{len(tids)} tournaments summarized')
+    for format, source in list(sql("select distinct FORMAT, SOURCE from Tournament")):
+        rebuildMatchupCube(format, source)
+        session.commit()
+        print(f'Rebuilt matchup cube for format={format}, source={source}')
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Create and backfill summary tables "
+            "(archetype totals and the matchup cube) used to speed up metagame queries.")
+    p.add_argument("-b", "--batch_size", type=int, default=200,
+            help="Number of tournaments to summarize per transaction (default: %(default)s)")
+    p.add_argument("t_ids", type=int, nargs="*",
+            help="Only backfill these tournaments (default: all)")
+    args = p.parse_args()
+    addPlayerKey()
+    for table in createSummaryTables():
+        print(f'Created table {table.name}')
+    backfill(args.t_ids if args.t_ids else None, args.batch_size)
@@ -0,0 +1,192 @@
+"""Monte Carlo estimates of tournament outcomes by archetype.
+
+Trials are split into chunks, each simulated by a SwissSimulator in a worker
+process with its own random stream spawned from a single seed, so results are
+reproducible for a given seed and chunk size regardless of how many workers
+are used. Per-trial summaries are streamed back and aggregated in chunk order.
+"""
+
+from metatools.meta import Metagame, MetaFactory
+from metatools.simulate import SwissSimulator
+
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+import numpy
+import os
+
+def _factorySpec(factory, players, concentration, strength):
+    names = list(factory.decknames)
+    return { 'keys': names, 'counts': None, 'matrix': factory.matrix, 'names': names,
+            'factory': factory, 'players': players, 'concentration': concentration,
+            'strength': strength }
+
+def _metaSpec(meta):
+    keys, matrix = meta.subarchetypeMatrix()
+    counts = [ meta.archetypes[main][sub] for main, sub in keys ]
+    return { 'keys': keys, 'counts': counts, 'matrix': matrix,
+            'names': list(meta.archetypes), 'factory': None, 'players': None }
+
+def _runChunk(spec, trials, rounds, cut, seedSequence):
+    """Worker task: simulate one chunk of trials and return its per-trial
+    summaries."""
+    rng = numpy.random.default_rng(seedSequence)
+    if spec['factory'] is None:
+        simulator = SwissSimulator(spec['keys'], spec['counts'], spec['matrix'],
+                names=spec['names'], seed=rng)
+        return simulator.simulate(trials, rounds, cut, tops=(8,))
+    # Sample a field (and possibly matchups) for each trial from the factory
+    factory = copy(spec['factory'])
+    factory.rng = rng
+    counts, matrices = factory.sampleEnsemble(trials, spec['players'],
+            spec['concentration'], spec['strength'])
+    simulator = SwissSimulator(spec['keys'], numpy.zeros(len(spec['keys']), dtype=int),
+            spec['matrix'], names=spec['names'], seed=rng)
+    types = numpy.stack([ numpy.repeat(numpy.arange(len(spec['keys'])), c) for c in counts ])
+    if spec['strength'] is None:
+        matrices = None
+    return simulator.simulate(trials, rounds, cut, tops=(8,), types=types, matrices=matrices)
+
+class _Accumulator(object):
+    """Running sums needed for means and standard errors of per-trial
+    statistics, including ratio estimates (e.g. top 8 decks / decks)."""
+
+    def __init__(self, A):
+        self.n = 0
+        self.sums = {}
+        self.wins = None
+        self.winners = numpy.zeros(A)
+
+    def _add(self, name, values):
+        if name not in self.sums:
+            self.sums[name] = numpy.zeros(values.shape[1])
+        self.sums[name] += values.sum(axis=0)
+
+    def add(self, result):
+        field = result['field'].astype(float)
+        top = result['top'][8].astype(float)
+        pct = result['percentile']
+        self.n += field.shape[0]
+        for name, values in (('x', field), ('xx', field * field), ('y', top), ('yy', top * top),
+                ('xy', field * top), ('z', pct), ('zz', pct * pct), ('xz', field * pct)):
+            self._add(name, values)
+        self.wins = result['wins'] if self.wins is None else self.wins + result['wins']
+        self.winners += numpy.bincount(result['winner'], minlength=len(self.winners))
+
+    def mean(self, name):
+        return self.sums[name] / self.n
+
+    def error(self, name, square):
+        """Standard error of the mean of a per-trial statistic."""
+        if self.n < 2:
+            return numpy.full(len(self.sums[name]), numpy.inf)
+        var = (self.sums[square] - self.sums[name]**2 / self.n) / (self.n - 1)
+        return numpy.sqrt(numpy.maximum(var, 0) / self.n)
+
+    def ratio(self, y, yy, xy):
+        """Ratio estimate sum(y)/sum(x) and its delta-method standard error."""
+        x = self.sums['x']
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            r = self.sums[y] / x
+            if self.n < 2:
+                return r, numpy.full(len(x), numpy.inf)
+            # Variance of the residuals y - r*x across trials
+            resid = self.sums[yy] - 2*r*self.sums[xy] + r*r*self.sums['xx']
+            var = numpy.maximum(resid, 0) / (self.n - 1)
+            xbar = x / self.n
+            return r, numpy.sqrt(var / self.n) / xbar
+
+def monteCarlo(meta, trials, rounds=None, cut=8, players=None, jobs=None, seed=None,
+        chunk=250, target=None, minTrials=1000, concentration=None, strength=None):
+    """Estimate per-archetype tournament outcomes by simulation.
+
+    meta: A Metagame (fixed field) or a MetaFactory (a field of the given
+        number of players is sampled for every trial).
+    trials: Maximum number of tournaments to simulate.
+    rounds: Number of Swiss rounds (default: ceil(log2(players))).
+    cut: Size of the single elimination playoff.
+    players: Number of players per tournament (required for a MetaFactory).
+    jobs: Number of worker processes (default: number of CPUs; 1 to run in
+        this process).
+    seed: Seed for the random streams; results are reproducible for a given
+        seed and chunk size.
+    chunk: Number of trials per task.
+    target: Stop early once the standard error of every archetype's top 8
+        share is at most this value.
+    minTrials: Don't stop early before this many trials.
+    concentration: For a MetaFactory, Dirichlet concentration of the field
+        shares sampled for each trial (default: no uncertainty in shares).
+    strength: For a MetaFactory, effective number of matches behind each
+        matchup, for Beta uncertainty in the matchups sampled for each trial
+        (default: no uncertainty in matchups).
+
+    Returns a dict with 'names', 'trials', and arrays (one entry per
+    archetype) of 'field', 'top8Share', 'conversion', 'percentile', and
+    'winRate' (share of tournaments won), each with an '...Error' array of
+    standard errors, plus 'wins': an (archetypes, rounds+1) histogram of Swiss
+    match wins."""
+    if isinstance(meta, MetaFactory):
+        if players is None:
+            raise Exception("Number of players is required to sample from a MetaFactory")
+        spec = _factorySpec(meta, players, concentration, strength)
+        n = players
+    else:
+        spec = _metaSpec(meta)
+        n = sum(spec['counts'])
+    if rounds is None:
+        rounds = int(numpy.ceil(numpy.log2(n)))
+    nChunks = (trials + chunk - 1) // chunk
+    seeds = numpy.random.SeedSequence(seed).spawn(nChunks)
+    sizes = [ min(chunk, trials - i*chunk) for i in range(nChunks) ]
+    acc = _Accumulator(len(spec['names']))
+
+    def done():
+        if target is None or acc.n < minTrials:
+            return False
+        return (acc.error('y', 'yy') / 8.0).max() <= target
+
+    if jobs == 1:
+        for i in range(nChunks):
+            acc.add(_runChunk(spec, sizes[i], rounds, cut, seeds[i]))
+            if done():
+                break
+    else:
+        workers = jobs if jobs else os.cpu_count()
+        with ProcessPoolExecutor(workers) as pool:
+            inFlight = {}
+            nextSubmit = 0
+            nextAdd = 0
+            while nextAdd < nChunks:
+                # Keep a couple of chunks queued per worker, so that stopping
+                # early doesn't leave much work to throw away
+                while nextSubmit < nChunks and len(inFlight) < 2 * workers:
+                    inFlight[nextSubmit] = pool.submit(_runChunk, spec, sizes[nextSubmit],
+                            rounds, cut, seeds[nextSubmit])
+                    nextSubmit += 1
+                # Aggregate strictly in chunk order so results don't depend on timing
+                acc.add(inFlight.pop(nextAdd).result())
+                nextAdd += 1
+                if done():
+                    for future in inFlight.values():
+                        future.cancel()
+                    break
+
+    field = acc.mean('x')
+    share = acc.mean('y') / 8.0
+    conversion, conversionError = acc.ratio('y', 'yy', 'xy')
+    percentile, percentileError = acc.ratio('z', 'zz', 'xz')
+    winRate = acc.winners / acc.n
+    return {
+        'names': spec['names'],
+        'trials': acc.n,
+        'field': field,
+        'fieldError': acc.error('x', 'xx'),
+        'top8Share': share,
+        'top8ShareError': acc.error('y', 'yy') / 8.0,
+        'conversion': conversion,
+        'conversionError': conversionError,
+        'percentile': percentile,
+        'percentileError': percentileError,
+        'winRate': winRate,
+        'winRateError': numpy.sqrt(winRate * (1 - winRate) / acc.n),
+        'wins': acc.wins,
+    }
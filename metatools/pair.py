@@ -1,5 +1,234 @@
+"""Swiss pairings.
+
+Players are paired bracket by bracket, from the highest score down, in the
+style of the Dutch system: within each bracket the upper half is matched
+against the lower half by solving an assignment problem whose costs prefer
+the usual 1-vs-(n/2+1) pairings and heavily penalize rematches. Players who
+can only be paired with a rematch float down into the next bracket, and the
+odd player out floats down as well. Most rematches are resolved by
+exchanging opponents between nearby tables first, in which case no assignment
+problem needs to be solved at all.
+
+The assignment only considers pairings between the two halves, so if it still
+leaves rematches, the bracket is paired by a maximum cardinality matching on
+the general graph of allowed pairings (Edmonds' blossom algorithm), starting
+from the assignment's rematch-free pairs. That finds a rematch-free pairing of
+the bracket whenever one exists, and otherwise pairs as many players as
+possible, in time polynomial in the size of the bracket rather than
+exponential as with backtracking."""
+
+from itertools import groupby
+
+import numpy
+from scipy.optimize import linear_sum_assignment
+
+REMATCH_COST = 1e6
+# How far apart two tables can be and still exchange opponents to avoid a rematch
+SWAP_WINDOW = 4
+
+def _assign(s1, s2, opponents):
+    """Solve the assignment of S1 to S2 with rematches penalized. Returns
+    the S2 index for each member of S1 and a rematch matrix."""
+    k = len(s1)
+    s2Index = { id(p): j for j, p in enumerate(s2) }
+    rematch = numpy.zeros((k, k), dtype=bool)
+    for i, p in enumerate(s1):
+        for q in opponents(p):
+            j = s2Index.get(id(q))
+            if j is not None:
+                rematch[i, j] = True
+    idx = numpy.arange(k)
+    cost = numpy.abs(idx[:, None] - idx[None, :]) + REMATCH_COST * rematch
+    rows, assignment = linear_sum_assignment(cost)
+    return list(assignment), lambda i, j: rematch[i, j]
+
+def _maxMatching(n, adjacent, match):
+    """Maximum cardinality matching in a general graph on vertices 0..n-1,
+    where adjacent[v] lists v's neighbors in order of preference. match is a
+    valid initial matching (match[v] is v's partner or -1), which is extended
+    in place by augmenting paths and returned."""
+    def lca(a, b, base, parent):
+        seen = [ False ] * n
+        while True:
+            a = base[a]
+            seen[a] = True
+            if match[a] == -1:
+                break
+            a = parent[match[a]]
+        while True:
+            b = base[b]
+            if seen[b]:
+                return b
+            b = parent[match[b]]
+
+    def markPath(v, b, child, base, parent, blossom):
+        while base[v] != b:
+            blossom[base[v]] = blossom[base[match[v]]] = True
+            parent[v] = child
+            child = match[v]
+            v = parent[match[v]]
+
+    def findPath(root):
+        used = [ False ] * n
+        parent = [ -1 ] * n
+        base = list(range(n))
+        used[root] = True
+        queue = [ root ]
+        head = 0
+        while head < len(queue):
+            v = queue[head]
+            head += 1
+            for to in adjacent[v]:
+                if base[v] == base[to] or match[v] == to:
+                    continue
+                if to == root or (match[to] != -1 and parent[match[to]] != -1):
+                    # Odd cycle: contract the blossom
+                    current = lca(v, to, base, parent)
+                    blossom = [ False ] * n
+                    markPath(v, current, to, base, parent, blossom)
+                    markPath(to, current, v, base, parent, blossom)
+                    for i in range(n):
+                        if blossom[base[i]]:
+                            base[i] = current
+                            if not used[i]:
+                                used[i] = True
+                                queue.append(i)
+                elif parent[to] == -1:
+                    parent[to] = v
+                    if match[to] == -1:
+                        return to, parent
+                    used[match[to]] = True
+                    queue.append(match[to])
+        return -1, parent
+
+    for root in range(n):
+        if match[root] != -1:
+            continue
+        v, parent = findPath(root)
+        # Flip the matching along the augmenting path
+        while v != -1:
+            pv = parent[v]
+            ppv = match[pv]
+            match[v] = pv
+            match[pv] = v
+            v = ppv
+    return match
+
+def _matchBracket(group, pairs, opponents):
+    """Pair as many players in a ranked group as possible without rematches,
+    keeping the given rematch-free pairs where possible. Returns (pairs,
+    unmatched), with each pair's higher-ranked player first and the unmatched
+    players in ranked order."""
+    n = len(group)
+    k = n // 2
+    index = { id(p): i for i, p in enumerate(group) }
+    played = [ { index[id(q)] for q in opponents(p) if id(q) in index } for p in group ]
+    # Prefer opponents close to the usual pairing (i vs. i+k)
+    adjacent = [ sorted((j for j in range(n) if j != i and j not in played[i]),
+        key=lambda j: abs(abs(i - j) - k)) for i in range(n) ]
+    match = [ -1 ] * n
+    for p1, p2 in pairs:
+        i, j = index[id(p1)], index[id(p2)]
+        match[i], match[j] = j, i
+    _maxMatching(n, adjacent, match)
+    matched = [ (group[i], group[j]) for i, j in enumerate(match) if i < j ]
+    unmatched = [ group[i] for i in range(n) if match[i] == -1 ]
+    return matched, unmatched
+
+def _pairBracket(group, opponents, allowRematch, window=SWAP_WINDOW):
+    """Pair a ranked list of players (a score bracket plus any floaters).
+    Returns (pairs, unpaired), where unpaired players should float down."""
+    unpaired = []
+    if len(group) % 2:
+        unpaired.append(group[-1])
+        group = group[:-1]
+    k = len(group) // 2
+    if k == 0:
+        return [], unpaired + group
+    s1 = group[:k]
+    s2 = group[k:]
+    assignment = list(range(k))
+    clash = lambda i, j: s2[j] in opponents(s1[i])
+    # Usually only a few of the default pairings are rematches, and each can be
+    # fixed by exchanging opponents with a nearby table.
+    for i in [ i for i in range(k) if clash(i, i) ]:
+        if not clash(i, assignment[i]):
+            continue
+        for d in range(1, window+1):
+            swapped = False
+            for j in (i+d, i-d):
+                if 0 <= j < k and not clash(i, assignment[j]) and not clash(j, assignment[i]):
+                    assignment[i], assignment[j] = assignment[j], assignment[i]
+                    swapped = True
+                    break
+            if swapped:
+                break
+    if any(clash(i, assignment[i]) for i in range(k)):
+        # Otherwise solve the whole bracket
+        assignment, clash = _assign(s1, s2, opponents)
+    pairs = [ (s1[i], s2[assignment[i]]) for i in range(k) if not clash(i, assignment[i]) ]
+    if len(pairs) == k:
+        return pairs, unpaired
+    # Some pairings need two players from the same half
+    pairs, floaters = _matchBracket(group, pairs, opponents)
+    if allowRematch:
+        # No two of these can avoid a rematch, or the matching would have paired them
+        pairs.extend(zip(floaters[0::2], floaters[1::2]))
+        floaters = []
+    rank = { id(p): r for r, p in enumerate(group) }
+    pairs.sort(key=lambda pair: rank[id(pair[0])])
+    return pairs, floaters + unpaired
+
+def swissPair(players, score=None, opponents=None, alreadyPlayed=None):
+    """Pair players for a Swiss round.
+
+    players: Players in ranked order (highest score first).
+    score: Function giving a player's score, used to split players into
+        brackets. If omitted, all players form one bracket.
+    opponents: Function returning the collection of opponents a player has
+        already faced.
+    alreadyPlayed: Alternatively, a function (p1, p2) that returns whether two
+        players have already played (slower; requires checking every pair).
+
+    Returns (pairs, unpaired): a list of (p1, p2) tuples and a list of at most
+    one leftover player. Rematches only occur if some players can't be paired
+    otherwise."""
+    if opponents is None:
+        if alreadyPlayed is None:
+            opponents = lambda p: ()
+        else:
+            opponents = lambda p: [ q for q in players if q is not p and alreadyPlayed(p, q) ]
+    if score is None:
+        brackets = [ list(players) ]
+    else:
+        brackets = [ list(g) for s, g in groupby(players, key=score) ]
+    rank = { id(p): r for r, p in enumerate(players) }
+    paired = []
+    floaters = []
+    for bracket in brackets:
+        group = floaters + bracket
+        bracketPairs, floaters = _pairBracket(group, opponents, allowRematch=False)
+        paired.append(bracketPairs)
+    # If players are left over at the bottom, re-pair them together with more
+    # and more of the brackets above until they can be paired without rematches.
+    merged = []
+    for depth in range(len(paired) if len(floaters) > 1 else 0):
+        merged = [ p for pairing in paired[-1-depth] for p in pairing ] + merged
+        group = sorted(merged + floaters, key=lambda p: rank[id(p)])
+        bracketPairs, leftover = _pairBracket(group, opponents, allowRematch=False)
+        if len(leftover) <= 1:
+            paired[-1-depth:] = [ bracketPairs ]
+            floaters = leftover
+            break
+    pairs = [ pairing for bracketPairs in paired for pairing in bracketPairs ]
+    if len(floaters) > 1:
+        # Whoever is left can't avoid rematches among themselves
+        bracketPairs, floaters = _pairBracket(floaters, opponents, allowRematch=True)
+        pairs.extend(bracketPairs)
+    return pairs, floaters
+
 def pair(players, matches, alreadyPlayed, i=0):
-    """Recursive function. Determines pairings.
+    """Determine pairings for a list of players, avoiding rematches.
 
        Pre: <players> is a list of players to pair, in preferred order.
             <matches> is an empty list.
@@ -7,49 +236,13 @@ def pair(players, matches, alreadyPlayed, i=0):
        Post: <matches> is a list of players in paired order.
              matches[0] vs. matches[1]
              matches[1] vs. matches[2], etc.
-       Returns: True if all players were successfully paired. False otherwise."""
-
-    success = False #Will be set to true when pairings are completed.
-    p1 = players[i] #Pair the next player in the list
-    i += 1 #Then move on.
-
-    if p1 in matches: 
-        #If this player has already been paired, move to the next one.
-        success = pair(players, matches, alreadyPlayed, i)
-        return success
-    for p2 in players:
-        #Iterate through the list of players looking for suitable opponents.
-        if p2 in matches:
-            #If this one has already been paired, move to the next one.
-            continue
-        if p2 == p1:
-            #If this one is the same object we are attempting to pair, move on.
-            continue
+       Returns: True if all players were successfully paired without
+             rematches. False otherwise."""
+    pairs, unpaired = swissPair(players[i:], alreadyPlayed=alreadyPlayed)
+    success = not unpaired
+    for p1, p2 in pairs:
         if alreadyPlayed(p1, p2):
-            #If the two players have already played, move on.
-            continue
-
-        #If we've reached this point, there is no reason the players should not
-        #be paired. Add this match to <matches>.
+            success = False
         matches.append(p1)
         matches.append(p2)
-
-        if len(matches) < len(players):
-            #If there are more players left, attempt to pair the next player.
-            success = pair(players, matches, alreadyPlayed, i)
-        else:
-            #If all players have been paired, the pairing has succeeded.
-            success = True
-
-        if success == False:
-            #If we failed to pair the remaining players, remove the pairing we
-            #just made and continue through the loop.
-            del matches[(len(matches) - 2):]
-        else:
-            #If we successfully paired all the players, terminate the loop.
-            break
-    #If success is true, terminate recursion.
-    #If success is false, pairing this player is currently impossible.
-    #Back up to the previous pairing. If this is the first call to the
-    #function, we can't back up any more, so there are no possible pairings.
     return success
@@ -42,6 +42,10 @@ def getStats(tournaments, context, outputs=[], top=[],
     mwpo: match win percentage vs. other decks (no mirrors)
     percentile: average percentile (1 - place / players)
     ev: expected value (based on matchups from context and field breakdown of tournaments)
+    evLowerBound, evUpperBound: 95% credible interval for ev, drawing matchups
+        from their posteriors given the match records in context (left out
+        if context adjusts its matchups for skill, since the interval would
+        not be around those matchups)
     """
     functions = {
         'n': getN(),
@@ -66,6 +70,7 @@ def getStats(tournaments, context, outputs=[], top=[],
         'mwpUpperBound': getMWP(ub=.95)
     }
     stats = []
+    bounds = None
     for key in outputs:
         if key in functions:
             stats.append((key, functions[key]))
@@ -73,6 +78,13 @@ def getStats(tournaments, context, outputs=[], top=[],
             stats.append((key, getEV(context, tournaments=tournaments, players=players)))
         elif key == 'evPairings':
             stats.append((key, getEV(context, players=players, usePairings=True)))
+        elif key in ('evLowerBound', 'evUpperBound'):
+            if getattr(context, 'skillModel', None) is not None:
+                continue
+            # Both ends of the interval come from the same posterior draws
+            if bounds is None:
+                bounds = getEVBounds(context, .95, tournaments=tournaments, players=players)
+            stats.append((key, bounds[0] if key == 'evLowerBound' else bounds[1]))
     for n in top:
         key = 't{0}'.format(n)
         stats.append((key, getTop(n)))
@@ -311,10 +323,11 @@ def getBreakdown(tournaments, context, outputs=[], top=[], percentTop=[],
         for decktype in groups[groupname]:
             deckgroups[decktype].append(groupname)
     # Fill dicts
+    keys = playerKeys(players)
     for t in tournaments:
         for d in t.decks:
             # Skip if it's a player we're not interested in
-            if players and d.player not in players:
+            if keys and d.playerKey not in keys:
                 continue
             # Add to the appropriate deck (if we care about that deck)
             if d.archetype in decks:
@@ -499,6 +512,7 @@ def getTrend(decktypes, tournies, context, outputs=[], top=[],
                 components={'group': groupname, 'stat': key}))
 
     # For each tournament or group of tournaments, construct a row.
+    keys = playerKeys(players)
     for i in range(len(tgroups)):
         tournaments = tgroups[i]
         if cumulative:
@@ -531,16 +545,16 @@ def getTrend(decktypes, tournies, context, outputs=[], top=[],
         # First, add deck-specific stats (once for each deck).
         for decktype in decktypes:
             decks = [ d for d in alldecks if d.archetype == decktype ]
-            if players:
-                decks = [ d for d in decks if d.player in players ]
+            if keys:
+                decks = [ d for d in decks if d.playerKey in keys ]
             for key, stat in stats:
                 func, name, datatype = stat
                 row.append(func(decks))
         # Then, add archetype-group-specific stats (once for each group).
         for group in sorted(groups.keys()):
             decks = [ d for d in alldecks if d.archetype in groups[group] ]
-            if players:
-                decks = [ d for d in decks if d.player in players ]
+            if keys:
+                decks = [ d for d in decks if d.playerKey in keys ]
             for key, stat in stats:
                 func, name, datatype = stat
                 row.append(func(decks))
@@ -949,6 +963,13 @@ def ev(filename, meta, historicalMeta):
     projected_meta = Metagame.fromFile(filename)
     getEV1 = getEV(meta, useMetagame=projected_meta)[0]
     getEV2 = getEV(historicalMeta, useMetagame=projected_meta)[0]
+    # The bounds come from raw match records, so they don't apply to
+    # skill-adjusted matchups
+    showBounds = getattr(historicalMeta, 'skillModel', None) is None
+    if showBounds:
+        lower, upper = getEVBounds(historicalMeta, .95, useMetagame=projected_meta)
+        getEVLower = lower[0]
+        getEVUpper = upper[0]
     getMatchCount = getMatchTotal(exclude_mirrors=True, known=True)[0]
     recent_cutoff = meta.beginning
     historical_cutoff = historicalMeta.beginning
@@ -961,6 +982,9 @@ def ev(filename, meta, historicalMeta):
     table.addField(Field('evRecent', fieldName=f'EV (matches since {recent_cutoff})', type='percent'))
     if metas_differ:
         table.addField(Field('evHistorical', fieldName=f'EV (matches since {historical_cutoff})', type='percent'))
+    if showBounds:
+        table.addField(Field('evLowerBound', fieldName='EV (95% lower bound)', type='percent'))
+        table.addField(Field('evUpperBound', fieldName='EV (95% upper bound)', type='percent'))
     table.addField(Field('matches', fieldName=f'Matches on Record (since {historical_cutoff})', type='int'))
     archetypes = list(meta.archetypes.keys() | historicalMeta.archetypes.keys() | projected_meta.archetypes.keys())
     counts = {a: projected_meta.getCount(a) for a in archetypes}
@@ -975,6 +999,9 @@ def ev(filename, meta, historicalMeta):
         row = [archetype, counts[archetype], counts[archetype]/projected_meta.total, getEV1([deck])]
         if metas_differ:
             row.append(getEV2([deck]))
+        if showBounds:
+            row.append(getEVLower([deck]))
+            row.append(getEVUpper([deck]))
         matches = 0
         row.append(getMatchCount(historical_decks[archetype]))
         table.addRecord(*row)
@@ -1013,6 +1040,9 @@ def explain(deckname, meta, historicalMeta, order, metagameFile=None):
         hmatches = historicalMeta.getSingleMatches(deckname, None, decktype, None)
         hwin, hloss, hdraw = record(hmatches)
         hwinp = mwp(hmatches)
+        skillModel = getattr(historicalMeta, 'skillModel', None)
+        if skillModel is not None and skillModel.matchup(deckname, decktype) is not None:
+            hwinp = skillModel.matchup(deckname, decktype)
         evFieldCont = 0.0
         evPairingsCont = 0.0
         evFileCont = 0.0
@@ -1111,37 +1141,29 @@ def getHistory(tournaments, context, outputs=[], top=[], percentTop=[],
             percentTop=percentTop, penetration=penetration,
             conversion=conversion,
             players=players)
-    # Get the full list of appearances/finishes, and calculate any stats we need
-    data = {}
-    deckIDs = []
-    # Transform player names into a regexp, where we only require the beginning
-    # to match
-    pattern = ''
-    for i in range(len(players)):
-        pattern += '|' + players[i]
-    regexp = re.compile(pattern[1:], re.IGNORECASE)
-    print(decktypes)
-    for tourney in tournaments:
-        for deck in tourney.decks:
-            if topX > 0 and (deck.place is None or deck.place > topX):
-                continue
-            if decktypes and deck.archetype not in decktypes:
-                continue
-            if players:
-                m = regexp.match(deck.player)
-                if m is None:
-                    continue
-            deckIDs.append(deck.id)
-            row = [ deck.player ]
-            for key, func in astats:
-                f, name, datatype = func
-                row.append(f([deck]))
-            row = row + [ tourney.date, tourney.name, deck.archetype ]
-            data[deck.id] = (deck, row)
-    # Sort data, if we want
-    deckIDs.sort(key=lambda x: data[x][0].place, reverse=False)
-    deckIDs.sort(key=lambda x: data[x][0].tournament.date, reverse=False)
-    deckIDs.sort(key=lambda x: data[x][0].player, reverse=False)
+    # Get the full list of appearances/finishes. Player names only need to
+    # match at the beginning, so with a list of players, look up each one's
+    # decks by a range scan over the player key index rather than checking
+    # every deck in the window.
+    if players:
+        decks = deckQuery(tournaments=tournaments, playerPrefixes=players,
+                max_place=topX if topX > 0 else None, archetypes=decktypes).all()
+    else:
+        decks = [ deck for tourney in tournaments for deck in tourney.decks
+                if (topX <= 0 or (deck.place is not None and deck.place <= topX))
+                and (not decktypes or deck.archetype in decktypes) ]
+    # Sort by player, then date, then place
+    decks.sort(key=lambda d: (d.player or '', d.tournament.date,
+        d.place is None, d.place or 0))
+    # Calculate any stats we need
+    rows = []
+    for deck in decks:
+        row = [ deck.player ]
+        for key, func in astats:
+            f, name, datatype = func
+            row.append(f([deck]))
+        row = row + [ deck.tournament.date, deck.tournament.name, deck.archetype ]
+        rows.append(row)
     # Collect in a table and return
     table = Table()
 #    table.addField(Field('player', fieldName='Player', align='<'))
@@ -1157,7 +1179,6 @@ def getHistory(tournaments, context, outputs=[], top=[], percentTop=[],
     table.addField(Field('event', fieldName='Event', align='<'))
     table.addField(Field('archetype', fieldName='Deck', align='<'))
 
-    for deckID in deckIDs:
-        deck, row = data[deckID]
+    for row in rows:
         table.addRecord(*row)
     return table
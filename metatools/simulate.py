@@ -0,0 +1,248 @@
+"""Vectorized simulation of Swiss tournaments.
+
+Rather than creating Deck and Match objects, each batch of simulated
+tournaments is a set of arrays indexed by (trial, player): deck type,
+wins, and the opponents played so far. Every round is paired and
+played for all trials at once with array operations.
+"""
+
+import numpy
+
+from math import ceil, log
+
+class SwissSimulator(object):
+    """Simulate many Swiss tournaments (optionally followed by a single
+    elimination playoff) over a fixed field of deck types."""
+
+    def __init__(self, keys, counts, matrix, names=None, seed=None):
+        """keys: A list of deck types, e.g. (archetype, subarchetype) pairs.
+        counts: Number of players of each type.
+        matrix: matrix[i][j] is the probability that type i beats type j.
+        names: Optional list of report categories (e.g. archetype names); by
+            default, each key's first element (or the key itself).
+        seed: Seed or numpy Generator for the random number generator."""
+        self.keys = list(keys)
+        self.counts = numpy.asarray(counts, dtype=int)
+        self.matrix = numpy.asarray(matrix, dtype=float)
+        if numpy.isnan(self.matrix).any():
+            missing = [ (self.keys[i], self.keys[j]) for i, j in zip(*numpy.nonzero(numpy.isnan(self.matrix))) ]
+            raise Exception(f"Missing matchups: {missing[:10]}{'...' if len(missing) > 10 else ''}")
+        if names is None:
+            names = []
+            for key in self.keys:
+                name = key[0] if isinstance(key, tuple) else key
+                if name not in names:
+                    names.append(name)
+        self.names = list(names)
+        nameIndex = { name: i for i, name in enumerate(self.names) }
+        self.group = numpy.array([ nameIndex[key[0] if isinstance(key, tuple) else key]
+            for key in self.keys ], dtype=int)
+        self.rng = seed if isinstance(seed, numpy.random.Generator) else numpy.random.default_rng(seed)
+        # One row per player: the index of its deck type
+        self.types = numpy.repeat(numpy.arange(len(self.keys)), self.counts)
+        self.numPlayers = len(self.types)
+
+    @staticmethod
+    def fromMetagame(meta, seed=None):
+        """Build a simulator from a Metagame, using its subarchetype-level
+        matchups and reporting by archetype."""
+        keys, matrix = meta.subarchetypeMatrix()
+        counts = [ meta.archetypes[main][sub] for main, sub in keys ]
+        return SwissSimulator(keys, counts, matrix, names=list(meta.archetypes), seed=seed)
+
+    def defaultRounds(self):
+        return int(ceil(log(self.numPlayers, 2)))
+
+    def simulate(self, trials, rounds=None, cut=8, tops=(8,), types=None, matrices=None):
+        """Simulate a batch of tournaments.
+
+        trials: Number of tournaments.
+        rounds: Number of Swiss rounds (default: ceil(log2(players))).
+        cut: Size of the single elimination playoff (0 for none).
+        tops: Report how many of each archetype finished in each of these top N.
+        types: Optional (trials, players) array of deck types, overriding the
+            fixed field (e.g. to simulate a different sampled field per trial).
+        matrices: Optional (trials, types, types) array of matchup matrices,
+            overriding the fixed matrix (e.g. sampled matchup uncertainty).
+
+        Returns a dict of arrays, where A is the number of report categories:
+            'field': (trials, A) number of players of each category
+            'top': { N: (trials, A) number of each category in the top N }
+            'percentile': (trials, A) sum of final percentiles
+            'wins': (A, rounds+1) count of players finishing with each number
+                of Swiss match wins (byes count as wins)
+            'winner': (trials,) category of the tournament winner"""
+        rng = self.rng
+        if types is None:
+            types = numpy.broadcast_to(self.types, (trials, self.numPlayers))
+        types = numpy.ascontiguousarray(types)
+        T, n = types.shape
+        if rounds is None:
+            rounds = int(ceil(log(n, 2)))
+        rows = numpy.arange(T)[:, None]
+        # Per-player state is kept in flat arrays of length T*n, indexed by
+        # trial*n + player, since 1-D take/put is much cheaper than indexing
+        # with broadcast (trial, player) index arrays.
+        offsets = rows * n
+        flatTypes = types.ravel()
+        K = len(self.keys)
+        if matrices is None:
+            flatMatrix = self.matrix.ravel()
+            matchup = lambda a, b: flatMatrix.take(a * K + b)
+        else:
+            flatMatrix = numpy.ascontiguousarray(matrices, dtype=float).ravel()
+            matchup = lambda a, b: flatMatrix.take(rows * (K*K) + a * K + b)
+        # Every match win is worth 3 points, including byes, and there are no
+        # draws, so players are ranked by wins alone.
+        wins = numpy.zeros(T * n, dtype=int)
+        hadBye = numpy.zeros(T * n, dtype=bool)
+        opponents = numpy.full((rounds, T * n), -1, dtype=numpy.int32)
+
+        for r in range(rounds):
+            order = self._order(wins.reshape(T, n))
+            if n % 2:
+                order = self._awardBye(order, hadBye.reshape(T, n), wins.reshape(T, n))
+            p1 = order[:, 0::2]
+            p2 = order[:, 1::2]
+            p2 = self._avoidRematches(p1, p2, offsets, opponents[:r])
+            f1 = p1 + offsets
+            f2 = p2 + offsets
+            p = matchup(flatTypes.take(f1), flatTypes.take(f2))
+            won = rng.random(p.shape) < p
+            numpy.add.at(wins, numpy.where(won, f1, f2), 1)
+            opponents[r].put(f1, p2)
+            opponents[r].put(f2, p1)
+        wins = wins.reshape(T, n)
+        standings = self._order(wins)
+        if cut >= 2:
+            standings = self._playoff(standings, min(cut, n), types, rows, matchup)
+        place = numpy.empty((T, n), dtype=int)
+        place[rows, standings] = numpy.arange(1, n+1)
+
+        A = len(self.names)
+        groups = self.group[types]
+        offsets = (numpy.arange(T) * A)[:, None]
+        def tally(mask, weights=None):
+            flat = (groups + offsets)[mask] if mask is not None else (groups + offsets).ravel()
+            w = None if weights is None else (weights[mask] if mask is not None else weights.ravel())
+            return numpy.bincount(flat, weights=w, minlength=T*A).reshape(T, A)
+        result = {
+            'field': tally(None).astype(int),
+            'top': { N: tally(place <= N).astype(int) for N in tops },
+            'percentile': tally(None, 1 - place / float(n)),
+            'wins': numpy.bincount((groups * (rounds+1) + wins).ravel(),
+                minlength=A*(rounds+1)).reshape(A, rounds+1),
+            'winner': groups[numpy.arange(T), standings[:, 0]],
+        }
+        return result
+
+    def _order(self, wins):
+        """Sort players by wins, breaking ties randomly. Rather than argsort
+        with a random tiebreak, this sorts one array of 64-bit keys, each
+        holding (from the top) how many wins the player is behind the leader,
+        random bits, and the player's index, which is about three times faster."""
+        T, n = wins.shape
+        most = int(wins.max())
+        winBits = max(1, most.bit_length())
+        indexBits = max(1, (n - 1).bit_length())
+        keys = self.rng.bit_generator.random_raw(T * n).reshape(T, n)
+        keys &= numpy.uint64((1 << (64 - winBits)) - (1 << indexBits))
+        behind = (most - numpy.arange(most + 1, dtype=numpy.uint64)) << numpy.uint64(64 - winBits)
+        keys |= behind.take(wins)
+        keys |= numpy.arange(n, dtype=numpy.uint64)
+        keys.sort(axis=1)
+        keys &= numpy.uint64((1 << indexBits) - 1)
+        return keys.view(numpy.int64)
+
+    def _awardBye(self, order, hadBye, wins):
+        """Give a bye to the lowest-ranked player in each trial who hasn't had
+        one (resetting once everyone has), and remove them from the order."""
+        T, n = order.shape
+        rows = numpy.arange(T)
+        eligible = ~hadBye[rows[:, None], order]
+        exhausted = ~eligible.any(axis=1)
+        if exhausted.any():
+            hadBye[exhausted] = False
+            eligible[exhausted] = True
+        index = n - 1 - numpy.argmax(eligible[:, ::-1], axis=1)
+        bye = order[rows, index]
+        hadBye[rows, bye] = True
+        wins[rows, bye] += 1
+        keep = numpy.ones((T, n), dtype=bool)
+        keep[rows, index] = False
+        return order[keep].reshape(T, n-1)
+
+    def _avoidRematches(self, p1, p2, offsets, history, passes=3):
+        """Adjust adjacent pairings so players don't face the same opponent
+        twice where possible, by swapping opponents between neighboring
+        tables. Any rematches that remain are allowed. history is the
+        (rounds played, trials*players) array of previous opponents."""
+        T, P = p1.shape
+        if len(history) == 0 or P < 2:
+            return p2
+        def rematch(a, b):
+            return (history.take(a, axis=1) == b).any(axis=0)
+        p2 = p2.copy()
+        repeated = rematch((p1 + offsets).ravel(), p2.ravel()).reshape(T, P)
+        n = history.shape[1] // T
+        for i in range(passes):
+            if not repeated.any():
+                break
+            for parity in (0, 1):
+                # Candidate swaps between tables k and k+1, where either has a rematch
+                bad = repeated[:, parity:P-1:2] | repeated[:, parity+1:P:2]
+                t, k = numpy.nonzero(bad)
+                if len(t) == 0:
+                    continue
+                k = parity + 2*k
+                a1, b1, a2, b2 = p1[t, k], p2[t, k], p1[t, k+1], p2[t, k+1]
+                swap = ~rematch(t*n + a1, b2) & ~rematch(t*n + a2, b1)
+                t, k = t[swap], k[swap]
+                p2[t, k], p2[t, k+1] = b2[swap], b1[swap]
+                repeated[t, k] = False
+                repeated[t, k+1] = False
+        return p2
+
+    def _playoff(self, standings, cut, types, rows, matchup):
+        """Play a single elimination playoff among the top players, reordering
+        them so that winners of each round rank above its losers."""
+        size = 1
+        while size * 2 <= cut:
+            size *= 2
+        standings = standings.copy()
+        while size >= 2:
+            half = size // 2
+            i = numpy.arange(half)
+            a = standings[:, i]
+            b = standings[:, size-1-i]
+            p = matchup(types[rows, a], types[rows, b])
+            won = self.rng.random(p.shape) < p
+            winners = numpy.where(won, a, b)
+            loserPos = numpy.where(won, size-1-i, i)
+            losers = numpy.take_along_axis(standings, numpy.sort(loserPos, axis=1), axis=1)
+            standings[:, :half] = winners
+            standings[:, half:size] = losers
+            size = half
+        return standings
+
+    def run(self, trials, rounds=None, cut=8, tops=(8,), batch=1000):
+        """Simulate tournaments in batches and total up the results. Returns
+        the same structure as simulate, with per-trial arrays concatenated."""
+        results = []
+        remaining = trials
+        while remaining > 0:
+            current = min(batch, remaining)
+            results.append(self.simulate(current, rounds, cut, tops))
+            remaining -= current
+        return combineResults(results)
+
+def combineResults(results):
+    """Concatenate the per-trial arrays (and sum the histograms) of several
+    simulate() results."""
+    return {
+        'field': numpy.concatenate([ r['field'] for r in results ]),
+        'top': { N: numpy.concatenate([ r['top'][N] for r in results ]) for N in results[0]['top'] },
+        'percentile': numpy.concatenate([ r['percentile'] for r in results ]),
+        'wins': sum(r['wins'] for r in results),
+        'winner': numpy.concatenate([ r['winner'] for r in results ]),
+    }
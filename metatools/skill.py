@@ -2,6 +2,8 @@ from metatools.database import *
 from metatools.util import *
 from metatools.table import *
 
+import numpy
+
 def skillMatchup(deckA, deckB, tournaments):
     aDecks = getDecks(archetypes=[deckA], tournaments=tournaments)
     bDecks = getDecks(archetypes=[deckB], tournaments=tournaments)
@@ -25,6 +27,44 @@ def skillMatchup(deckA, deckB, tournaments):
             print("{0}: {1} ({2})".format(s, record(l), mwp(l)))
         print()
 
+def _deckGroups(decktypes, groups):
+    """Column names, the archetypes making up each column, and every
+    archetype involved."""
+    decknames = decktypes[:]
+    allarchetypes = decktypes[:]
+    archetypelist = [ [deck] for deck in decktypes ]
+    for name, members in groups.items():
+        decknames.append(name)
+        archetypelist.append(members)
+        allarchetypes += members
+    return decknames, archetypelist, allarchetypes
+
+def playerRecords(archetypes, tournies):
+    """Match records of every player who played any of the given archetypes
+    in the given tournaments, broken down by the archetype they played,
+    from one grouped query. Player names are compared case-insensitively.
+
+    Returns (names, columns, counts), where names lists one spelling of each
+    player's name, columns lists archetypes, and counts is an array of shape
+    (players, archetypes, 3) of match wins, losses, and draws."""
+    tids = [ t.id for t in tournies ]
+    players = sorted(getArchetypePlayers(tids, list(archetypes)), key=lambda row: row[1])
+    index = { key: i for i, (key, name) in enumerate(players) }
+    rows = [ row for row in getPlayerRecords(tids) if row[0] in index ]
+    columns = sorted({ row[1] for row in rows })
+    columnIndex = { name: j for j, name in enumerate(columns) }
+    counts = numpy.zeros((len(players), len(columns), 3), dtype=int)
+    for key, archetype, win, loss, draw in rows:
+        counts[index[key], columnIndex[archetype]] = (win or 0, loss or 0, draw or 0)
+    return [ name for key, name in players ], columns, counts
+
+def _split(columns, counts, archetypes):
+    """Per-player (wins, losses, draws) with and without the given
+    archetypes: two arrays of shape (players, 3)."""
+    mask = numpy.array([ c in archetypes for c in columns ], dtype=bool)
+    deck = counts[:, mask].sum(axis=1) if len(columns) else counts.sum(axis=1)
+    return deck, counts.sum(axis=1) - deck
+
 def skillDeck(decktypes, groups, historicalMetagame, tournies, min_other,
         min_deck, min_all, other):
     """Generate a table of players who have played the given decks, and their
@@ -39,13 +79,7 @@ def skillDeck(decktypes, groups, historicalMetagame, tournies, min_other,
     min_all: require this many matches total
     other: If True, report win % with other decks as well.
     """
-    decknames = decktypes[:]
-    allarchetypes = decktypes[:]
-    archetypelist = [ [deck] for deck in decktypes ]
-    for g in groups:
-        decknames += g[0]
-        archetypelist.append(g[1:])
-        allarchetypes += g[1:]
+    decknames, archetypelist, allarchetypes = _deckGroups(decktypes, groups)
 
     table = Table()
     for name in decknames:
@@ -57,42 +91,25 @@ def skillDeck(decktypes, groups, historicalMetagame, tournies, min_other,
         table.addField(Field('n{0}'.format(name), type='int',
             fieldName='# of Matches ({0})'.format(name)))
 
-    deck = decktypes[0]
-
-    alldecks = getDecks(archetypes=allarchetypes, tournaments=tournies)
-    players = { d.player for d in alldecks }
-    for player in players:
-        row = []
-        playerDecks = getDecks(players=[player], tournaments=tournies)
-        playerMatches = getMatches(decks1=playerDecks)
-        for i in range(len(decknames)):
-            deck = decknames[i]
-            archetypes = archetypelist[i]
-            playerDeckMatches = []
-            playerOtherMatches = []
-            for match in playerMatches:
-                if match.deck1.archetype in archetypes:
-                    playerDeckMatches.append(match)
-                else:
-                    playerOtherMatches.append(match)
-
-            pOther = mwp(playerOtherMatches)
-            pDeck = mwp(playerDeckMatches)
-            pAll = mwp(playerMatches)
-            nOther = len(playerOtherMatches)
-            nDeck = len(playerDeckMatches)
-            nAll = len(playerMatches)
-
+    players, columns, counts = playerRecords(allarchetypes, tournies)
+    nAll = counts.sum(axis=(1, 2))
+    rows = [ [] for player in players ]
+    for i in range(len(decknames)):
+        deckRecord, otherRecord = _split(columns, counts, archetypelist[i])
+        nDeck = deckRecord.sum(axis=1)
+        nOther = otherRecord.sum(axis=1)
+        if other:
+            keep = (nOther >= min_other) & (nDeck >= min_deck) & (nAll >= min_all)
+        else:
+            keep = nDeck >= min_deck
+        for j in range(len(players)):
+            if not keep[j]:
+                rows[j].extend([float('NaN'), float('NaN'), 0] if other else [float('NaN'), 0])
+                continue
             if other:
-                if nOther >= min_other and nDeck >= min_deck and nAll >= min_all:
-                    row.extend([pOther, pDeck, nDeck])
-                else:
-                    row.extend([float('NaN'), float('NaN'), 0])
-            else:
-                if nDeck >= min_deck:
-                    row.extend([pDeck, nDeck])
-                else:
-                    row.extend([float('NaN'), 0])
+                rows[j].append(mwp_record(*otherRecord[j]))
+            rows[j].extend([mwp_record(*deckRecord[j]), int(nDeck[j])])
+    for row in rows:
         table.addRecord(*row)
     return table
 
@@ -104,13 +121,7 @@ def recordsDeck(decktypes, groups, metagame, tournies):
             of decks to group together
     tournies: a list of Tournaments from which to gather records.
     """
-    decknames = decktypes[:]
-    allarchetypes = decktypes[:]
-    archetypelist = [ [deck] for deck in decktypes ]
-    for g in groups:
-        decknames += g[0]
-        archetypelist.append(g[1:])
-        allarchetypes += g[1:]
+    decknames, archetypelist, allarchetypes = _deckGroups(decktypes, groups)
 
     table = Table()
     table.addField(Field('player', type='str'))
@@ -120,33 +131,60 @@ def recordsDeck(decktypes, groups, metagame, tournies):
         table.addField(Field('n{0}'.format(name), type='int',
             fieldName='# of Matches ({0})'.format(name)))
 
-    deck = decktypes[0]
-
-    alldecks = getDecks(archetypes=allarchetypes, tournaments=tournies)
-    players = { d.player for d in alldecks }
-    for player in players:
-        row = [player]
-        playerDecks = getDecks(players=[player], tournaments=tournies)
-        playerMatches = getMatches(decks1=playerDecks)
-        for i in range(len(decknames)):
-            deck = decknames[i]
-            archetypes = archetypelist[i]
-            playerDeckMatches = []
-#            playerOtherMatches = []
-            for match in playerMatches:
-                if match.deck1.archetype in archetypes:
-                    playerDeckMatches.append(match)
-#                else:
-#                    playerOtherMatches.append(match)
-
-#            pOther = mwp(playerOtherMatches)
-            pDeck = mwp(playerDeckMatches)
-#            pAll = mwp(playerMatches)
-#            nOther = len(playerOtherMatches)
-            nDeck = len(playerDeckMatches)
-#            nAll = len(playerMatches)
-
-            if nDeck > 0:
-                row.extend([pDeck, nDeck])
+    players, columns, counts = playerRecords(allarchetypes, tournies)
+    rows = [ [player] for player in players ]
+    for i in range(len(decknames)):
+        deckRecord, otherRecord = _split(columns, counts, archetypelist[i])
+        nDeck = deckRecord.sum(axis=1)
+        for j in numpy.nonzero(nDeck > 0)[0]:
+            rows[j].extend([mwp_record(*deckRecord[j]), int(nDeck[j])])
+    for row in rows:
         table.addRecord(*row)
     return table
+
+def skillModelMatchups(decktypes, historicalMetagame, model):
+    """Generate a table comparing raw matchups between the given decks to
+    matchups from a SkillModel, with the skill of their pilots factored out.
+    decktypes: list of strings representing archetype names
+    historicalMetagame: metagame used for the raw match records
+    model: a fitted SkillModel
+    """
+    table = Table()
+    table.setTitle('Matchups Adjusted for Pilot Skill')
+    table.addField(Field('deck', fieldName='Deck', align='<'))
+    table.addField(Field('opponent', fieldName='Opponent', align='<'))
+    table.addField(Field('n', fieldName='# of Matches', type='int'))
+    table.addField(Field('raw', fieldName='Win %', type='percent'))
+    table.addField(Field('adjusted', fieldName='Win % (skill-adjusted)', type='percent'))
+    records = historicalMetagame.getMatchupRecords(decktypes, decktypes)
+    for d1 in decktypes:
+        for d2 in decktypes:
+            adjusted = model.matchup(d1, d2)
+            if d1 == d2 or adjusted is None:
+                continue
+            win, loss, draw = records.get(d1, {}).get(d2, (0, 0, 0))
+            table.addRecord(d1, d2, model.matches(d1, d2), mwp_record(win, loss, draw), adjusted)
+    return table
+
+def skillModelRatings(model, min_all=0, players=[]):
+    """Generate a table of player ratings from a SkillModel, best first.
+    model: a fitted SkillModel
+    min_all: require this many matches total
+    players: if given, only report these players
+    """
+    table = Table()
+    table.setTitle('Player Ratings')
+    table.addField(Field('player', fieldName='Player', align='<'))
+    table.addField(Field('n', fieldName='# of Matches', type='int'))
+    table.addField(Field('rating', fieldName='Rating', type='float'))
+    table.addField(Field('p', fieldName='Win % vs. Average Pilot', type='percent'))
+    selected = playerKeys(players)
+    for i in numpy.argsort(-model.ratings):
+        if model.playerCounts[i] < min_all:
+            continue
+        if selected and model.players[i] not in selected:
+            continue
+        rating = float(model.ratings[i])
+        table.addRecord(model.players[i], int(model.playerCounts[i]), rating,
+                1.0 / (1.0 + numpy.exp(-rating)))
+    return table
@@ -0,0 +1,135 @@
+"""Joint model of pilot skill and archetype matchups.
+
+Match results are modeled Bradley-Terry style: the log-odds that one deck
+beats another is the difference between its pilot's rating and the
+opponent's, plus a matchup effect for the pair of archetypes (antisymmetric,
+so one parameter per unordered pair, and none for mirrors). Ratings and
+matchup effects have Gaussian priors centered on zero, i.e. L2 penalties, so
+players and pairs with few matches are shrunk towards average. The model is
+fit by maximizing the penalized likelihood with L-BFGS over a sparse design
+matrix, which scales to hundreds of thousands of matches and millions of
+players.
+"""
+
+from metatools.database import getUniqueMatches
+
+import numpy
+import sys
+from scipy import optimize, sparse
+from scipy.special import expit
+
+class SkillModel(object):
+    """Player ratings and pilot-adjusted archetype matchups."""
+
+    def __init__(self, playerPenalty=1.0, matchupPenalty=0.1):
+        """playerPenalty: Precision of the prior on player ratings (larger
+            values shrink ratings more).
+        matchupPenalty: Precision of the prior on matchup effects."""
+        self.playerPenalty = playerPenalty
+        self.matchupPenalty = matchupPenalty
+        self.players = []
+        self.ratings = numpy.zeros(0)
+        self.archetypes = []
+        self.edges = {}
+        self.pairCounts = {}
+        self.playerCounts = numpy.zeros(0, dtype=int)
+
+    def fit(self, player1, archetype1, player2, archetype2, score, maxiter=1000, tol=1e-8):
+        """Fit the model to a set of matches, given as parallel sequences of
+        each side's player and archetype and the score for the first side
+        (1 for a win, 0 for a loss, 0.5 for a draw). Returns self."""
+        player1 = numpy.asarray(player1, dtype=object)
+        player2 = numpy.asarray(player2, dtype=object)
+        score = numpy.asarray(score, dtype=float)
+        n = len(score)
+        players, playerIndex = numpy.unique(numpy.concatenate([player1, player2]),
+                return_inverse=True)
+        i1, i2 = playerIndex[:n], playerIndex[n:]
+        archetypes, archetypeIndex = numpy.unique(numpy.concatenate([
+            numpy.asarray(archetype1, dtype=object), numpy.asarray(archetype2, dtype=object)]),
+            return_inverse=True)
+        a1, a2 = archetypeIndex[:n], archetypeIndex[n:]
+        P = len(players)
+        K = len(archetypes)
+        low = numpy.minimum(a1, a2)
+        high = numpy.maximum(a1, a2)
+        mirror = low == high
+        pairs, pairIndex = numpy.unique(low[~mirror] * K + high[~mirror], return_inverse=True)
+        M = len(pairs)
+
+        # Each row is +1 for the first pilot, -1 for the second, and +/-1 for
+        # the matchup, signed by which archetype comes first
+        rows = numpy.concatenate([ numpy.arange(n), numpy.arange(n),
+            numpy.nonzero(~mirror)[0] ])
+        cols = numpy.concatenate([ i1, i2, P + pairIndex ])
+        values = numpy.concatenate([ numpy.ones(n), -numpy.ones(n),
+            numpy.where(a1[~mirror] < a2[~mirror], 1.0, -1.0) ])
+        X = sparse.csr_matrix((values, (rows, cols)), shape=(n, P + M))
+        penalty = numpy.concatenate([ numpy.full(P, self.playerPenalty),
+            numpy.full(M, self.matchupPenalty) ])
+
+        def objective(theta):
+            z = X @ theta
+            loss = numpy.sum(numpy.logaddexp(0, z) - score * z) + 0.5 * numpy.dot(penalty * theta, theta)
+            grad = X.T @ (expit(z) - score) + penalty * theta
+            return loss, grad
+
+        result = optimize.minimize(objective, numpy.zeros(P + M), jac=True, method='L-BFGS-B',
+                options={ 'maxiter': maxiter, 'gtol': tol })
+        if not result.success:
+            print(f'WARNING: skill model did not converge: {result.message}', file=sys.stderr)
+        theta = result.x
+        self.players = list(players)
+        self.ratings = theta[:P]
+        self.playerCounts = numpy.bincount(i1, minlength=P) + numpy.bincount(i2, minlength=P)
+        self.archetypes = list(archetypes)
+        pairCounts = numpy.bincount(pairIndex, minlength=M)
+        self.edges = {}
+        self.pairCounts = {}
+        for pair, edge, count in zip(pairs, theta[P:], pairCounts):
+            a, b = archetypes[pair // K], archetypes[pair % K]
+            self.edges[(a, b)] = edge
+            self.pairCounts[(a, b)] = int(count)
+        return self
+
+    def edge(self, archetype1, archetype2):
+        """Log-odds that the first archetype beats the second between equally
+        skilled pilots, or None if they never played each other."""
+        if archetype1 == archetype2:
+            return 0.0
+        if (archetype1, archetype2) in self.edges:
+            return self.edges[(archetype1, archetype2)]
+        if (archetype2, archetype1) in self.edges:
+            return -self.edges[(archetype2, archetype1)]
+        return None
+
+    def matchup(self, archetype1, archetype2):
+        """Probability that the first archetype beats the second between
+        equally skilled pilots, or None if they never played each other."""
+        edge = self.edge(archetype1, archetype2)
+        return None if edge is None else float(expit(edge))
+
+    def matches(self, archetype1, archetype2):
+        """Number of matches between two (different) archetypes."""
+        return self.pairCounts.get((archetype1, archetype2),
+                self.pairCounts.get((archetype2, archetype1), 0))
+
+def pilot(key, deckId):
+    """Identity of a deck's pilot: its player key, or for a deck with no
+    player name, one of its own. (Player keys never start with a space, so
+    these can't collide with a real player.)"""
+    return key or f' #{deckId}'
+
+def fitSkillModel(tournaments, playerPenalty=1.0, matchupPenalty=0.1):
+    """Fit a SkillModel to every match in the given tournaments, counting
+    each match once and identifying players by PLAYER_KEY."""
+    rows = list(getUniqueMatches(tids=[ t.id for t in tournaments ]))
+    player1 = [ pilot(row[11], row[4]) for row in rows ]
+    player2 = [ pilot(row[12], row[6]) for row in rows ]
+    archetype1 = [ row[5] or '' for row in rows ]
+    archetype2 = [ row[7] or '' for row in rows ]
+    score = [ 1.0 if row[8] > row[9] else 0.0 if row[8] < row[9] else 0.5 for row in rows ]
+    model = SkillModel(playerPenalty, matchupPenalty)
+    if not rows:
+        return model
+    return model.fit(player1, archetype1, player2, archetype2, score)
@@ -0,0 +1,143 @@
+"""Analytic estimates of Swiss tournament standings by archetype.
+
+Rather than simulating individual tournaments, treat the field as a continuous
+population and propagate the share of the field in each (deck type, wins)
+state from round to round. Players are assumed to be paired within their
+score bracket, so a player's chance of winning a round is their matchup
+against the composition of their bracket. Draws, byes, and players floating
+between brackets are ignored, which is a good approximation for large fields.
+"""
+
+from metatools.meta import MetaFactory
+
+import numpy
+
+from math import ceil, log
+
+def _metagameSpec(meta):
+    keys, matrix = meta.subarchetypeMatrix()
+    names = list(meta.archetypes)
+    nameIndex = { name: i for i, name in enumerate(names) }
+    counts = numpy.array([ meta.archetypes[main][sub] for main, sub in keys ], dtype=float)
+    group = numpy.array([ nameIndex[main] for main, sub in keys ], dtype=int)
+    return names, group, counts / counts.sum(), matrix, int(counts.sum())
+
+def _factorySpec(factory):
+    names = list(factory.decknames)
+    matrix = numpy.array([ [ float(factory.matchups[a][''][b]['']) for b in names ]
+        for a in names ])
+    p = numpy.array([ float(x) for x in factory.p ])
+    return names, numpy.arange(len(names)), p / p.sum(), matrix, None
+
+def propagate(field, matrix, rounds):
+    """Propagate a field through Swiss rounds with bracket pairing.
+
+    field: Share of the field playing each deck type (K,).
+    matrix: matrix[i][j] is the probability that type i beats type j.
+    rounds: Number of rounds.
+
+    Returns an array of shape (rounds+1, K, rounds+1), where [r, i, w] is the
+    share of the whole field playing type i with w wins after r rounds."""
+    K = len(field)
+    state = numpy.zeros((rounds+1, K, rounds+1))
+    state[0, :, 0] = field
+    for r in range(rounds):
+        current = state[r, :, :r+1]
+        size = current.sum(axis=0)
+        # Probability of each type winning against its bracket
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            p = numpy.where(size > 0, (matrix @ current) / size, 0.0)
+        won = current * p
+        state[r+1, :, :r+1] += current - won
+        state[r+1, :, 1:r+2] += won
+    return state
+
+def topCut(final, share):
+    """Given the final (K, W) distribution over wins, return the share of
+    the field of each type finishing within the top 'share' of the
+    standings. Ties at the boundary are broken at random."""
+    taken = numpy.zeros(final.shape[0])
+    remaining = share
+    for w in range(final.shape[1]-1, -1, -1):
+        bracket = final[:, w]
+        size = bracket.sum()
+        if size <= 0:
+            continue
+        if size <= remaining:
+            taken += bracket
+            remaining -= size
+        else:
+            taken += bracket * (remaining / size)
+            break
+    return taken
+
+def playoff(field, matrix, rounds):
+    """Share of playoff wins for each type, for a single elimination bracket
+    of 2**rounds players with the given composition, assuming random
+    pairings among the survivors of each round."""
+    alive = numpy.asarray(field, dtype=float) / max(field.sum(), 1e-300)
+    for r in range(rounds):
+        total = alive.sum()
+        if total <= 0:
+            break
+        alive = alive * (matrix @ alive) / total
+    return alive / max(alive.sum(), 1e-300)
+
+def expectedStandings(meta, rounds=None, players=None, cut=8, day2=None):
+    """Estimate per-archetype Swiss results without simulation.
+
+    meta: A Metagame, or a MetaFactory (in which case the field is its
+        expected composition).
+    rounds: Number of Swiss rounds (default: ceil(log2(players))).
+    players: Number of players (default: the Metagame's total; required for
+        a MetaFactory).
+    cut: Size of the single elimination playoff.
+    day2: Optional (rounds, wins): how many wins are needed after how many
+        rounds to advance to day 2.
+
+    Returns a dict with 'names' and arrays (one entry per archetype) of
+    'field' (share of the field), 'topShare' (share of the top cut),
+    'conversion' (chance of making the top cut), 'winRate' (share of
+    tournaments won), 'day2' (chance of making day 2, if requested), and
+    'wins': an (archetypes, rounds+1) distribution of Swiss match wins for
+    each archetype."""
+    if isinstance(meta, MetaFactory):
+        if players is None:
+            raise Exception("Number of players is required for a MetaFactory")
+        names, group, field, matrix, total = _factorySpec(meta)
+    else:
+        names, group, field, matrix, total = _metagameSpec(meta)
+        if players is None:
+            players = total
+    if numpy.isnan(matrix).any():
+        raise Exception("Missing matchups: the matchup matrix must be fully specified")
+    if rounds is None:
+        rounds = int(ceil(log(players, 2)))
+    A = len(names)
+    state = propagate(field, matrix, rounds)
+
+    def byArchetype(values):
+        result = numpy.zeros((A,) + values.shape[1:])
+        numpy.add.at(result, group, values)
+        return result
+
+    archField = byArchetype(field)
+    final = state[rounds]
+    share = min(1.0, cut / float(players)) if cut else 0.0
+    top = topCut(final, share)
+    winners = playoff(top, matrix, int(log(cut, 2))) if cut >= 2 else numpy.zeros(len(field))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result = {
+            'names': names,
+            'rounds': rounds,
+            'field': archField,
+            'topShare': byArchetype(top) / share if share else numpy.zeros(A),
+            'conversion': byArchetype(top) / archField,
+            'winRate': byArchetype(winners),
+            'wins': byArchetype(final) / archField[:, None],
+        }
+        if day2 is not None:
+            day2Rounds, day2Wins = day2
+            advanced = state[day2Rounds][:, day2Wins:].sum(axis=1)
+            result['day2'] = byArchetype(advanced) / archField
+    return result
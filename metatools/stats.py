@@ -3,6 +3,7 @@ from metatools.util import *
 from metatools.meta import ObservedMeta, PairedMeta
 
 from itertools import product
+import numpy
 
 #-----------------------------------------------------------------------
 # Statistics for a group of decks. Each function is a generator
@@ -161,8 +162,66 @@ def getPercentile():
         return float(total)/n
     return (avgpercentile, 'Avg. Percentile', 'percent')
 
+def _posteriorRows(context, decks1, decks2, fromSub, samples, correction, seed):
+    """Return a function mapping a 'from' deck type to a (samples, len(decks2))
+    array of MWPs drawn from Beta(successes + correction, failures +
+    correction) posteriors over the observed match records. Rows are drawn on
+    first use. With no prior, a record with no wins (or no losses) always
+    gives 0 (or 1), and pairings with no record are fixed at .5."""
+    records = context.getMatchupRecords(decks1, decks2, fromSub)
+    rng = numpy.random.default_rng(seed)
+    rows = {}
+    def posterior(decktype):
+        if decktype not in rows:
+            successes = numpy.zeros(len(decks2))
+            failures = numpy.zeros(len(decks2))
+            for j, other in enumerate(decks2):
+                win, loss, draw = records.get(decktype, {}).get(other, (0, 0, 0))
+                successes[j] = int(win) + int(draw) * float(drawMult)
+                failures[j] = int(loss) + int(draw) * (drawCount - float(drawMult))
+            a = successes + correction
+            b = failures + correction
+            known = (a > 0) & (b > 0)
+            row = numpy.full((samples, len(decks2)), .5)
+            # The limit of Beta(a, b) as either parameter goes to zero
+            certain = (a + b > 0) & ~known
+            row[:, certain] = a[certain] / (a[certain] + b[certain])
+            row[:, known] = rng.beta(a[known], b[known], size=(samples, known.sum()))
+            rows[decktype] = row
+        return rows[decktype]
+    return posterior
+
+def _evField(decks, tournaments, fromSub, smartSub, players, usePairings, useMetagame):
+    """The field to compute EV against for a list of decks, and the decks'
+    own types. Returns (field metagame, { type: count }, whether types are
+    (archetype, subarchetype) pairs)."""
+    archetypesMain = {}
+    archetypesBoth = {}
+    for d in decks:
+        main = d.archetype
+        sub = d.subarchetype
+        archetypesMain[main] = archetypesMain.get(main, 0) + 1
+        archetypesBoth[(main, sub)] = archetypesBoth.get((main, sub), 0) + 1
+    tlist = tournaments
+    if not tlist:
+        tlist = { d.tournament for d in decks }
+    if useMetagame is not None:
+        thisMeta = useMetagame
+    elif usePairings:
+        thisMeta = PairedMeta(decks, players=players)
+    else:
+        thisMeta = ObservedMeta(tlist, players=players)
+    fSub = fromSub
+    if smartSub and len(archetypesBoth) == 1:
+        fSub = True
+    return thisMeta, archetypesBoth if fSub else archetypesMain, fSub
+
+def _evName(usePairings):
+    return 'EV vs. {}'.format('Pairings' if usePairings else 'Field')
+
 def getEV(context, tournaments=None, fromSub=False, smartSub=False,
-        players=[], usePairings=False, useMetagame=None):
+        players=[], usePairings=False, useMetagame=None, lb=None, ub=None,
+        samples=4000, correction=0, seed=0):
     """Get expected value for a list of decks.
 
     context: Metagame to be used for matchup data.
@@ -176,37 +235,25 @@ def getEV(context, tournaments=None, fromSub=False, smartSub=False,
             rather than the overall field of the tournaments.
     useMetagame: If given, use this metagame for the field breakdown, overriding
             other options about how to calculate the field.
+    lb, ub: If given, return the lower or upper end of a credible interval
+            with this probability, rather than the point estimate (see
+            getEVBounds, which computes both ends from the same draws).
+    samples, correction, seed: See getEVBounds.
     """
+    interval = lb or ub
+    if interval:
+        lower, upper = getEVBounds(context, interval, tournaments, fromSub, smartSub,
+                players, usePairings, useMetagame, samples, correction, seed)
+        return lower if lb else upper
     alldecks = list(context.archetypes.keys())
     matchupsMain = context.getMultipleMatchups(alldecks, alldecks)
     if fromSub or smartSub:
         matchupsSub = context.getMultipleMatchups(alldecks, alldecks, True)
     def ev_func(decks):
-        archetypesMain = {}
-        archetypesBoth = {}
-        for d in decks:
-            main = d.archetype
-            sub = d.subarchetype
-            archetypesMain[main] = archetypesMain.get(main, 0) + 1
-            archetypesBoth[(main, sub)] = archetypesBoth.get((main, sub), 0) + 1
-        tlist = tournaments
-        if not tlist:
-            tlist = { d.tournament for d in decks }
-        if useMetagame is not None:
-            thisMeta = useMetagame
-        elif usePairings:
-            thisMeta = PairedMeta(decks, players=players)
-        else:
-            thisMeta = ObservedMeta(tlist, players=players)
+        thisMeta, archetypes, fSub = _evField(decks, tournaments, fromSub, smartSub,
+                players, usePairings, useMetagame)
         result = 0.0
-        archetypes = archetypesMain
-        matchups = matchupsMain
-        fSub = fromSub
-        if smartSub and len(archetypesBoth) == 1:
-            fSub = True
-        if fSub:
-            archetypes = archetypesBoth
-            matchups = matchupsSub
+        matchups = matchupsSub if fSub else matchupsMain
         for decktype in archetypes:
             n = archetypes[decktype]
             ev = 0.0
@@ -216,8 +263,60 @@ def getEV(context, tournaments=None, fromSub=False, smartSub=False,
                 ev += p * float(mwp)
             result += ev * n / len(decks)
         return result
-    oppType = 'Pairings' if usePairings else 'Field'
-    return (ev_func, f'EV vs. {oppType}', 'percent')
+    return (ev_func, _evName(usePairings), 'percent')
+
+def getEVBounds(context, p=.95, tournaments=None, fromSub=False, smartSub=False,
+        players=[], usePairings=False, useMetagame=None, samples=4000,
+        correction=0, seed=0):
+    """Get the lower and upper ends of a credible interval for expected value,
+    as a pair of statistics (see getEV for the other arguments).
+
+    Matchups are drawn from Beta posteriors over the match records in the
+    context, ignoring any skill model it has, and EV is computed for every draw. Both statistics take
+    quantiles of the same draws, so computing the upper bound for the decks
+    just passed to the lower bound (or vice versa) reuses them.
+
+    p: Probability of the interval.
+    samples: Number of posterior draws.
+    correction: Pseudo-count of wins and losses added to each matchup as the
+            prior. The default of 0 matches the point estimate from getEV,
+            which is the mean of the draws.
+    seed: Random seed, so repeated runs give the same interval.
+    """
+    alldecks = list(context.archetypes.keys())
+    posteriorMain = _posteriorRows(context, alldecks, alldecks, False,
+            samples, correction, seed)
+    if fromSub or smartSub:
+        posteriorSub = _posteriorRows(context, alldecks, alldecks, True,
+                samples, correction, seed)
+    deckIndex = { d: i for i, d in enumerate(alldecks) }
+    last = [ None, None ]
+    def draws(decks):
+        if last[0] is not None and len(last[0]) == len(decks) \
+                and all(a is b for a, b in zip(last[0], decks)):
+            return last[1]
+        thisMeta, archetypes, fSub = _evField(decks, tournaments, fromSub, smartSub,
+                players, usePairings, useMetagame)
+        # Field shares of the known archetypes; the rest count as even matchups
+        field = numpy.zeros(len(alldecks))
+        other = 0.0
+        for deck in thisMeta.archetypes:
+            share = thisMeta.getCount(deck)/float(thisMeta.total)
+            if deck in deckIndex:
+                field[deckIndex[deck]] += share
+            else:
+                other += share
+        posterior = posteriorSub if fSub else posteriorMain
+        evs = numpy.zeros(samples)
+        for decktype in archetypes:
+            evs += (posterior(decktype) @ field + .5 * other) * archetypes[decktype] / len(decks)
+        last[:] = [ list(decks), evs ]
+        return evs
+    name = _evName(usePairings)
+    lower = lambda decks: float(numpy.quantile(draws(decks), (1 - p) / 2))
+    upper = lambda decks: float(numpy.quantile(draws(decks), 1 - (1 - p) / 2))
+    return ((lower, f'{name} ({p*100}% lower bound)', 'percent'),
+            (upper, f'{name} ({p*100}% upper bound)', 'percent'))
 
 def getTop(n):
     """Get the number of top n placings for a list of decks.
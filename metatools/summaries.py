@@ -0,0 +1,124 @@
+"""Maintain precomputed summary tables derived from Deck and Matches.
+
+Anything that writes decks or matches (or changes their archetypes) should call
+updateSummaries with the affected tournament IDs before committing, so that the
+summaries stay consistent with the underlying rows."""
+
+from metatools.database import session, sql, inequals, param, matchupCube, toDate, weekOf, \
+        hasTable
+
+def updateArchetypeTotals(tids):
+    """Recompute the ArchetypeTotals rows for the given tournaments: one row per
+    (tournament, archetype, subarchetype) with the number of decks, their match
+    results, and how many finished in the top 8 and top 16. Does nothing if
+    metatools.migrate hasn't created the table yet."""
+    if not tids or not hasTable('ArchetypeTotals'):
+        return
+    tids = list(tids)
+    sql("delete from ArchetypeTotals where T_ID " + inequals(tids), *tids)
+    sql("""insert into ArchetypeTotals (T_ID, DECK_NAME, QUALIFIER, DECKS,
+            MATCH_WIN, MATCH_LOSS, MATCH_DRAW, TOP8, TOP16)
+        select Deck.T_ID, Deck.DECK_NAME, Deck.QUALIFIER, COUNT(*),
+            COALESCE(SUM(R.W), 0), COALESCE(SUM(R.L), 0), COALESCE(SUM(R.D), 0),
+            SUM(case when Deck.PLACE <= 8 then 1 else 0 end),
+            SUM(case when Deck.PLACE <= 16 then 1 else 0 end)
+        from Deck left join (
+            select DECK_1,
+                SUM(case when WIN > LOSS then 1 else 0 end) as W,
+                SUM(case when WIN < LOSS then 1 else 0 end) as L,
+                SUM(case when WIN = LOSS then 1 else 0 end) as D
+            from Matches where T_ID """ + inequals(tids) + """
+            group by DECK_1) R on R.DECK_1 = Deck.DECK_ID
+        where Deck.T_ID """ + inequals(tids) + """
+        group by Deck.T_ID, Deck.DECK_NAME, Deck.QUALIFIER""", *(tids + tids))
+
+def _matches(column, value):
+    """SQL condition comparing a column to a possibly-null value."""
+    if value is None:
+        return column + " IS NULL", []
+    return column + " = " + param, [value]
+
+def rebuildMatchupCube(format, source, since=None):
+    """Rebuild the matchup cube for one (format, source) from the week containing
+    'since' onwards (or from the beginning): weekly totals are recomputed from
+    the matches, and the cumulative totals continue from the last week before.
+    Does nothing if metatools.migrate hasn't created the cube yet."""
+    if not hasTable('MatchupCube'):
+        return
+    since = weekOf(since) if since is not None else None
+    fcond, fparams = _matches("FORMAT", format)
+    scond, sparams = _matches("SOURCE", source)
+    # Cumulative totals per pair as of the week before the rebuild
+    base = {}
+    if since is not None:
+        for row in sql("""select DECK_NAME, QUALIFIER, DECK_NAME_2, QUALIFIER_2,
+                MAX(CUM_WIN), MAX(CUM_LOSS), MAX(CUM_DRAW) from MatchupCube
+                where """ + fcond + " and " + scond + " and WEEK < " + param + """
+                group by DECK_NAME, QUALIFIER, DECK_NAME_2, QUALIFIER_2""",
+                *(fparams + sparams + [str(since)])):
+            base[tuple(row[:4])] = tuple(row[4:])
+    # Weekly totals from the matches themselves
+    tfcond, tfparams = _matches("T.FORMAT", format)
+    tscond, tsparams = _matches("T.SOURCE", source)
+    condition = tfcond + " and " + tscond
+    params = tfparams + tsparams
+    if since is not None:
+        condition += " and T.T_DATE >= " + param
+        params.append(str(since))
+    weekly = {}
+    for date, d1, s1, d2, s2, win, loss, draw in sql("""select T.T_DATE,
+            M.DECK_NAME, M.QUALIFIER, M.DECK_NAME_2, M.QUALIFIER_2, SUM(M.MATCH_WIN),
+            SUM(M.MATCH_LOSS), SUM(M.MATCH_DRAW) from MatchesSCG M
+            join Tournament T on M.T_ID = T.T_ID where """ + condition + """
+            group by T.T_DATE, M.DECK_NAME, M.QUALIFIER, M.DECK_NAME_2, M.QUALIFIER_2""",
+            *params):
+        if date is None:
+            continue
+        k = (weekOf(date), d1, s1, d2, s2)
+        w, l, d = weekly.get(k, (0, 0, 0))
+        weekly[k] = (w + win, l + loss, d + draw)
+    if since is not None:
+        sql("delete from MatchupCube where " + fcond + " and " + scond + " and WEEK >= "
+                + param, *(fparams + sparams + [str(since)]))
+    else:
+        sql("delete from MatchupCube where " + fcond + " and " + scond, *(fparams + sparams))
+    rows = []
+    cumulative = dict(base)
+    for k in sorted(weekly, key=lambda k: (k[0],) + tuple('' if x is None else x for x in k[1:])):
+        week, pair = k[0], k[1:]
+        win, loss, draw = weekly[k]
+        cw, cl, cd = cumulative.get(pair, (0, 0, 0))
+        cumulative[pair] = (cw + win, cl + loss, cd + draw)
+        rows.append({ 'FORMAT': format, 'SOURCE': source, 'WEEK': week,
+            'DECK_NAME': pair[0], 'QUALIFIER': pair[1], 'DECK_NAME_2': pair[2],
+            'QUALIFIER_2': pair[3], 'MATCH_WIN': win, 'MATCH_LOSS': loss,
+            'MATCH_DRAW': draw, 'CUM_WIN': cw + win, 'CUM_LOSS': cl + loss,
+            'CUM_DRAW': cd + draw })
+    if rows:
+        session.execute(matchupCube.insert(), rows)
+
+def staleMatchupCube(tids):
+    """The parts of the matchup cube invalidated by writing the given
+    tournaments, as { (format, source): earliest affected date }. Nothing is
+    stale if there is no cube yet."""
+    if not tids or not hasTable('MatchupCube'):
+        return {}
+    tids = list(tids)
+    earliest = {}
+    for format, source, date in sql("""select FORMAT, SOURCE, MIN(T_DATE) from Tournament
+            where T_ID """ + inequals(tids) + " group by FORMAT, SOURCE", *tids):
+        if date is not None:
+            earliest[(format, source)] = toDate(date)
+    return earliest
+
+def updateMatchupCube(tids):
+    """Bring the matchup cube up to date after the given tournaments were
+    written: each affected (format, source) is rebuilt from the earliest
+    affected week onwards."""
+    for (format, source), date in staleMatchupCube(tids).items():
+        rebuildMatchupCube(format, source, since=date)
+
+def updateSummaries(tids):
+    """Bring every summary table up to date for the given tournaments."""
+    updateArchetypeTotals(tids)
+    updateMatchupCube(tids)
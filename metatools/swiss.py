@@ -1,25 +1,18 @@
 #!/usr/bin/env python
 """Simulate a Swiss Tournament."""
 
-from deck import Deck
-from meta import Metagame
-from tournament import Tournament
-from match import Match
-from stats import *
-import pair
+from metatools.deck import Deck
+from metatools.meta import Metagame
+from metatools.tournament import Tournament
+from metatools.match import Match
+from metatools.simulate import SwissSimulator
+from metatools import pair
 
 from math import log, ceil, floor
 from random import random, shuffle
+from itertools import islice
 from operator import attrgetter
 
-def alreadyPaired(deck1, deck2):
-    """Check to see if two decks have played against each other
-    already."""
-    for match in deck1.matches:
-        if match.deck2 == deck2:
-            return True
-    return False
-
 class SimulatedTournament(Tournament):
     def __init__(self, name, meta):
         """Initialize a tournament and fill it with decks, based on the
@@ -28,12 +21,15 @@ class SimulatedTournament(Tournament):
         self.meta = meta
         self.byes = set()
         self.players = []
+        # Opponents each deck has faced so far, kept up to date as matches are played
+        self.opponents = {}
         p = 1
         for main in meta.archetypes:
             for sub in meta.archetypes[main]:
                 for i in range(meta.archetypes[main][sub]):
                     deck = Deck(player=str(p), tournament=self, points=0, archetype=main, subarchetype=sub)
                     self.players.append(deck)
+                    self.opponents[deck] = set()
                     p += 1
 
     def run(self, numrounds=None, top8=True, trackDecks=[]):
@@ -79,10 +75,10 @@ class SimulatedTournament(Tournament):
         if self.numPlayers < 2 or topx < 2:
             return self.players[0]
         if self.numPlayers < topx:
-            return self.topElim(topx/2)
+            return self.topElim(topx//2)
         winners = []
         losers = []
-        for i in range(topx/2):
+        for i in range(topx//2):
             if self.play(self.players[i], self.players[topx-1-i], None):
                 winners.append(i)
                 losers.append(topx-1-i)
@@ -91,10 +87,10 @@ class SimulatedTournament(Tournament):
                 losers.append(i)
         losers.sort()
         temp = self.players[:topx]
-        for i in range(topx/2):
+        for i in range(topx//2):
             self.players[i] = temp[winners[i]]
-            self.players[topx/2 + i] = temp[losers[i]]
-        return self.topElim(topx/2)
+            self.players[topx//2 + i] = temp[losers[i]]
+        return self.topElim(topx//2)
 
     def singleElim(self):
         """Run a single elimination tournament."""
@@ -120,7 +116,7 @@ class SimulatedTournament(Tournament):
             for i in range(0, numPlaying, 2):
                 self.play(self.players[i], self.players[i+1], round)
             round += 1
-            numPlaying /= 2
+            numPlaying //= 2
         # Assign final places.
         self.order()
         for i in range(self.numPlayers):
@@ -134,35 +130,42 @@ class SimulatedTournament(Tournament):
 
     def awardBye(self):
         """If anyone should get a bye, make it the lowest-ranked player
-        who hasn't gotten one yet. (Assumes self.players has been sorted.)"""
-        index = None
-        if self.numPlayers % 2 > 0:
-            for i in range(self.numPlayers-1, -1, -1):
-                if self.players[i] not in self.byes:
-                    index = i
-                    self.byes.add(self.players[i])
-                    self.players[i].points += 3
-                    #If everyone has somehow gotten a bye now, reset the bye list.
-                    if len(self.byes) == self.numPlayers:
-                        self.byes = set()
-                    break
-        return index
+        who hasn't gotten one yet, and return that player. (Assumes
+        self.players has been sorted.) Only players who have already had a
+        bye are passed over, so this looks at no more than len(self.byes)+1
+        players."""
+        if self.numPlayers % 2 == 0:
+            return None
+        deck = next(d for d in reversed(self.players) if d not in self.byes)
+        return self.giveBye(deck)
 
-    def pair(self, round):
-        """Generate and play pairings for this round. Guaranteed to find a
-        valid pairing if one is possible. Uses a recursive pairing function to
-        backtrack when necessary."""
-        # Initialize
-        players = self.players[:]
+    def giveBye(self, deck):
+        """Give a particular player a bye, and return that player."""
+        self.byes.add(deck)
+        deck.points += 3
+        #If everyone has somehow gotten a bye now, reset the bye list.
+        if len(self.byes) == self.numPlayers:
+            self.byes = set()
+        return deck
+
+    def _unpaired(self):
+        """Award a bye if needed and return the remaining players in order."""
         bye = self.awardBye()
-        if bye:
-            players.pop(bye)
-        pairings = []
-        # Generate 
-        pair.pair(players, pairings, alreadyPaired)
-        # Play
-        for i in range(0, len(pairings), 2):
-            self.play(pairings[i], pairings[i+1], round)
+        if bye is None:
+            return self.players
+        return [ deck for deck in self.players if deck is not bye ]
+
+    def pair(self, round):
+        """Generate and play pairings for this round. Players are paired
+        within point brackets (floating down when necessary), avoiding
+        rematches whenever a rematch-free pairing can be found."""
+        players = self._unpaired()
+        pairings, unpaired = pair.swissPair(players, attrgetter('points'),
+                self.opponents.__getitem__)
+        for deck1, deck2 in pairings:
+            self.play(deck1, deck2, round)
+        for deck in unpaired:
+            self.giveBye(deck)
 
     def simplePair(self, round):
         """Generate pairings for this round, then play them out.
@@ -171,38 +174,32 @@ class SimulatedTournament(Tournament):
         against already. If the end of the list is reached and there are
         no good pairings, pair the player against the next player in the
         list regardless."""
-        pairings = []
-        skip = set()
-        bye = self.awardBye()
-        if bye:
-            skip.add(self.players[bye])
-                    
-        # Now pair the remaining players top-down.
-        for i in range(self.numPlayers):
-            paired = False
-            if i in skip:
+        remaining = self._unpaired()
+        paired = set()
+        for i, deck1 in enumerate(remaining):
+            if deck1 in paired:
                 continue
-            for num_pass in (1, 2):
-                for j in range(i+1, self.numPlayers):
-                    if j in skip:
-                        continue
-                    # Only allow a repeat pairing if there is no other
-                    # option (other than backtracking, i.e. don't mess
-                    # with the pairings we've made so far).
-                    if num_pass==1 and alreadyPaired(self.players[i], self.players[j]):
-                        continue
-                    pairings.append((i, j))
-                    skip.add(i)
-                    skip.add(j)
-                    paired = True
-                    break
-                if paired:
+            played = self.opponents[deck1]
+            deck2 = None
+            first = None
+            for d in islice(remaining, i+1, None):
+                if d in paired:
+                    continue
+                if first is None:
+                    first = d
+                if d not in played:
+                    deck2 = d
                     break
+            if deck2 is None:
+                deck2 = first
+            if deck2 is None:
+                # Nobody left to play
+                self.giveBye(deck1)
+                break
+            paired.add(deck1)
+            paired.add(deck2)
+            self.play(deck1, deck2, round)
 
-        # Finally, play out the matches.
-        for i, j in pairings:
-            self.play(self.players[i], self.players[j], round)
-        
     def play(self, deck1, deck2, round):
         """Play out a match between two decks, based on the matchup
         percentage given by the Metagame. Update the points and store
@@ -227,6 +224,8 @@ class SimulatedTournament(Tournament):
         m2 = Match(deck2, deck1, d2, d1, round=round)
         deck1.matches.append(m1)
         deck2.matches.append(m2)
+        self.opponents.setdefault(deck1, set()).add(deck2)
+        self.opponents.setdefault(deck2, set()).add(deck1)
         return winner == deck1
 
 if __name__ == "__main__":
@@ -243,30 +242,17 @@ if __name__ == "__main__":
         }
     counts = {'A': {'': 10}, 'C': {'y': 8, 'x': 4}, 'B': {'': 12}}
     meta = Metagame(counts, matchups)
-    stats = [ getMWP(), getPercentile() ]
-
-    decks = []
-    for main in counts:
-        for sub in counts[main]:
-            deck = [ main, sub, [], {} ]
-            for f, name, datatype in stats:
-                deck[3][name] = []
-            decks.append(deck)
-    trials = 500
-    for i in range(trials):
-        t = SimulatedTournament('Trial {0}'.format(i), meta)
-        t.run()
-        for deck in decks:
-            current = [ d for d in t if d.archetype == deck[0] and d.subarchetype == deck[1] ]
-            deck[2].extend(current)
-            for f, name, datatype in stats:
-                deck[3][name].append(f(current))
 
-    header = ','.join([s[1] for s in stats])
-    print(header)
-    deck = decks[0]
-    for i in range(trials):
-        row = []
-        for f, name, datatype in stats:
-            row.append(str(deck[3][name][i]))
+    trials = 5000
+    simulator = SwissSimulator.fromMetagame(meta)
+    results = simulator.run(trials)
+    field = results['field'].sum(axis=0)
+    top8 = results['top'][8].sum(axis=0)
+    percentile = results['percentile'].sum(axis=0)
+    print('deck,field,top 8 share,top 8 conversion,avg. percentile,' +
+            ','.join(f'{w} wins' for w in range(results['wins'].shape[1])))
+    for i, name in enumerate(simulator.names):
+        row = [ name, str(field[i] / trials), str(top8[i] / (8.0 * trials)),
+                str(top8[i] / field[i]), str(percentile[i] / field[i]) ]
+        row.extend(str(x) for x in results['wins'][i] / field[i])
         print(','.join(row))
@@ -10,6 +10,7 @@ from metatools.table import Table,Field
 from metatools.dbmeta import DBMeta
 from metatools.reports import *
 from metatools.skill import *
+from metatools.skillmodel import fitSkillModel
 from metatools.insert import *
 
 # Wrapper functions to access the reports in reports.py via the command line.
@@ -140,6 +141,13 @@ def getMatchupsWrapper(args, decktypes, groups, recentMeta, historicalMeta, tour
             players, args.get('nmatches', False), args.get('sub', False),
             conf=args.get('conf', None), mainLabel=args.get('title', ''))
 
+def adjustForSkill(historicalMeta, *metagames):
+    """Fit a skill model to the historical tournaments and use its matchups,
+    with pilot skill factored out, in each of the given metagames."""
+    model = fitSkillModel(historicalMeta.tournaments)
+    for meta in (historicalMeta,) + metagames:
+        meta.adjustForSkill(model)
+
 def evWrapper(args, decktypes, groups, recentMeta, historicalMeta, tournies, players):
     """
     args: dictionary of command-line arguments
@@ -151,6 +159,8 @@ def evWrapper(args, decktypes, groups, recentMeta, historicalMeta, tournies, pla
     tournies: a list of Tournaments for the relevant time period
     players: Player names -- restrict the field to these players
     """
+    if args.get('adjust_skill'):
+        adjustForSkill(historicalMeta, recentMeta)
     return ev(args['filename'], recentMeta, historicalMeta)
 
 def explainWrapper(args, decktypes, groups, recentMeta, historicalMeta, tournies, players):
@@ -164,6 +174,8 @@ def explainWrapper(args, decktypes, groups, recentMeta, historicalMeta, tournies
     tournies: a list of Tournaments for the relevant time period
     players: Player names -- restrict the field to these players
     """
+    if args.get('adjust_skill'):
+        adjustForSkill(historicalMeta, recentMeta)
     return explain(args['deck'], recentMeta, historicalMeta, args['order'],
             metagameFile=args.get('file', None))
 
@@ -178,6 +190,12 @@ def skillWrapper(args, decktypes, groups, recentMeta, historicalMeta, tournies,
     tournies: a list of Tournaments for the relevant time period
     players: Player names -- restrict the field to these players
     """
+    if args.get('model'):
+        model = fitSkillModel(historicalMeta.tournaments, args['player_penalty'],
+                args['matchup_penalty'])
+        if args.get('ratings'):
+            return skillModelRatings(model, args['min_all'], players)
+        return skillModelMatchups(decktypes, historicalMeta, model)
     return skillDeck(decktypes, groups, historicalMeta, tournies,
         args['min_other'], args['min_deck'], args['min_all'], args['other'])
 
@@ -293,7 +311,8 @@ def buildMeta(
     # other background information.
     tournaments = getTournaments(format=format, source=source,
             min_date=begin, max_date=end)
-    historicalMeta = DBMeta(tournaments, players=players)
+    historicalMeta = DBMeta(tournaments, players=players,
+            window=(format, source, begin, end))
 
     # Then, get the overall metagame and individual metagames for recent
     # tournaments.
@@ -455,7 +474,7 @@ def main(arglist):
     breakdownp = subp.add_parser('breakdown', help='Show a breakdown for one or more tournaments.')
     breakdownp.add_argument('outputs', nargs='*', type=str, default=['field', 'n',
             'avgplace', 'win', 'loss', 'draw', 'mwp', 'mwpLowerBound', 'mwpUpperBound',
-            'mwpo', 'ev', 'evPairings'],
+            'mwpo', 'ev', 'evLowerBound', 'evUpperBound', 'evPairings'],
             help='Statistics to output.')
     breakdownp.add_argument('-a', '--all', action="store_true",
             help='Break down all tournaments from the given time period.')
@@ -504,6 +523,8 @@ def main(arglist):
 
     evp = subp.add_parser('ev', help='Estimate EVs for a hypothetical metagame.')
     evp.add_argument('filename', type=str, help='CSV file containing deck counts or percentages.')
+    evp.add_argument('--adjust_skill', action='store_true', help='Use matchups \
+            adjusted for pilot skill (see skill --model).')
     evp.set_defaults(func=evWrapper)
 
     explainp = subp.add_parser('explain', help='Try to explain a deck\'s win\
@@ -514,6 +535,8 @@ def main(arglist):
             order by: w, l, ev, evneg, winp, or lossp.')
     explainp.add_argument('-f', '--file', type=str, nargs='?',
             help='If given, also compute EV against a metagame loaded from a CSV file.')
+    explainp.add_argument('--adjust_skill', action='store_true', help='Use matchups \
+            adjusted for pilot skill (see skill --model).')
     explainp.set_defaults(func=explainWrapper)
 
     gridp = subp.add_parser('grid', help='Print a table of matchups between various decks.')
@@ -599,6 +622,16 @@ def main(arglist):
             Minimum number of total matches needed to include the data point.')
     skillp.add_argument('-o', '--other', action='store_true', help='\
             Also report performance with other decks.')
+    skillp.add_argument('--model', action='store_true', help='\
+            Fit a model of match results with both player ratings and \
+            archetype matchups, and report matchups between the selected \
+            decks with pilot skill factored out.')
+    skillp.add_argument('--ratings', action='store_true', help='\
+            With --model, report player ratings instead of matchups.')
+    skillp.add_argument('--player_penalty', type=float, default=1.0, help='\
+            With --model, L2 penalty on player ratings (default: %(default)s).')
+    skillp.add_argument('--matchup_penalty', type=float, default=0.1, help='\
+            With --model, L2 penalty on matchup effects (default: %(default)s).')
     skillp.set_defaults(func=skillWrapper)
 
     insertp = subp.add_parser('insert', help='Insert a tournament from CSV files.')
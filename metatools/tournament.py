@@ -1,3 +1,5 @@
+from metatools.deck import playerKeys
+
 class Tournament(object):
     """Represents a tournament.
 
@@ -79,9 +81,10 @@ class Tournament(object):
         """Get the number of players. If the stored number of players
         differs from the total number of decks, return the larger."""
         if players:
+            keys = playerKeys(players)
             count = 0
             for d in self.decks:
-                if d.player and d.player in players:
+                if d.playerKey in keys:
                     count += 1
             return count
         return max(self.numPlayers, len(self.decks))
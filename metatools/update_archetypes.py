@@ -2,10 +2,15 @@
 
 from metatools.archetypes import ArchetypeParser
 from metatools.database import session, getTournaments
+from metatools.summaries import updateArchetypeTotals, updateMatchupCube
 
 import argparse
 
 def update_tournament_archetypes(session, t_id, parser):
+    """Reclassify a tournament's decks and update its archetype totals.
+    Returns whether any deck changed; the caller should then update the
+    matchup cube (see updateMatchupCube), which is cheaper to do once for
+    every tournament changed."""
     matching_tournaments = getTournaments(tids=[t_id])
     if len(matching_tournaments) == 0:
         raise Exception(f"No tournament found with T_ID={t_id}")
@@ -20,7 +25,7 @@ def update_tournament_archetypes(session, t_id, parser):
         if not deck.maindeck or deck.count() < 50:
             n_skipped += 1
             continue
-        main, sub = parser.classify(deck)
+        main, sub, exact_match = parser.classify(deck)
         updated = False
         if main is not None and deck.archetype != main:
             print(f"Updating {deck}: archetype {deck.archetype} -> {main}")
@@ -34,8 +39,12 @@ def update_tournament_archetypes(session, t_id, parser):
             n_updated += 1
         else:
             n_unchanged += 1
+    if n_updated > 0:
+        session.flush()
+        updateArchetypeTotals([t_id])
     n_total = n_skipped + n_updated + n_unchanged
     print(f"Processed {n_total} decks: {n_updated} updated, {n_unchanged} unchanged, {n_skipped} skipped.")
+    return n_updated > 0
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser(description="Re-run archetype classification on one or more "
@@ -47,8 +56,10 @@ if __name__ == "__main__":
     args = p.parse_args()
 
     archetype_parser = ArchetypeParser(args.archetype_dir)
-    for t_id in args.t_ids:
-        update_tournament_archetypes(session, t_id, archetype_parser)
+    updated = [ t_id for t_id in args.t_ids
+            if update_tournament_archetypes(session, t_id, archetype_parser) ]
+    # One rebuild per (format, source), from the earliest tournament changed
+    updateMatchupCube(updated)
     if args.dry_run:
         print('(Not committing; dry run.)')
     else:
@@ -0,0 +1,193 @@
+"""Concurrent HTTP fetching for parse_melee.
+
+A Fetcher runs requests as asyncio tasks with a bound on how many are in
+flight at once, a minimum interval between requests to the same host, and
+retries with exponential backoff for connection errors, rate limiting (429)
+and server errors. The actual I/O is done by a transport, so tests (or a
+different HTTP library) can swap it out; the default runs a requests.Session
+in a thread pool.
+
+Successful responses can also be kept in an on-disk ResponseCache, so that
+rerunning a fetch (e.g. after a failure partway through) only requests what
+wasn't already downloaded.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+RETRY_STATUS = { 429, 500, 502, 503, 504 }
+
+class Response(namedtuple('Response', ['url', 'status', 'headers', 'text'])):
+    def json(self):
+        return json.loads(self.text)
+
+class RequestsTransport(object):
+    """Blocking requests.Session calls, run in a thread pool."""
+
+    def __init__(self, workers=8, timeout=30):
+        import requests
+        self.session = requests.Session()
+        self.pool = ThreadPoolExecutor(workers)
+        self.timeout = timeout
+
+    def _request(self, method, url, headers, data, allow_redirects):
+        response = self.session.request(method, url, headers=headers, data=data,
+                allow_redirects=allow_redirects, timeout=self.timeout)
+        return Response(url, response.status_code, dict(response.headers), response.text)
+
+    async def request(self, method, url, headers=None, data=None, allow_redirects=True):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, self._request, method, url, headers,
+                data, allow_redirects)
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        self.session.close()
+
+class RateLimiter(object):
+    """Space out the start of requests to each host by at least 1/rate
+    seconds."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next = {}
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        start = max(now, self.next.get(host, now))
+        self.next[host] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+class ResponseCache(object):
+    """Successful responses stored on disk, one JSON file per request, named
+    by a hash of the method, URL and payload. Entries are written atomically
+    as soon as each response arrives."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, method, url, data=None):
+        payload = json.dumps(data, sort_keys=True) if data is not None else ''
+        return hashlib.sha256('\n'.join([method, url, payload]).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key, ttl=None):
+        """Return the cached Response, or None if there isn't one or it's
+        older than ttl seconds (None: never expires; 0: always refetch)."""
+        if ttl == 0:
+            return None
+        try:
+            with open(self.path(key)) as infile:
+                entry = json.load(infile)
+        except (OSError, ValueError):
+            return None
+        if ttl is not None and time.time() - entry['time'] > ttl:
+            return None
+        return Response(entry['url'], entry['status'], entry['headers'], entry['text'])
+
+    def put(self, key, response):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'w') as outfile:
+            json.dump({ 'url': response.url, 'status': response.status,
+                'headers': response.headers, 'text': response.text, 'time': time.time() },
+                outfile)
+        os.replace(temp, path)
+
+class Fetcher(object):
+    """Bounded, rate limited, retrying HTTP requests for use from coroutines."""
+
+    def __init__(self, transport=None, concurrency=8, rate=10.0, retries=4, backoff=0.5,
+            cache=None):
+        """transport: Object with a coroutine request(method, url, headers, data,
+            allow_redirects) returning a Response (default: RequestsTransport).
+        concurrency: Maximum number of requests in flight.
+        rate: Maximum requests per second to any one host (None for no limit).
+        retries: Number of times to retry a failed request.
+        backoff: Delay before the first retry, in seconds; doubled each time.
+        cache: Optional ResponseCache (or directory name) for successful
+            responses."""
+        self.transport = transport if transport is not None else RequestsTransport(concurrency)
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = ResponseCache(cache) if isinstance(cache, str) else cache
+        self.hits = 0
+        self.misses = 0
+        self._semaphore = None
+
+    def _delay(self, attempt, response=None):
+        if response is not None:
+            try:
+                return float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                pass
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def request(self, method, url, headers=None, data=None, allow_redirects=True,
+            ttl=0):
+        """Make a request, or return a cached response no older than ttl
+        seconds (None: any cached response will do)."""
+        if self.cache is not None:
+            key = self.cache.key(method, url, data)
+            cached = self.cache.get(key, ttl)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+        response = await self._fetch(method, url, headers, data, allow_redirects)
+        if self.cache is not None and response.status == 200:
+            self.cache.put(key, response)
+        return response
+
+    async def _fetch(self, method, url, headers, data, allow_redirects):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            response = None
+            async with self._semaphore:
+                await self.limiter.wait(host)
+                try:
+                    response = await self.transport.request(method, url, headers=headers,
+                            data=data, allow_redirects=allow_redirects)
+                except Exception as e:
+                    error = e
+                else:
+                    if response.status not in RETRY_STATUS:
+                        return response
+                    error = f"HTTP {response.status}"
+            if attempt < self.retries:
+                delay = self._delay(attempt, response)
+                print(f'Retrying {method} {url} in {delay:.1f}s ({error})', file=sys.stderr)
+                await asyncio.sleep(delay)
+        raise Exception(f"{method} {url} failed after {self.retries + 1} attempts: {error}")
+
+    async def get(self, url, headers=None, allow_redirects=True, ttl=0):
+        return await self.request('GET', url, headers=headers, allow_redirects=allow_redirects,
+                ttl=ttl)
+
+    async def post(self, url, data, headers=None, allow_redirects=False, ttl=0):
+        return await self.request('POST', url, headers=headers, data=data,
+                allow_redirects=allow_redirects, ttl=ttl)
+
+    def close(self):
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            close()
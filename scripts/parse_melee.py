@@ -1,37 +1,73 @@
 #!/usr/bin/env python
 
 import argparse
+import asyncio
 import csv
+import datetime
+import html
 import json
+import multiprocessing
+import os
 import re
-import requests
 import sys
 
 import bs4
 
+from melee_http import Fetcher
 
-def fetch_html(url, allow_redirects=True):
-    """Fetch using GET and return a BeautifulSoup object representing the HTML content."""
+# How long cached responses stay valid, in seconds. A tournament's overview
+# changes as rounds finish, but decklists and the results and standings of a
+# completed round never do.
+TOURNAMENT_TTL = 3600
+IMMUTABLE = None
+CACHE_DIR = os.environ.get('MELEE_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '.meleecache'))
+
+
+async def fetch_text(fetcher, url, allow_redirects=True, ttl=0):
+    """Fetch using GET and return the response body."""
     headers = {
         'User-Agent': 'curl/7.61.1',
         'cache-control': 'no-cache',
         'Accept': '*/*'
     }
-    response = requests.get(url, headers=headers, allow_redirects=allow_redirects)
-    return bs4.BeautifulSoup(response.text, 'html.parser')
+    response = await fetcher.get(url, headers=headers, allow_redirects=allow_redirects, ttl=ttl)
+    return response.text
 
-def fetch_json(url, payload):
+async def fetch_html(fetcher, url, allow_redirects=True, ttl=0):
+    """Fetch using GET and return a BeautifulSoup object representing the HTML content."""
+    text = await fetch_text(fetcher, url, allow_redirects=allow_redirects, ttl=ttl)
+    return bs4.BeautifulSoup(text, 'html.parser')
+
+async def fetch_json(fetcher, url, payload, ttl=0):
     """Fetch using POST, passing the payload as the body, and return a JSON object."""
     headers = {
         'User-Agent': 'curl/7.61.1'
     }
-    response = requests.post(url, headers=headers, data=payload, allow_redirects=False)
+    response = await fetcher.post(url, payload, headers=headers, allow_redirects=False, ttl=ttl)
     json_data = response.json()
     return json_data
 
-def get_round_info(tournament_id, allow_incomplete=False):
+async def fetch_pages(fetcher, url, payload, page_size, ttl=0):
+    """Fetch every page of a paginated table: the first page gives the total
+    number of records, then the rest are fetched concurrently. Returns the
+    total and the records in order."""
+    def page_payload(page):
+        return dict(payload, start=str(page * page_size), length=str(page_size))
+    content = await fetch_json(fetcher, url, page_payload(0), ttl)
+    total = content['recordsTotal']
+    pages = (total + page_size - 1) // page_size
+    rest = await asyncio.gather(*[ fetch_json(fetcher, url, page_payload(page), ttl)
+        for page in range(1, pages) ])
+    records = list(content['data'])
+    for page in rest:
+        records.extend(page['data'])
+    return total, records
+
+async def get_round_info(fetcher, tournament_id, allow_incomplete=False):
     rounds = []
-    soup = fetch_html(f"https://melee.gg/Tournament/View/{tournament_id}")
+    soup = await fetch_html(fetcher, f"https://melee.gg/Tournament/View/{tournament_id}",
+            ttl=TOURNAMENT_TTL)
     standings = soup.find('div', id='standings')
     buttons = standings.find_all('button')
     i = 1
@@ -69,59 +105,68 @@ def get_round_info(tournament_id, allow_incomplete=False):
     rounds.sort(key=lambda p: p['index'])
     return rounds
 
-def fetch_standings(round_id, page_size=25):
+async def fetch_standings(fetcher, round_id, page_size=25, ttl=IMMUTABLE):
     payload = {
         'roundId': round_id,
         'columns[0][data]': 'Rank',
         'columns[0][name]': 'Rank',
         'order[0][dir]': 'asc',
-        'order[0][column]': '0',
-        "length": str(page_size)
+        'order[0][column]': '0'
     }
-    player_data = []
-    page = 0
-    total_players = 0
-    while page == 0 or page * page_size < total_players:
-        payload['start'] = str(page * page_size)
-        content = fetch_json("https://melee.gg/Standing/GetRoundStandings", payload)
-        total_players = content['recordsTotal']
-        if total_players == 0:
-            return None
-        player_data.extend(content['data'])
-        page += 1
+    total_players, player_data = await fetch_pages(fetcher,
+            "https://melee.gg/Standing/GetRoundStandings", payload, page_size, ttl)
+    if total_players == 0:
+        return None
     return player_data
 
-def fetch_round_results(round_id, page_size=25):
-    page = 0
+async def fetch_round_results(fetcher, round_id, page_size=25, ttl=IMMUTABLE):
     payload = {
         "columns[0][data]": "TableNumber",
         "columns[0][name]": "TableNumber",
         "order[0][column]": "0",
-        "order[0][dir]": "asc",
-        "length": str(page_size)
+        "order[0][dir]": "asc"
     }
-    records = []
-    page = 0
-    total_records = 0
-    while page == 0 or page * page_size < total_records:
-        payload['start'] = str(page * page_size)
-        content = fetch_json(f"https://melee.gg/Match/GetRoundMatches/{round_id}", payload)
-        total_records = content['recordsTotal']
-        records.extend(content['data'])
-        page += 1
+    total_records, records = await fetch_pages(fetcher,
+            f"https://melee.gg/Match/GetRoundMatches/{round_id}", payload, page_size, ttl)
     return records
 
-def fetch_decklist(deck_id):
-    """Fetches decklist and returns it in the form of a string:
-    '4 Card Name 3\r\nCard Name 2\r\n...4 Card Name N\r\n\r\nSideboard\r\n3 Sideboard Card 1\r\n...\r\n3 Sideboard Card M'
-    """
-    decklist_url = f"https://melee.gg/Decklist/View/{deck_id}"
-    soup = fetch_html(decklist_url)
-    copy_button = soup.find('button', class_='decklist-builder-copy-button')
-    if copy_button is not None:
-        decklist = copy_button['data-clipboard-text']
+BUTTON_TAG = re.compile(r"""<button\b((?:[^>"']|"[^"]*"|'[^']*')*)>""", re.IGNORECASE)
+# Markup an HTML parser never treats as tags: comments and the contents of
+# script and style elements
+NOT_TAGS = re.compile(r"<!--.*?-->|<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+ATTRIBUTE = re.compile(r"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+)))?""")
+
+def tag_attributes(text):
+    """Attributes of an HTML start tag, given the text after its name."""
+    attributes = {}
+    for match in ATTRIBUTE.finditer(text):
+        value = next((v for v in match.groups()[1:] if v is not None), '')
+        attributes.setdefault(match.group(1).lower(), html.unescape(value))
+    return attributes
+
+def scan_clipboard_text(page, button_class='decklist-builder-copy-button'):
+    """Find the data-clipboard-text of the first button with the given class
+    by scanning the raw HTML, without parsing the whole page. Returns None
+    if there is no such button or it has no clipboard text."""
+    if button_class not in page:
+        return None
+    for match in BUTTON_TAG.finditer(NOT_TAGS.sub('', page)):
+        if button_class not in match.group(1):
+            continue
+        attributes = tag_attributes(match.group(1))
+        if button_class in attributes.get('class', '').split():
+            return attributes.get('data-clipboard-text')
+    return None
+
+def parse_decklist(page, decklist_url=''):
+    """Extract a decklist from a decklist page, preferring the text behind
+    its copy button and falling back to the individual card entries."""
+    decklist = scan_clipboard_text(page)
+    if decklist is not None:
         return re.sub('^Deck\r?\n', '', decklist)
-    decklist_container = soup.find('div', class_='decklist-container')
+    strainer = bs4.SoupStrainer('div', class_='decklist-container')
+    decklist_container = bs4.BeautifulSoup(page, 'html.parser', parse_only=strainer).find(
+            'div', class_='decklist-container')
     if decklist_container is not None:
         maindeck = []
         sideboard = []
@@ -147,21 +192,67 @@ def fetch_decklist(deck_id):
     print(f"WARNING: Unable to find decklist in {decklist_url}", file=sys.stderr)
     return None
 
-def fetch_player_data(rounds, allow_incomplete=True, forward=False):
+async def fetch_decklist(fetcher, deck_id):
+    """Fetches decklist and returns it in the form of a string:
+    '4 Card Name 3\r\nCard Name 2\r\n...4 Card Name N\r\n\r\nSideboard\r\n3 Sideboard Card 1\r\n...\r\n3 Sideboard Card M'
+    """
+    decklist_url = f"https://melee.gg/Decklist/View/{deck_id}"
+    page = await fetch_text(fetcher, decklist_url, ttl=IMMUTABLE)
+    return parse_decklist(page, decklist_url)
+
+def round_ttl(round_props):
+    return IMMUTABLE if round_props['complete'] else 0
+
+async def fetch_player_data(fetcher, rounds, allow_incomplete=True, forward=False):
     player_data = []
     for i in range(len(rounds)):
         index = i if forward else len(rounds)-1-i
-        player_data = fetch_standings(rounds[index]['id'])
+        player_data = await fetch_standings(fetcher, rounds[index]['id'],
+                ttl=round_ttl(rounds[index]))
         if player_data is not None and len(player_data) > 0:
             break
     return player_data
 
+def run(func, *args, fetcher=None, **kwargs):
+    """Run a coroutine function that takes a Fetcher as its first argument,
+    creating (and afterwards closing) a default Fetcher if none is given."""
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = Fetcher()
+    try:
+        return asyncio.run(func(fetcher, *args, **kwargs))
+    finally:
+        if own_fetcher:
+            fetcher.close()
+
 def fetch_tournament(tournament_id, player_output=None, match_output=None, allow_incomplete=False,
-        decklists=None):
-    data = {}
+        decklists=None, fetcher=None):
+    return run(fetch_tournament_async, tournament_id, allow_incomplete=allow_incomplete,
+            decklists=decklists, fetcher=fetcher)
+
+async def fetch_players(fetcher, tournament_id):
+    rounds = await get_round_info(fetcher, tournament_id, allow_incomplete=True)
+    return await fetch_player_data(fetcher, rounds, forward=True)
+
+async def fetch_tournament_async(fetcher, tournament_id, allow_incomplete=False, decklists=None):
+    players, rounds, results = await fetch_tournament_data(fetcher, tournament_id,
+            allow_incomplete=allow_incomplete, decklists=bool(decklists))
+    if decklists is not None:
+        write_decklists(players, decklists)
+    return tournament_rows(players, rounds, results)
+
+async def fetch_tournament_data(fetcher, tournament_id, allow_incomplete=False, decklists=False):
+    """Fetch a tournament's players (with decklists, if requested) and
+    results. Returns (players, rounds, results), where results maps each
+    round's index to a list of (player ID, opponent ID, wins, losses), with
+    an opponent of None for a bye."""
     players = []
-    rounds = get_round_info(tournament_id, allow_incomplete)
-    player_data = fetch_player_data(rounds, allow_incomplete=allow_incomplete)
+    rounds = await get_round_info(fetcher, tournament_id, allow_incomplete)
+    # Every round's results can be fetched alongside the standings and decklists
+    round_tasks = [ asyncio.ensure_future(fetch_round_results(fetcher, round_metadata['id'],
+            ttl=round_ttl(round_metadata))) for round_metadata in rounds ]
+    player_data = await fetch_player_data(fetcher, rounds, allow_incomplete=allow_incomplete)
+    decklist_tasks = {}
     for entry in player_data:
         player_record = {
                 'place': entry['Rank'],
@@ -173,10 +264,13 @@ def fetch_tournament(tournament_id, player_output=None, match_output=None, allow
             player_record['archetype'] = entry['Decklists'][0]['DecklistName']
             if decklists:
                 deck_id = entry['Decklists'][0]['DecklistId']
-                player_record['decklist'] = fetch_decklist(deck_id)
-                if player_record['decklist'] is None:
-                    print(f"WARNING: couldn't fetch decklist: {player_record}", file=sys.stderr)
+                decklist_tasks[len(players)] = fetch_decklist(fetcher, deck_id)
         players.append(player_record)
+    fetched = await asyncio.gather(*decklist_tasks.values())
+    for i, decklist in zip(decklist_tasks, fetched):
+        players[i]['decklist'] = decklist
+        if decklist is None:
+            print(f"WARNING: couldn't fetch decklist: {players[i]}", file=sys.stderr)
     distinct_names = set()
     for i in range(len(players)):
         if players[i]['player'] in distinct_names:
@@ -185,49 +279,60 @@ def fetch_tournament(tournament_id, player_output=None, match_output=None, allow
                 j += 1
             players[i]["player"] = f'{players[i]["player"]}{j}'
         distinct_names.add(players[i]["player"])
-    if decklists is not None:
-        with open(decklists, 'a') as file:
-            json.dump(players, file, indent=4, ensure_ascii=False)
-    player_names = {metadata['id']: metadata['player'] for metadata in players}
-    player_records = {metadata['id']: {} for metadata in players}
-    opponents = {metadata['player']: {} for metadata in players}
-    for round_metadata in rounds:
+    player_ids = {metadata['id'] for metadata in players}
+    results = {}
+    all_round_data = await asyncio.gather(*round_tasks)
+    for round_metadata, round_data in zip(rounds, all_round_data):
         round_index = round_metadata['index']
-        round_data = fetch_round_results(round_metadata['id'])
+        round_results = results.setdefault(round_index, [])
         for entry in round_data:
-            game_counts = {}
             competitors = entry['Competitors']
             if len(competitors) == 1:
                 p1 = competitors[0]['Team']['Players'][0]['ID']
-                if p1 in player_records:
-                    player_records[p1][round_index] = ['', f"Bye"]
+                if p1 in player_ids:
+                    round_results.append((p1, None, 0, 0))
                 else:
                     name = competitors[0]['Team']['Players'][0]['DisplayName']
-                    print(f'WARNING: round {round_index}: player {p1} "{name}" not found in {len(player_records)} records', file=sys.stderr)
+                    print(f'WARNING: round {round_index}: player {p1} "{name}" not found in {len(player_ids)} records', file=sys.stderr)
             elif len(competitors) == 2:
                 p1 = competitors[0]['Team']['Players'][0]['ID']
                 p2 = competitors[1]['Team']['Players'][0]['ID']
                 w1 = int(competitors[0]['GameWinsAndGameByes'])
                 l1 = int(competitors[1]['GameWinsAndGameByes'])
-                if p1 in player_names and p2 in player_names:
-                    player_records[p1][round_index] = [player_names.get(p2, ''), f"{w1}-{l1}"]
-                    player_records[p2][round_index] = [player_names.get(p1, ''), f"{l1}-{w1}"]
+                if p1 in player_ids and p2 in player_ids:
+                    round_results.append((p1, p2, w1, l1))
                 else:
-                    if p1 not in player_records:
+                    if p1 not in player_ids:
                         p1name = competitors[0]['Team']['Players'][0]['DisplayName']
-                        print(f'WARNING: round {round_index}: player {p1} "{p1name}" not found in {len(player_names)} standings', file=sys.stderr)
-                    if p2 not in player_names:
+                        print(f'WARNING: round {round_index}: player {p1} "{p1name}" not found in {len(player_ids)} standings', file=sys.stderr)
+                    if p2 not in player_ids:
                         p2name = competitors[1]['Team']['Players'][0]['DisplayName']
-                        print(f'WARNING: round {round_index}: player {p2} "{p2name}" not found in {len(player_names)} standings', file=sys.stderr)
+                        print(f'WARNING: round {round_index}: player {p2} "{p2name}" not found in {len(player_ids)} standings', file=sys.stderr)
             else:
                 raise Exception(f"Doesn't know how to handle other than two 'Competitors': {competitors}")
+    return players, rounds, results
+
+def write_decklists(players, filename):
+    with open(filename, 'a') as file:
+        json.dump(players, file, indent=4, ensure_ascii=False)
+
+def tournament_rows(players, rounds, results):
+    """Rows of a TSV in the form read by insert_ldcp: player, archetype, and
+    an opponent and result for each round. Returns (rows, header)."""
+    player_names = {metadata['id']: metadata['player'] for metadata in players}
+    player_records = {metadata['id']: {} for metadata in players}
+    for round_index, round_results in results.items():
+        for p1, p2, w1, l1 in round_results:
+            if p2 is None:
+                player_records[p1][round_index] = ['', f"Bye"]
+            else:
+                player_records[p1][round_index] = [player_names.get(p2, ''), f"{w1}-{l1}"]
+                player_records[p2][round_index] = [player_names.get(p1, ''), f"{l1}-{w1}"]
     rows = []
     for player in players:
         player_name = player['player']
         player_id = player['id']
         row = [player_name, player['archetype']]
-        for i in range(len(rounds)):
-            pass
         for round_metadata in rounds:
             round_index = round_metadata['index']
             if round_index in player_records[player_id]:
@@ -241,6 +346,105 @@ def fetch_tournament(tournament_id, player_output=None, match_output=None, allow
         header.append('')
     return rows, header
 
+def write_rows(rows, header, file, delimiter='\t'):
+    writer = csv.writer(file, delimiter=delimiter)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+
+def decklist_slots(decklist):
+    """Card counts in a decklist string, as {card: (main, side)}, read by
+    Deck.readLines as insert_ldcp reads decklists."""
+    from metatools.deck import Deck
+    deck = Deck()
+    deck.readLines([ line.strip() for line in decklist.splitlines() if line.strip() != '' ])
+    return { card: (deck.maindeck.get(card, 0), deck.sideboard.get(card, 0))
+            for card in set(deck.maindeck) | set(deck.sideboard) }
+
+def tournament_record(players, rounds, results, name, date, mtg_format, source='melee.gg'):
+    """Build a record for metatools.bulk.BulkWriter directly from fetched
+    tournament data. Matches are stored from both players' sides, and byes
+    are left out, as insert_ldcp does."""
+    index = {}
+    decks = []
+    for player in players:
+        index[player['id']] = len(decks)
+        deck = { 'player': player['player'], 'place': player['place'], 'points': 0,
+                'archetype': player['archetype'], 'original': player['archetype'] }
+        decklist = (player.get('decklist') or '').strip()
+        if decklist:
+            deck['slots'] = decklist_slots(decklist)
+        decks.append(deck)
+    matches = []
+    for round_index, round_results in results.items():
+        for p1, p2, w1, l1 in round_results:
+            if p2 is None:
+                continue
+            i1 = index[p1]
+            i2 = index[p2]
+            matches.append((i1, i2, w1, l1, 0, round_index))
+            matches.append((i2, i1, l1, w1, 0, round_index))
+            if w1 > l1:
+                decks[i1]['points'] += 3
+            elif l1 > w1:
+                decks[i2]['points'] += 3
+    tournament = { 'name': name, 'date': date, 'format': mtg_format,
+            'numPlayers': len(decks), 'source': source }
+    return { 'tournament': tournament, 'decks': decks, 'matches': matches }
+
+_worker_parser = None
+
+def _init_worker(archetype_dir):
+    global _worker_parser
+    from metatools.archetypes import ArchetypeParser
+    _worker_parser = ArchetypeParser(archetype_dir)
+
+def _classify_decks(decks):
+    """Worker task: classify a chunk of a record's decks."""
+    from metatools.bulk import classifyRecord
+    return classifyRecord({ 'decks': decks }, _worker_parser)['decks']
+
+def classify_decks(record, archetype_dir, jobs=None, chunk_size=16):
+    """Classify every deck in a record with a decklist, in a pool of worker
+    processes (or in this process, if jobs is 1)."""
+    decks = record['decks']
+    chunks = [ decks[i:i+chunk_size] for i in range(0, len(decks), chunk_size) ]
+    if jobs == 1:
+        _init_worker(archetype_dir)
+        classified = map(_classify_decks, chunks)
+        record['decks'] = [ deck for chunk in classified for deck in chunk ]
+        return record
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(archetype_dir,)) as pool:
+        classified = pool.map(_classify_decks, chunks)
+    record['decks'] = [ deck for chunk in classified for deck in chunk ]
+    return record
+
+def insert_tournament(tournament_id, name, date, mtg_format, source='melee.gg', archetypes=None,
+        jobs=None, allow_incomplete=False, dry_run=False, output=None, delimiter='\t',
+        decklists=None, fetcher=None):
+    """Fetch a tournament and insert it into the database with a BulkWriter,
+    optionally also writing the TSV (output) and decklist JSON (decklists)
+    as archival copies."""
+    from metatools.bulk import BulkWriter
+    from metatools.database import session
+    writer = BulkWriter(session, dryRun=dry_run)
+    if writer.isIngested(name, date):
+        print(f'Skipping {name} ({date}): already in the database')
+        return False
+    players, rounds, results = run(fetch_tournament_data, tournament_id,
+            allow_incomplete=allow_incomplete, decklists=True, fetcher=fetcher)
+    if output is not None:
+        with open(output, 'w', newline='') as file:
+            write_rows(*tournament_rows(players, rounds, results), file, delimiter)
+    if decklists is not None:
+        write_decklists(players, decklists)
+    record = tournament_record(players, rounds, results, name, date, mtg_format, source)
+    if archetypes:
+        classify_decks(record, archetypes, jobs)
+    writer.add(record)
+    writer.close()
+    return True
+
 if __name__ == "__main__":
     p = argparse.ArgumentParser("Download an MTGMelee tournament.")
     p.add_argument("tournament_id", type=int, help="Tournament ID in melee.gg")
@@ -248,15 +452,44 @@ if __name__ == "__main__":
     p.add_argument("-i", "--incomplete", action="store_true", help="Proceed even if some rounds are marked as incomplete")
     p.add_argument("-l", "--lists", help="Write decklists to a JSON file with this path")
     p.add_argument("-p", "--players", action="store_true", help="Just fetch player data and exit")
+    p.add_argument("-c", "--concurrency", type=int, default=8, help="Maximum number of requests in flight")
+    p.add_argument("-r", "--rate", type=float, default=10.0, help="Maximum requests per second")
+    p.add_argument("--cache-dir", default=CACHE_DIR, help="Directory for cached responses (default: %(default)s)")
+    p.add_argument("--no-cache", action="store_true", help="Don't read or write cached responses")
+    p.add_argument("--refresh", action="store_true", help="Refetch the tournament overview even if recently cached")
+    p.add_argument("--insert", action="store_true", help="Insert the tournament directly into the database "
+            + "instead of printing a TSV (requires --name, --format and --date)")
+    p.add_argument("-n", "--name", help="Tournament name, for --insert")
+    p.add_argument("-f", "--format", help="Tournament format, for --insert")
+    p.add_argument("--date", type=datetime.date.fromisoformat, help="Tournament date (YYYY-MM-DD), for --insert")
+    p.add_argument("-s", "--source", default="melee.gg", help="Tournament source, for --insert (default: %(default)s)")
+    p.add_argument("-a", "--archetypes", help="Archetype parsing rule directory, used with --insert to "
+            + "classify decklists (the Melee deck name is the fallback)")
+    p.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes used to "
+            + "classify decklists (default: number of CPUs)")
+    p.add_argument("-o", "--output", help="With --insert, also write the TSV to this file")
+    p.add_argument("-D", "--dry_run", action="store_true", help="With --insert, don't commit anything to the database")
     args = p.parse_args()
+    if args.insert and (args.name is None or args.format is None or args.date is None):
+        p.error("--insert requires --name, --format and --date")
+    if args.refresh:
+        TOURNAMENT_TTL = 0
+    fetcher = Fetcher(concurrency=args.concurrency, rate=args.rate,
+            cache=None if args.no_cache else args.cache_dir)
     if args.players:
-        rounds = get_round_info(args.tournament_id, allow_incomplete=True)
-        player_data = fetch_player_data(rounds, forward=True)
+        player_data = run(fetch_players, args.tournament_id, fetcher=fetcher)
         print(json.dumps(player_data))
+        fetcher.close()
         sys.exit(0)
-    rows, header = fetch_tournament(args.tournament_id, allow_incomplete=args.incomplete,
-            decklists=args.lists)
-    writer = csv.writer(sys.stdout, delimiter=args.delimiter)
-    writer.writerow(header)
-    for row in rows:
-        writer.writerow(row)
+    if args.insert:
+        insert_tournament(args.tournament_id, args.name, args.date, args.format, args.source,
+                archetypes=args.archetypes, jobs=args.jobs, allow_incomplete=args.incomplete,
+                dry_run=args.dry_run, output=args.output, delimiter=args.delimiter,
+                decklists=args.lists, fetcher=fetcher)
+    else:
+        rows, header = fetch_tournament(args.tournament_id, allow_incomplete=args.incomplete,
+                decklists=args.lists, fetcher=fetcher)
+        write_rows(rows, header, sys.stdout, args.delimiter)
+    fetcher.close()
+    if fetcher.cache is not None:
+        print(f'{fetcher.hits} cached responses, {fetcher.misses} requests', file=sys.stderr)
@@ -0,0 +1,107 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = os.path.join(ROOT, 'database', 'create_tables.sql')
+
+# Runs in a separate process, since metatools.database connects to whatever
+# database TMI_CONFIG names when it's first imported
+INSERT = """
+import datetime, json, sys
+from metatools.bulk import BulkWriter
+from metatools.database import session, sql, deckQuery, getTournaments, getArchetypePlayers, \
+        getPlayerRecords, getUniqueMatches
+from metatools.meta import ObservedMeta
+from metatools.insert_ldcp import insertLDCPTournament
+
+insertLDCPTournament(session, sys.argv[1] + '/Legacy Challenge 5_4_2024.tsv')
+session.commit()
+writer = BulkWriter(session, verbose=False)
+writer.add({ 'tournament': { 'name': 'Bulk Open', 'date': datetime.date(2024, 5, 11),
+        'format': 'Legacy', 'numPlayers': 2, 'source': 'SCG' },
+    'decks': [ { 'player': 'José Ruiz', 'archetype': 'Delver', 'place': 1, 'points': 3 },
+        { 'player': 'Ana  Lee', 'archetype': 'Lands', 'place': 2, 'points': 0 } ],
+    'matches': [ (0, 1, 2, 1, 0, 1), (1, 0, 1, 2, 0, 1) ] })
+writer.close()
+tables = [ row[0] for row in sql("select name from sqlite_master where type = 'table'") ]
+counts = { table: sql('select count(*) from ' + table).scalar()
+        for table in ('Deck', 'Matches', 'ArchetypeTotals', 'MatchupCube') if table in tables }
+tids = [ t.id for t in getTournaments() ]
+def players(**kwargs):
+    return sorted(d.player for d in deckQuery(**kwargs).all())
+lookups = {
+    'players': players(players=[ 'josé ruiz', 'ANA  LEE' ]),
+    'prefixes': players(playerPrefixes=[ 'jos', 'ana  l' ]),
+    'archetypePlayers': sorted(list(row) for row in getArchetypePlayers(tids, [ 'Delver', 'Lands' ])),
+    'records': sorted(row[0] for row in getPlayerRecords(tids)),
+    'matches': sorted({ key for row in getUniqueMatches(tids=tids) for key in row[11:] }),
+    'field': ObservedMeta(getTournaments(), players=[ 'JOSÉ RUIZ', 'ana lee' ]).total,
+}
+print(json.dumps({ 'counts': counts, 'lookups': lookups }))
+"""
+
+# Every way of looking up players should agree with or without PLAYER_KEY
+LOOKUPS = {
+    'players': [ 'Ana  Lee', 'José Ruiz' ],
+    'prefixes': [ 'Ana  Lee', 'José Ruiz' ],
+    'archetypePlayers': [ [ 'ANA', 'Ana' ], [ 'ANA LEE', 'Ana  Lee' ], [ 'BEN KIM', 'Ben Kim' ],
+        [ 'JOSÉ RUIZ', 'José Ruiz' ] ],
+    'records': [ 'ANA', 'ANA LEE', 'BEN KIM', 'JOSÉ RUIZ' ],
+    'matches': [ 'ANA', 'ANA LEE', 'BEN KIM', 'JOSÉ RUIZ' ],
+    'field': 2,
+}
+
+# Opponents are matched to players by player key
+CHALLENGE = """Player\tDeck\tRound 1\tResult
+Ana\tDelver\tben  kim\t2-1
+Ben Kim\tLands\tAna\t1-2
+"""
+
+class InsertTest(unittest.TestCase):
+    def insert(self, migrated):
+        """Insert one tournament through insert_ldcp and one through a
+        BulkWriter, returning row counts for the tables that exist and the
+        results of looking up players in various ways."""
+        with tempfile.TemporaryDirectory() as directory:
+            db = sqlite3.connect(os.path.join(directory, 'test.db'))
+            with open(SCHEMA) as schema:
+                db.executescript(schema.read())
+            if not migrated:
+                # The schema as it was before metatools.migrate added to it
+                db.executescript("""drop table ArchetypeTotals; drop table MatchupCube;
+                    drop index Deck_playerKey; alter table Deck drop column PLAYER_KEY;""")
+            db.close()
+            with open(os.path.join(directory, 'config.ini'), 'w') as config:
+                config.write('[database]\nconnection = sqlite+pysqlite:///'
+                        + os.path.join(directory, 'test.db') + '\n')
+            with open(os.path.join(directory, 'Legacy Challenge 5_4_2024.tsv'), 'w') as file:
+                file.write(CHALLENGE)
+            env = dict(os.environ, TMI_CONFIG=os.path.join(directory, 'config.ini'),
+                    PYTHONPATH=ROOT)
+            result = subprocess.run([ sys.executable, '-c', INSERT, directory ], cwd=ROOT,
+                    env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    universal_newlines=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def testUnmigrated(self):
+        result = self.insert(migrated=False)
+        self.assertEqual(result['counts'], { 'Deck': 4, 'Matches': 4 })
+        self.assertEqual(result['lookups'], LOOKUPS)
+
+    def testMigrated(self):
+        result = self.insert(migrated=True)
+        self.assertEqual(result['lookups'], LOOKUPS)
+        counts = result['counts']
+        self.assertEqual(counts['Deck'], 4)
+        self.assertEqual(counts['Matches'], 4)
+        self.assertEqual(counts['ArchetypeTotals'], 4)
+        self.assertGreater(counts['MatchupCube'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
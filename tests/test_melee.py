@@ -0,0 +1,170 @@
+import asyncio
+import os
+import re
+import sys
+import unittest
+
+import bs4
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'melee')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import parse_melee
+from melee_http import Fetcher, Response
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as file:
+        return file.read()
+
+class StubTransport(object):
+    """Serves recorded pages. failures maps a URL and start offset to the
+    statuses of its first few responses."""
+
+    def __init__(self, failures=None, delay=0.005):
+        self.failures = { key: list(statuses) for key, statuses in (failures or {}).items() }
+        self.delay = delay
+        self.requests = []
+        self.inFlight = 0
+        self.maxInFlight = 0
+
+    async def request(self, method, url, headers=None, data=None, allow_redirects=True):
+        start = (data or {}).get('start')
+        self.requests.append((url, start, asyncio.get_event_loop().time()))
+        self.inFlight += 1
+        self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.inFlight -= 1
+        statuses = self.failures.get((url, start))
+        if statuses:
+            status = statuses.pop(0)
+            return Response(url, status, {'Retry-After': '0'} if status == 429 else {}, '')
+        return Response(url, 200, {}, self.body(url, start))
+
+    def body(self, url, start):
+        path = url.split('melee.gg/')[1]
+        if path.startswith('Tournament/View/'):
+            return fixture('tournament.html')
+        if path.startswith('Decklist/View/'):
+            return fixture('decklist-copy.html')
+        if path == 'Standing/GetRoundStandings':
+            # Only the last complete round's standings were recorded
+            return fixture(f'standings-102-{start}.json')
+        if path.startswith('Match/GetRoundMatches/'):
+            return fixture(f'matches-{path.rsplit("/", 1)[1]}-{start}.json')
+        raise Exception(f'No fixture for {url}')
+
+STANDINGS = 'https://melee.gg/Standing/GetRoundStandings'
+MATCHES = 'https://melee.gg/Match/GetRoundMatches/102'
+
+class FetchTournamentTest(unittest.TestCase):
+    def fetch(self, transport, **kwargs):
+        fetcher = Fetcher(transport, rate=None, **kwargs)
+        return parse_melee.run(parse_melee.fetch_tournament_data, 1, allow_incomplete=True,
+                decklists=True, fetcher=fetcher)
+
+    def testPagination(self):
+        transport = StubTransport()
+        players, rounds, results = self.fetch(transport)
+        self.assertEqual([ r['id'] for r in rounds ], [ 101, 102 ])
+        self.assertEqual(len(players), 27)
+        self.assertEqual([ p['place'] for p in players ], list(range(1, 28)))
+        self.assertEqual(players[26]['player'], 'Alex Kim')
+        self.assertEqual(players[26]['archetype'], 'Unknown')
+        self.assertNotIn('decklist', players[26])
+        self.assertTrue(players[0]['decklist'].startswith('4 Brainstorm\r\n'))
+        standingsPages = sorted(start for url, start, t in transport.requests if url == STANDINGS)
+        self.assertEqual(standingsPages, [ '0', '25' ])
+        for roundIndex in (1, 2):
+            self.assertEqual(len(results[roundIndex]), 14)
+            paired = [ p for r in results[roundIndex] for p in r[:2] if p is not None ]
+            self.assertEqual(sorted(paired), sorted(p['id'] for p in players))
+        rows, header = parse_melee.tournament_rows(players, rounds, results)
+        self.assertEqual(header, [ 'Player', 'Archetype', 'Round 1', '', 'Round 2', '' ])
+        self.assertEqual(len(rows), 27)
+
+    def testRetries(self):
+        transport = StubTransport(failures={ (STANDINGS, '25'): [ 429 ], (MATCHES, '0'): [ 503 ] })
+        backoff = 0.02
+        players, rounds, results = self.fetch(transport, backoff=backoff)
+        self.assertEqual(len(players), 27)
+        self.assertEqual(len(results[2]), 14)
+        for url, start in ((STANDINGS, '25'), (MATCHES, '0')):
+            times = [ t for u, s, t in transport.requests if (u, s) == (url, start) ]
+            self.assertEqual(len(times), 2)
+        # The 503 waits out the backoff (jittered to at least half of it)
+        first, second = [ t for u, s, t in transport.requests if (u, s) == (MATCHES, '0') ]
+        self.assertGreaterEqual(second - first, transport.delay + backoff / 2)
+
+    def testGivesUp(self):
+        transport = StubTransport(failures={ (STANDINGS, '0'): [ 503 ] * 3 })
+        with self.assertRaises(Exception) as raised:
+            self.fetch(transport, retries=2, backoff=0)
+        self.assertIn('failed after 3 attempts', str(raised.exception))
+        self.assertEqual(sum(1 for u, s, t in transport.requests if (u, s) == (STANDINGS, '0')), 3)
+
+    def testConcurrencyBound(self):
+        transport = StubTransport()
+        self.fetch(transport, concurrency=4)
+        self.assertEqual(transport.maxInFlight, 4)
+        # One tournament page, two pages of standings, one page of matches per
+        # round and one decklist for each player who submitted one
+        self.assertEqual(len(transport.requests), 1 + 2 + 2 + 26)
+
+def soupDecklist(page):
+    """The decklist as found by parsing the whole page with BeautifulSoup,
+    which is how decklist pages used to be read."""
+    soup = bs4.BeautifulSoup(page, 'html.parser')
+    copyButton = soup.find('button', class_='decklist-builder-copy-button')
+    if copyButton is not None and copyButton.has_attr('data-clipboard-text'):
+        return re.sub('^Deck\r?\n', '', copyButton['data-clipboard-text'])
+    container = soup.find('div', class_='decklist-container')
+    if container is None:
+        return None
+    maindeck = []
+    sideboard = []
+    for category in container.find_all('div', class_='decklist-category'):
+        title = category.find('div', class_='decklist-category-title').text.strip()
+        for entry in category.find_all('div', class_='decklist-record'):
+            quantity = entry.find('span', class_='decklist-record-quantity')
+            name = entry.find('a', class_='decklist-record-name')
+            if quantity is None or name is None:
+                continue
+            line = quantity.text.strip() + ' ' + name.text.strip()
+            if title.startswith('Sideboard') or title.startswith('Companion'):
+                sideboard.append(line)
+            else:
+                maindeck.append(line)
+    if not maindeck:
+        return None
+    return '\r\n'.join(maindeck + [ '', 'Sideboard' ] + sideboard + [ '' ])
+
+class ParseDecklistTest(unittest.TestCase):
+    def parse(self, name):
+        page = fixture(name)
+        decklist = parse_melee.parse_decklist(page, name)
+        self.assertEqual(decklist, soupDecklist(page))
+        return decklist
+
+    def testCopyButton(self):
+        self.assertEqual(self.parse('decklist-copy.html'), '4 Brainstorm\r\n4 Ponder\r\n'
+                '4 Dark Ritual\r\n1 Doomsday\r\n1 Thassa\'s Oracle\r\n\r\nSideboard\r\n'
+                '2 Flusterstorm\r\n1 Hydroblast')
+
+    def testRecords(self):
+        self.assertEqual(self.parse('decklist-records.html'), '2 Dark Depths\r\n'
+                '1 Thespian\'s Stage\r\n1 Urza\'s Saga\r\n4 Exploration\r\n\r\nSideboard\r\n'
+                '2 Force of Vigor\r\n1 Lurrus of the Dream-Den\r\n')
+
+    def testCopyButtonWithoutText(self):
+        # Falls back to the individual entries rather than failing
+        self.assertEqual(self.parse('decklist-nocopy.html'),
+                '4 Brainstorm\r\n4 Dark Ritual\r\n\r\nSideboard\r\n')
+
+    def testIgnoresCommentsAndScripts(self):
+        self.assertEqual(self.parse('decklist-hidden.html'), '4 Painter\'s Servant\r\n'
+                '4 Grindstone\r\n\r\nSideboard\r\n3 Red Elemental Blast')
+
+if __name__ == '__main__':
+    unittest.main()
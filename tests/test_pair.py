@@ -0,0 +1,49 @@
+import random
+import unittest
+
+from metatools import pair
+
+def playedFunction(games):
+    played = { frozenset(g) for g in games }
+    return lambda p1, p2: frozenset((p1, p2)) in played
+
+def canPair(players, alreadyPlayed):
+    """Brute force: is there any pairing of the players without rematches?"""
+    if not players:
+        return True
+    first, rest = players[0], players[1:]
+    return any(not alreadyPlayed(first, p) and canPair([ q for q in rest if q != p ], alreadyPlayed)
+            for p in rest)
+
+class PairTest(unittest.TestCase):
+    def testPairsWithinHalf(self):
+        # A and B have each played both C and D, so the only rematch-free
+        # pairing takes both players from the same half of the bracket
+        alreadyPlayed = playedFunction([ 'AC', 'AD', 'BC', 'BD' ])
+        matches = []
+        self.assertTrue(pair.pair([ 'A', 'B', 'C', 'D' ], matches, alreadyPlayed))
+        self.assertEqual(matches, [ 'A', 'B', 'C', 'D' ])
+
+    def testNoRematchesWhenPossible(self):
+        rng = random.Random(0)
+        for trial in range(500):
+            players = list(range(rng.choice([ 4, 6, 8, 10 ])))
+            density = rng.random() * 0.7
+            games = [ (p, q) for p in players for q in players
+                    if p < q and rng.random() < density ]
+            alreadyPlayed = playedFunction(games)
+            if not canPair(players, alreadyPlayed):
+                continue
+            matches = []
+            self.assertTrue(pair.pair(players, matches, alreadyPlayed), games)
+            self.assertEqual(sorted(matches), players)
+            score = { p: rng.randint(0, 2) for p in players }
+            ranked = sorted(players, key=lambda p: -score[p])
+            opponents = { p: [ q for q in players if alreadyPlayed(p, q) ] for p in players }
+            pairs, unpaired = pair.swissPair(ranked, score.get, opponents.get)
+            self.assertEqual(unpaired, [])
+            self.assertEqual(sorted(p for pairing in pairs for p in pairing), players)
+            self.assertFalse(any(alreadyPlayed(p1, p2) for p1, p2 in pairs), games)
+
+if __name__ == '__main__':
+    unittest.main()